@@ -0,0 +1,5 @@
+# This package contains benchmarks for the Medalytik project.
+#
+# They do not need a running crawl or database and can be invoked from inside the Medalytik project with:
+#
+#     python -m Medalytik.benchmarks.<benchmark>
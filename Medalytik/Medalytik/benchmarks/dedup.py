@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+#
+#  dedup.py
+#  Medalytik
+#
+#  Measures the cost of detecting already stored jobs in the MongoDBPipeline.
+#
+#  Every synthetic job is looked up in the index and stored if it is new.
+#  One in four jobs is a duplicate found with another query, just like a multi query run of 'usz' or 'amedes'.
+#  The cost per item should stay flat, no matter how many jobs have been stored.
+#
+#      python -m Medalytik.benchmarks.dedup
+#
+
+import time
+
+from ..items import Job
+from ..pipelines import StoredJobIndex
+
+SIZES = [1000, 10000, 100000]
+
+
+def synthetic_jobs(count):
+    jobs = []
+    for i in range(count):
+        # Every fourth job repeats the job before the last one.
+        identity = i - 3 if i % 4 == 3 else i
+        job = Job()
+        job['website_name'] = 'Website %d' % (identity % 8)
+        job['title'] = 'Job %d' % identity
+        job['date_availability'] = 'nach Vereinbarung'
+        job['regions'] = 'Zürich'
+        job['queries'] = ['Query %d' % (i % 50)]
+        jobs.append(job)
+    return jobs
+
+
+def run(count):
+    jobs = synthetic_jobs(count)
+    index = StoredJobIndex()
+
+    start = time.perf_counter()
+    for _id, job in enumerate(jobs):
+        stored_job = index.get(job)
+        if stored_job is None:
+            index.add(job, _id, job['queries'])
+        else:
+            stored_job.merge_query_ids(job['queries'])
+    elapsed = time.perf_counter() - start
+
+    return elapsed, len(index)
+
+
+def main():
+    print('%10s %10s %12s %14s' % ('items', 'stored', 'total (s)', 'per item (us)'))
+    for count in SIZES:
+        elapsed, stored = run(count)
+        print('%10d %10d %12.4f %14.3f' % (count, stored, elapsed, elapsed / count * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+#
+#  indexes.py
+#  Medalytik
+#
+#  Reports the query plans of the MongoDBPipeline lookups before and after the indexes have been created.
+#
+#  A scratch database is filled with synthetic documents, every lookup of the pipeline is explained,
+#  the indexes are created and every lookup is explained again.
+#  Needs a running Mongo server, the scratch database is dropped afterwards.
+#
+#      python -m Medalytik.benchmarks.indexes --uri mongodb://localhost:27017
+#
+
+import argparse
+from datetime import datetime
+
+import pymongo
+
+from ..indexes import INDEXES, create_index
+
+DATABASE_NAME = 'MedalytikIndexBenchmark'
+
+
+def fill(db, count):
+    today = datetime.combine(datetime.now().date(), datetime.min.time())
+    website_ids = db.Websites.insert_many([
+        {'name': 'Website %d' % i, 'last_updated_date': today} for i in range(8)
+    ]).inserted_ids
+    db.Regions.insert_many([{'name': 'Region %d' % i, 'last_updated_date': today} for i in range(count // 100)])
+    db.Queries.insert_many([{'name': 'Query %d' % i, 'last_updated_date': today} for i in range(count // 100)])
+    db.Contacts.insert_many([
+        {'name': 'Contact %d' % i, 'phone': str(i), 'field': 'Field', 'email': '%d@example.com' % i,
+         'last_updated_date': today} for i in range(count // 10)
+    ])
+    db.Jobs.insert_many([
+        {'website_id': website_ids[i % 8], 'title': 'Job %d' % i, 'last_updated_date': today} for i in range(count)
+    ])
+    return website_ids
+
+
+def lookups(website_ids, count):
+    """:return: The lookups of the pipeline as (collection name, query) tuples."""
+    today = datetime.combine(datetime.now().date(), datetime.min.time())
+    return [
+        ('Jobs', {'website_id': website_ids[1], 'title': 'Job %d' % (count - 7)}),
+        ('Jobs', {'website_id': website_ids[1], 'last_updated_date': {'$gte': today}, 'active': {'$ne': True}}),
+        ('Websites', {'name': 'Website 1'}),
+        ('Regions', {'name': 'Region 1'}),
+        ('Queries', {'name': 'Query 1'}),
+        ('Contacts', {'name': 'Contact 1', 'phone': '1', 'field': 'Field', 'email': '1@example.com'}),
+        ('Contacts', {'last_updated_date': {'$lt': today}}),
+    ]
+
+
+def plan(db, collection_name, query):
+    """:return: A short description of the winning plan and the number of examined documents."""
+    explanation = db[collection_name].find(query).explain()
+    stage = explanation['queryPlanner']['winningPlan']
+    stages = []
+    while stage is not None:
+        stages.append(stage['stage'] + (' ' + stage['indexName'] if 'indexName' in stage else ''))
+        stage = stage.get('inputStage')
+    examined = explanation.get('executionStats', {}).get('totalDocsExamined', '?')
+    return ' <- '.join(stages), examined
+
+
+def report(db, website_ids, count):
+    for collection_name, query in lookups(website_ids, count):
+        stages, examined = plan(db, collection_name, query)
+        print('  %-9s %-70s %10s docs  %s' % (collection_name, sorted(query), examined, stages))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--uri', default='mongodb://localhost:27017')
+    parser.add_argument('--documents', type=int, default=100000)
+    args = parser.parse_args()
+
+    client = pymongo.MongoClient(args.uri)
+    db = client[DATABASE_NAME]
+    client.drop_database(DATABASE_NAME)
+
+    try:
+        website_ids = fill(db, args.documents)
+
+        print('Before:')
+        report(db, website_ids, args.documents)
+
+        for collection_name, keys, unique in INDEXES:
+            create_index(db[collection_name], keys, unique)
+
+        print('After:')
+        report(db, website_ids, args.documents)
+    finally:
+        client.drop_database(DATABASE_NAME)
+        client.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+#
+#  obsolete.py
+#  Medalytik
+#
+#  Measures the obsolete pass the MongoDBPipeline runs over the Jobs collection when the spider closes.
+#
+#  A scratch database is filled with synthetic jobs spread over a few websites,
+#  a part of them updated today and the rest on older days.
+#  Needs a running Mongo server, the scratch database is dropped afterwards.
+#
+#      python -m Medalytik.benchmarks.obsolete --uri mongodb://localhost:27017 --jobs 500000
+#
+#  Pass --legacy to also time the former implementation, which updates every job on its own.
+#  Pass --indexes to create the indexes of the pipeline first.
+#
+
+import argparse
+from datetime import datetime, timedelta
+import time
+
+import pymongo
+
+from ..indexes import ensure_indexes
+from ..pipelines import MongoDBPipeline, time_format
+
+DATABASE_NAME = 'MedalytikObsoleteBenchmark'
+
+
+def fill(db, jobs, websites):
+    today = datetime.combine(datetime.now().date(), datetime.min.time())
+    dates = [today - timedelta(days=i) for i in range(30)]
+    days = [date.strftime(time_format) for date in dates]
+
+    website_ids = db.Websites.insert_many([
+        {'name': 'Website %d' % i, 'last_updated': days[0], 'last_updated_date': dates[0]} for i in range(websites)
+    ]).inserted_ids
+
+    batch = []
+    for i in range(jobs):
+        # A third of the jobs has been seen today.
+        day = 0 if i % 3 == 0 else i % len(days)
+        batch.append({
+            'title': 'Job %d' % i,
+            'website_id': website_ids[i % websites],
+            'last_updated': days[day],
+            'last_updated_date': dates[day],
+            'active': i % 2 == 0,
+        })
+        if len(batch) == 10000:
+            db.Jobs.insert_many(batch)
+            batch = []
+    if batch:
+        db.Jobs.insert_many(batch)
+
+
+def legacy_obsolete_items(db):
+    for job in db.Jobs.find():
+        website = db.Websites.find_one({'_id': job['website_id']})
+        if not website:
+            active = job['last_updated'] == datetime.now().strftime(time_format)
+        else:
+            active = website['last_updated'] == job['last_updated']
+        db.Jobs.update_one({'_id': job['_id']}, {'$set': {'active': active}})
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--uri', default='mongodb://localhost:27017')
+    parser.add_argument('--jobs', type=int, default=500000)
+    parser.add_argument('--websites', type=int, default=8)
+    parser.add_argument('--legacy', action='store_true')
+    parser.add_argument('--indexes', action='store_true')
+    args = parser.parse_args()
+
+    client = pymongo.MongoClient(args.uri)
+    db = client[DATABASE_NAME]
+    client.drop_database(DATABASE_NAME)
+
+    try:
+        print('Filling %d jobs over %d websites...' % (args.jobs, args.websites))
+        fill(db, args.jobs, args.websites)
+        if args.indexes:
+            ensure_indexes(db)
+
+        pipeline = MongoDBPipeline(args.uri, args.uri, DATABASE_NAME, DATABASE_NAME)
+
+        start = time.perf_counter()
+        pipeline.obsolete_items(db)
+        print('%-10s %10.2f s' % ('current', time.perf_counter() - start))
+
+        # The second run has nothing left to change.
+        start = time.perf_counter()
+        pipeline.obsolete_items(db)
+        print('%-10s %10.2f s' % ('unchanged', time.perf_counter() - start))
+
+        if args.legacy:
+            start = time.perf_counter()
+            legacy_obsolete_items(db)
+            print('%-10s %10.2f s' % ('legacy', time.perf_counter() - start))
+    finally:
+        client.drop_database(DATABASE_NAME)
+        client.close()
+
+
+if __name__ == '__main__':
+    main()
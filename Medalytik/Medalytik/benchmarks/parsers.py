@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+#
+#  parsers.py
+#  Medalytik
+#
+#  Measures the parse times of the spider callbacks on the recorded corpus, see replay.py.
+#
+#  Every corpus is replayed several times and the fastest run is reported,
+#  so XPath regressions show up as a drop in pages/s or a rise in ms/item of a callback.
+#
+#      python -m Medalytik.benchmarks.parsers --repeat 5
+#      python -m Medalytik.benchmarks.parsers synlab usz
+#
+
+import argparse
+import os
+
+from scrapy.spiderloader import SpiderLoader
+from scrapy.utils.project import get_project_settings
+
+from ..replay import DEFAULT_CORPUS_DIR, Replay, report
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('spiders', nargs='*', help='Defaults to all spiders with a corpus.')
+    parser.add_argument('--corpus', default=DEFAULT_CORPUS_DIR)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    spider_loader = SpiderLoader.from_settings(get_project_settings())
+    spiders = args.spiders or sorted(name[:-len('.jsonl.gz')] for name in os.listdir(args.corpus)
+                                     if name.endswith('.jsonl.gz'))
+    for spider_name in spiders:
+        replay = Replay(spider_loader.load(spider_name), args.corpus)
+        best = None
+        for _ in range(args.repeat):
+            _, missing, stats = replay.run()
+            seconds = sum(callback_stats.seconds for callback_stats in stats.values())
+            if best is None or seconds < best[0]:
+                best = (seconds, missing, stats)
+        report(spider_name, best[2], best[1])
+
+
+if __name__ == '__main__':
+    main()
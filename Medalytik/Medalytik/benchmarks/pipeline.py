@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+#
+#  pipeline.py
+#  Medalytik
+#
+#  Measures the throughput of the MongoDBPipeline without any service running.
+#
+#  Synthetic jobs are written with the embedded storage backend and a static geocoder,
+#  the first run fills the empty databases, the second one updates the jobs of the first, like a crawl on the next day.
+#
+#      python -m Medalytik.benchmarks.pipeline --jobs 10000
+#      python -m Medalytik.benchmarks.pipeline --jobs 10000 --bulk-write
+#
+
+import argparse
+import cProfile
+import pstats
+import time
+
+from ..geocoding import GeocodeCache, GeocodeResult, StaticResolver
+from ..items import Job
+from ..pipelines import MongoDBPipeline
+from ..storage import EmbeddedBackend
+
+REGIONS = ['Zürich', 'Bern', 'Berlin', 'Halle', 'Gauting', 'München', 'Köln', 'Hamburg']
+
+
+def synthetic_jobs(count):
+    jobs = []
+    for i in range(count):
+        # Every fourth job repeats the job before the last one, found with another query.
+        identity = i - 3 if i % 4 == 3 else i
+        job = Job()
+        job['in_development'] = True
+        job['website_name'] = 'Website %d' % (identity % 8)
+        job['website_url'] = 'https://example.com/%d' % (identity % 8)
+        job['title'] = 'Job %d' % identity
+        job['regions'] = REGIONS[identity % len(REGIONS)]
+        job['queries'] = ['Query %d' % (i % 50)]
+        job['contact_name'] = 'Contact %d' % (identity % 100)
+        job['desc'] = 'Description %d ' % identity * 20
+        job['requirements'] = 'Requirements %d ' % identity * 20
+        jobs.append(job)
+    return jobs
+
+
+def geocode_cache():
+    cache = GeocodeCache(':memory:', StaticResolver())
+    for i, region in enumerate(REGIONS):
+        cache.put(region, GeocodeResult(47.0 + i, 8.0 + i, region, None))
+    return cache
+
+
+def run(jobs, bulk_write):
+    pipeline = MongoDBPipeline('embedded', 'embedded', 'MedalytikBenchmark', 'MedalytikBenchmark',
+                               bulk_write_enabled=bulk_write, geocode_cache=geocode_cache(),
+                               storage_backend=EmbeddedBackend())
+    pipeline.open_spider(None)
+    start = time.perf_counter()
+    for job in jobs:
+        pipeline.process_item(job, None)
+    elapsed = time.perf_counter() - start
+    pipeline.close_spider(None)
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--jobs', type=int, default=10000)
+    parser.add_argument('--bulk-write', action='store_true')
+    parser.add_argument('--profile', action='store_true', help='Print the functions the first run spends most time in.')
+    args = parser.parse_args()
+
+    jobs = synthetic_jobs(args.jobs)
+    for name in ('first', 'second'):
+        if args.profile and name == 'first':
+            profile = cProfile.Profile()
+            elapsed = profile.runcall(run, jobs, args.bulk_write)
+            pstats.Stats(profile).sort_stats('cumulative').print_stats(20)
+        else:
+            elapsed = run(jobs, args.bulk_write)
+        print('%-8s %8d items %10.2f s %10.0f items/s' % (name, len(jobs), elapsed, len(jobs) / elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+#
+#  sections.py
+#  Medalytik
+#
+#  Measures the extraction of the panel sections of the Synlab detail pages.
+#      - rescan       looks up every field separately and walks all panels of the job ad again for each of them,
+#                     how the spider extracted the sections before the section map
+#      - section map  SynlabSpider.section_map walks the panels once and the fields are looked up in the map
+#
+#  The detail pages are taken from the recorded Synlab corpus if there is one (see replay.py),
+#  otherwise a synthetic page with the panels the spider expects is used.
+#
+#      python -m Medalytik.benchmarks.sections --pages 2000
+#
+
+import argparse
+import base64
+import gzip
+import json
+import os
+import time
+
+from scrapy.http import HtmlResponse
+
+from ..replay import DEFAULT_CORPUS_DIR, corpus_path
+from ..spiders.synlab import SynlabSpider
+
+# The headings of the fields, in the order the spider looks them up.
+FIELD_HEADINGS = [
+    "Das sind Ihre Aufgaben",
+    "Das bringen Sie mit",
+    "Das können Sie von uns erwarten",
+    "Kontakt & Bewerbung",
+]
+
+PANEL = '''<div class="col-sm-12"><div class="panel">
+    <div class="panel-heading"><h3>%s:</h3></div>
+    <div class="panel-body"><ul>%s</ul></div>
+</div></div>'''
+
+SYNTHETIC_PAGE = '<html><body><div id="jobad">%s</div></body></html>' % ''.join(
+    PANEL % (heading, ''.join('<li>Punkt %d</li>' % i for i in range(10)))
+    for heading in ["Ihr Arbeitsplatz", "Über uns"] + FIELD_HEADINGS
+)
+
+
+def recorded_pages(directory, limit):
+    """:return: Up to 'limit' recorded Synlab detail pages, the pages of the search API are left out."""
+    path = corpus_path(directory, SynlabSpider.name)
+    if not os.path.exists(path):
+        return []
+    responses = []
+    with gzip.open(path, 'rt', encoding='utf-8') as file:
+        next(file)
+        for line in file:
+            record = json.loads(line)
+            if record['url'].startswith(SynlabSpider.url):
+                continue
+            responses.append(HtmlResponse(record['url'], body=base64.b64decode(record['body']), encoding='utf-8'))
+            if len(responses) == limit:
+                break
+    return responses
+
+
+def rescan(response):
+    """Looks up each heading by walking all panels again."""
+    texts = []
+    for name in FIELD_HEADINGS:
+        for division in response.xpath('//div[@id="jobad"]//div[@class="col-sm-12"]'):
+            title = division.xpath('string(.//div[@class="panel-heading"])').extract_first().strip().rstrip(':')
+            if title.casefold() == name.casefold():
+                texts.append(division.xpath('string(.//div[@class="panel-body"])').extract_first())
+                break
+        else:
+            texts.append(None)
+    return texts
+
+
+def section_map(response):
+    sections = SynlabSpider.section_map(response)
+    return [SynlabSpider.get_section(sections, [name]) for name in FIELD_HEADINGS]
+
+
+def measure(responses, extract, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for response in responses:
+            extract(response)
+    return (time.perf_counter() - start) / (repeat * len(responses))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pages', type=int, default=1000, help='Number of pages extracted per method.')
+    parser.add_argument('--corpus', default=DEFAULT_CORPUS_DIR)
+    args = parser.parse_args()
+
+    responses = recorded_pages(args.corpus, 200)
+    source = 'recorded'
+    if not responses:
+        responses = [HtmlResponse('https://www.karriere-synlab.de/job', body=SYNTHETIC_PAGE, encoding='utf-8')]
+        source = 'synthetic'
+    # Parses the documents before measuring.
+    for response in responses:
+        if rescan(response) != section_map(response):
+            print('The section map differs from the rescan on %s' % response.url)
+
+    repeat = max(1, args.pages // len(responses))
+    rescan_seconds = measure(responses, rescan, repeat)
+    map_seconds = measure(responses, section_map, repeat)
+    print('%d %s pages' % (len(responses), source))
+    print('  rescan       %8.1f us/page' % (1e6 * rescan_seconds))
+    print('  section map  %8.1f us/page, %.0f%% saved' % (1e6 * map_seconds, 100 * (1 - map_seconds / rescan_seconds)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+#
+#  clients.py
+#  Medalytik
+#
+#  Process wide registry of Mongo clients.
+#
+#  Every spider running in the same process shares one client, and with it one connection pool, per uri.
+#  Clients are reference counted and closed once the last spider using them has released them.
+#  The pymongo and the Motor clients of a uri are registered separately, pass the class with 'client_class'.
+#
+
+import threading
+
+import pymongo
+
+# (client class, uri) -> [client, reference count]
+_clients = {}
+_lock = threading.Lock()
+
+
+def acquire_client(uri, max_pool_size=100, client_class=pymongo.MongoClient):
+    """
+    Returns the client for the uri, creating it if no spider uses it yet.
+    Every acquired client has to be released with 'release_client'.
+    :param max_pool_size: The size of the connection pool, only used when the client is created.
+    :param client_class: The class of the client, like pymongo.MongoClient or Motor's AsyncIOMotorClient.
+    """
+    with _lock:
+        entry = _clients.get((client_class, uri))
+        if entry is None:
+            entry = [client_class(uri, maxPoolSize=max_pool_size), 0]
+            _clients[(client_class, uri)] = entry
+        entry[1] += 1
+        return entry[0]
+
+
+def release_client(uri, client_class=pymongo.MongoClient):
+    """Releases a client acquired with 'acquire_client'. The client is closed once it is not used anymore."""
+    with _lock:
+        entry = _clients.get((client_class, uri))
+        if entry is None:
+            return
+        entry[1] -= 1
+        if entry[1] <= 0:
+            del _clients[(client_class, uri)]
+            entry[0].close()
+
+
+def reference_count(uri, client_class=pymongo.MongoClient):
+    """:return: The number of users of the client for the uri."""
+    with _lock:
+        entry = _clients.get((client_class, uri))
+        return entry[1] if entry is not None else 0
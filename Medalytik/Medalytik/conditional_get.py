@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+#
+#  conditional_get.py
+#  Medalytik
+#
+#  The validators of the fetched detail pages.
+#
+#  For every detail page the ETag and Last-Modified headers are stored along with the fields of the job
+#  parsed from it. The ConditionalGetMiddleware sends them back as If-None-Match and If-Modified-Since,
+#  if the server answers with '304 Not Modified' the stored fields are used instead of parsing the page again.
+#
+#  The downloader and the spider middleware of a crawl share the store of their path, see 'acquire_store'.
+#
+
+import json
+
+from .storage import SQLiteStore, sqlite_path
+
+class ValidatorStore(SQLiteStore):
+    """
+    Persistent store of the validators and job fields by url, stored in a SQLite file.
+    Pass ':memory:' as path to keep the store for the current process only.
+    """
+
+    TABLE = 'validators'
+    COLUMNS = 'url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, job TEXT'
+
+    def get(self, url):
+        """:return: A tuple (etag, last modified, job fields) or None if the page has not been stored."""
+        row = self.connection.execute(
+            'SELECT etag, last_modified, job FROM validators WHERE url = ?', (url,)
+        ).fetchone()
+        if row is None:
+            return None
+        return row[0], row[1], json.loads(row[2])
+
+    def put(self, url, etag, last_modified, job_fields):
+        """Stores the validators of the page at 'url' and the fields of the job parsed from it."""
+        self.connection.execute(
+            'INSERT OR REPLACE INTO validators VALUES (?, ?, ?, ?)',
+            (url, etag, last_modified, json.dumps(job_fields, default=str))
+        )
+        self.written()
+
+    def delete(self, url):
+        self.connection.execute('DELETE FROM validators WHERE url = ?', (url,))
+
+
+# path -> [store, reference count]
+_stores = {}
+
+
+def conditional_get_store_path(settings):
+    return sqlite_path(settings.get('CONDITIONAL_GET_STORE_PATH', 'validators.sqlite'))
+
+
+def acquire_store(path):
+    """
+    Returns the store at the path, opening it if it is not used yet.
+    Every acquired store has to be released with 'release_store'.
+    """
+    entry = _stores.get(path)
+    if entry is None:
+        entry = _stores[path] = [ValidatorStore(path), 0]
+    entry[1] += 1
+    return entry[0]
+
+
+def release_store(path):
+    """Releases a store acquired with 'acquire_store'. The store is closed once it is not used anymore."""
+    entry = _stores.get(path)
+    if entry is None:
+        return
+    entry[1] -= 1
+    if entry[1] <= 0:
+        del _stores[path]
+        entry[0].close()
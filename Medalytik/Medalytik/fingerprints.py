@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+#
+#  fingerprints.py
+#  Medalytik
+#
+#  The request fingerprints of the project, used by the duplicate filter and the HTTP cache.
+#
+#  Two requests have the same fingerprint if they ask for the same page:
+#      - the method and the canonical url, the arguments of the query string are sorted and their encoding normalized,
+#        so the search urls the spiders build ('url_from_query', 'SynlabSpider.url_from', 'MTADialogSpider.query_url')
+#        match however their arguments are ordered and escaped
+#      - the body, form bodies are normalized the same way, the USZ listing pages only differ in their form data
+#      - the cookie session from meta['cookiejar'], sites like MTA Dialog keep the search in the session
+#
+#  With these fingerprints the spiders no longer need 'dont_filter=True', duplicate requests are filtered.
+#  Only requests whose response depends on the state of the session, like the 'next' page of MTA Dialog,
+#  still have to set it.
+#
+#  RequestFingerprinter is set as REQUEST_FINGERPRINTER_CLASS, JobBoardDupeFilter as DUPEFILTER_CLASS.
+#  The duplicate filter uses the same fingerprints on versions of Scrapy without fingerprinter classes
+#  and counts the filtered detail and listing requests in the stats.
+#
+
+import hashlib
+from urllib.parse import parse_qsl, urlencode
+from weakref import WeakKeyDictionary
+
+from scrapy.dupefilters import RFPDupeFilter
+from w3lib.url import canonicalize_url
+
+FORM_CONTENT_TYPE = b'application/x-www-form-urlencoded'
+
+
+def normalized_body(request):
+    """:return: The body of the request, form bodies with their fields sorted."""
+    content_type = request.headers.get('Content-Type') or b''
+    if request.body and content_type.startswith(FORM_CONTENT_TYPE):
+        fields = parse_qsl(request.body.decode(request.encoding), keep_blank_values=True)
+        return urlencode(sorted(fields)).encode('ascii')
+    return request.body
+
+
+def fingerprint(request):
+    """:return: The fingerprint of the request as bytes."""
+    fingerprint_hash = hashlib.sha1()
+    fingerprint_hash.update(request.method.encode('ascii'))
+    fingerprint_hash.update(b'\0' + canonicalize_url(request.url).encode('utf-8'))
+    fingerprint_hash.update(b'\0' + (normalized_body(request) or b''))
+    cookiejar = request.meta.get('cookiejar')
+    if cookiejar is not None:
+        fingerprint_hash.update(b'\0' + str(cookiejar).encode('utf-8'))
+    return fingerprint_hash.digest()
+
+
+class RequestFingerprinter(object):
+    """The request fingerprinter of the project, caches the fingerprint of every request."""
+
+    def __init__(self):
+        self.cache = WeakKeyDictionary()
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls()
+
+    def fingerprint(self, request):
+        if request not in self.cache:
+            self.cache[request] = fingerprint(request)
+        return self.cache[request]
+
+
+class JobBoardDupeFilter(RFPDupeFilter):
+    """Filters duplicate requests by the fingerprints of the project and counts them in the stats."""
+
+    def request_fingerprint(self, request):
+        return fingerprint(request).hex()
+
+    def log(self, request, spider):
+        super(JobBoardDupeFilter, self).log(request, spider)
+        # Detail requests carry the job of the listing page.
+        kind = 'detail' if 'job' in request.meta else 'listing'
+        spider.crawler.stats.inc_value('dupefilter/filtered/%s' % kind, spider=spider)
@@ -0,0 +1,310 @@
+# -*- coding: utf-8 -*-
+#
+#  geocoding.py
+#  Medalytik
+#
+#  Resolves region names to coordinates for the MongoDBPipeline.
+#
+#  Region names are resolved by a resolver (Nominatim by default) and stored in a persistent cache,
+#  so each region only has to be geocoded once, no matter how many crawls are run.
+#  The cache is a SQLite file keyed by the normalized region name.
+#
+#  Regions that are not cached yet are resolved by the GeocodeQueue in a thread,
+#  so the reactor keeps downloading while the geocoder is waiting for an answer.
+#
+
+from abc import ABC, abstractmethod
+from collections import namedtuple
+import logging
+import time
+
+from twisted.internet import defer, task, threads
+from twisted.python import failure
+
+from .storage import SQLiteStore
+
+logger = logging.getLogger(__name__)
+
+geolocation_map = {
+    "Halle": "Halle Deutschland",
+    "Gauting": "Gauting Deutschland"
+}
+
+# The result of a geocode lookup.
+GeocodeResult = namedtuple('GeocodeResult', ['latitude', 'longitude', 'address', 'state'])
+
+
+def search_name(region_name):
+    """:return: The name that should be passed to the geocoder for the region."""
+    return geolocation_map.get(region_name, region_name)
+
+
+def normalize_region_name(region_name):
+    """:return: The key the geocode of the region is stored with."""
+    return ' '.join(search_name(region_name).split()).casefold()
+
+
+class GeocodeResolver(ABC):
+    """
+    Resolves a region name to its coordinates.
+    Subclass this to change where the coordinates come from, for example a local stand-in for offline runs.
+    """
+
+    @abstractmethod
+    def geocode(self, region_name):
+        """
+        :param region_name: The name to search for, the geolocation map has already been applied.
+        :return: A GeocodeResult or None if the region could not be found.
+        """
+
+
+class NominatimResolver(GeocodeResolver):
+    """Resolves the regions with the Nominatim service of OpenStreetMap."""
+
+    USER_AGENT = "Medalytik"
+
+    def __init__(self, user_agent=USER_AGENT):
+        # Imported here so offline runs do not depend on geopy.
+        from geopy.geocoders import Nominatim
+        self.geo_locator = Nominatim(user_agent=user_agent)
+
+    def geocode(self, region_name):
+        location = self.geo_locator.geocode(region_name, addressdetails=True)
+        if location is None:
+            return None
+
+        state = None
+        address = location.raw.get('address')
+        if address is not None:
+            state = address.get('state')
+        return GeocodeResult(location.latitude, location.longitude, location.address, state)
+
+
+class StaticResolver(GeocodeResolver):
+    """
+    Resolves the regions from a fixed dictionary, without any network access.
+    Used for tests and offline runs, unknown regions are not found.
+    """
+
+    def __init__(self, locations=None):
+        self.locations = {}
+        for region_name, result in (locations or {}).items():
+            self.locations[normalize_region_name(region_name)] = result
+
+    def geocode(self, region_name):
+        return self.locations.get(normalize_region_name(region_name))
+
+
+class GeocodeCache(SQLiteStore):
+    """
+    Persistent cache of geocode results stored in a SQLite file.
+
+    Regions that could not be found are stored as well, so they are not looked up on every crawl.
+    Pass ':memory:' as path to keep the cache for the current process only.
+    """
+
+    TABLE = 'geocodes'
+    COLUMNS = 'name TEXT PRIMARY KEY, found INTEGER, latitude REAL, longitude REAL, address TEXT, state TEXT'
+
+    def __init__(self, path, resolver):
+        super(GeocodeCache, self).__init__(path)
+        self.resolver = resolver
+
+    def __contains__(self, region_name):
+        row = self.connection.execute(
+            'SELECT 1 FROM geocodes WHERE name = ?', (normalize_region_name(region_name),)
+        ).fetchone()
+        return row is not None
+
+    def get(self, region_name):
+        """
+        :return: A tuple (cached, result). 'cached' is False if the region has never been looked up.
+        """
+        row = self.connection.execute(
+            'SELECT found, latitude, longitude, address, state FROM geocodes WHERE name = ?',
+            (normalize_region_name(region_name),)
+        ).fetchone()
+        if row is None:
+            return False, None
+        if not row[0]:
+            return True, None
+        return True, GeocodeResult(*row[1:])
+
+    def put(self, region_name, result):
+        """Stores the result of a lookup, None marks the region as not found."""
+        self._insert(region_name, result, replace=True)
+        self.commit()
+
+    def _insert(self, region_name, result, replace):
+        if result is None:
+            values = (normalize_region_name(region_name), 0, None, None, None, None)
+        else:
+            values = (normalize_region_name(region_name), 1) + tuple(result)
+        self.connection.execute(
+            ('INSERT OR REPLACE' if replace else 'INSERT OR IGNORE') + ' INTO geocodes VALUES (?, ?, ?, ?, ?, ?)',
+            values
+        )
+
+    def lookup(self, region_name):
+        """
+        Returns the coordinates of the region, asking the resolver only if the region is not cached yet.
+        :return: A GeocodeResult or None if the region could not be found.
+        """
+        cached, result = self.get(region_name)
+        if cached:
+            return result
+
+        result = self.resolver.geocode(search_name(region_name))
+        self.put(region_name, result)
+        return result
+
+    def seed(self, regions, name_field='name', latitude_field='lat', longitude_field='long',
+             address_field='address', state_field='state'):
+        """
+        Fills the cache with already geocoded regions, for example the documents of the 'Regions' collection.
+        Regions without coordinates and regions that are already cached are skipped.
+        :return: The number of regions seeded.
+        """
+        count = 0
+        for region in regions:
+            region_name = region.get(name_field)
+            latitude = region.get(latitude_field)
+            longitude = region.get(longitude_field)
+            if not region_name or latitude in (None, "") or longitude in (None, ""):
+                continue
+            if region_name in self:
+                continue
+            self._insert(region_name,
+                         GeocodeResult(latitude, longitude, region.get(address_field), region.get(state_field)),
+                         replace=False)
+            count += 1
+        self.commit()
+        return count
+
+
+class TokenBucket(object):
+    """
+    Limits the rate of the geocode requests.
+    Tokens are refilled at 'rate' tokens per second, up to 'capacity' tokens.
+    """
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.last_refill = time.time()
+
+    def consume(self):
+        """
+        Takes a token out of the bucket. If the bucket is empty the token is reserved in advance.
+        :return: The number of seconds to wait before the token may be used.
+        """
+        now = time.time()
+        self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
+
+        self.tokens -= 1
+        if self.tokens >= 0:
+            return 0
+        return -self.tokens / self.rate
+
+
+class GeocodeQueue(object):
+    """
+    Resolves the regions that are not cached yet without blocking the reactor.
+
+    Lookups are run in threads by at most 'max_workers' workers and rate limited by a token bucket.
+    Lookups of a region that is already being resolved wait for the running one.
+    The queue depth and the lookup latency are written to the crawl stats, if stats are passed.
+    """
+
+    def __init__(self, cache, max_workers=1, rate=1.0, stats=None):
+        self.cache = cache
+        self.semaphore = defer.DeferredSemaphore(max_workers)
+        self.bucket = TokenBucket(rate)
+        self.stats = stats
+
+        # normalized region name -> deferreds waiting for the lookup
+        self._pending = {}
+
+    @property
+    def depth(self):
+        """:return: The number of regions waiting to be resolved."""
+        return len(self._pending)
+
+    def lookup(self, region_name):
+        """
+        :return: A deferred firing with a GeocodeResult, or None if the region could not be found.
+        """
+        cached, result = self.cache.get(region_name)
+        if cached:
+            return defer.succeed(result)
+
+        key = normalize_region_name(region_name)
+        waiting = defer.Deferred()
+        if key in self._pending:
+            self._pending[key].append(waiting)
+            return waiting
+
+        self._pending[key] = [waiting]
+        self._record_depth()
+        d = self.semaphore.run(self._resolve, region_name)
+        d.addBoth(self._finish, key, region_name)
+        return waiting
+
+    def _resolve(self, region_name):
+        from twisted.internet import reactor
+        delay = self.bucket.consume()
+        return task.deferLater(reactor, delay, self._geocode, region_name)
+
+    def _geocode(self, region_name):
+        start = time.time()
+        d = threads.deferToThread(self.cache.resolver.geocode, search_name(region_name))
+        d.addBoth(self._record_latency, start)
+        return d
+
+    def _finish(self, result, key, region_name):
+        waiting = self._pending.pop(key)
+        self._record_depth()
+
+        if isinstance(result, failure.Failure):
+            # Failed lookups are not cached, they are retried on the next crawl.
+            logger.warning('Failed to geocode %s: %s', region_name, result.getErrorMessage())
+            if self.stats is not None:
+                self.stats.inc_value('geocode/failures')
+            result = None
+        else:
+            self.cache.put(region_name, result)
+
+        for d in waiting:
+            d.callback(result)
+
+    def _record_depth(self):
+        if self.stats is not None:
+            self.stats.set_value('geocode/queue_depth', self.depth)
+            self.stats.max_value('geocode/queue_depth_max', self.depth)
+
+    def _record_latency(self, result, start):
+        if self.stats is not None:
+            latency = time.time() - start
+            self.stats.inc_value('geocode/lookups')
+            self.stats.inc_value('geocode/latency_total', latency)
+            self.stats.max_value('geocode/latency_max', latency)
+            self.stats.set_value('geocode/latency_avg',
+                                 self.stats.get_value('geocode/latency_total') /
+                                 self.stats.get_value('geocode/lookups'))
+        return result
+
+
+def when_done(deferred, value):
+    """
+    :return: A new deferred firing with 'value' once 'deferred' has fired. The result of 'deferred' is not changed.
+    """
+    done = defer.Deferred()
+
+    def fire(result):
+        done.callback(value)
+        return result
+
+    deferred.addBoth(fire)
+    return done
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+#
+#  httpcache.py
+#  Medalytik
+#
+#  The HTTP cache of the job boards, used to work on the parsers without downloading every page again.
+#
+#  SQLiteCacheStorage keeps the responses of every spider in '<HTTPCACHE_DIR>/<spider>.sqlite',
+#  the bodies are compressed with zstd if the 'zstandard' package is installed, otherwise with zlib.
+#  JobBoardCachePolicy decides per request if and how long it is cached:
+#      - HTTPCACHE_RULES is a list of (method, url pattern, expiration) tuples, the first matching rule applies.
+#        An expiration of None never caches the request, 0 never expires it.
+#        Spiders set their own rules in their custom settings.
+#      - Detail requests (see middlewares.is_detail_request) expire after HTTPCACHE_DETAIL_EXPIRATION_SECS.
+#      - All other requests expire after HTTPCACHE_EXPIRATION_SECS.
+#
+
+import logging
+import os
+import re
+import time
+import zlib
+
+from scrapy.extensions.httpcache import DummyPolicy
+from scrapy.http import Headers
+from scrapy.responsetypes import responsetypes
+from scrapy.utils.project import data_path
+from w3lib.http import headers_dict_to_raw, headers_raw_to_dict
+
+from .fingerprints import fingerprint
+from .middlewares import is_detail_request
+from .storage import SQLiteStore
+
+logger = logging.getLogger(__name__)
+
+
+class CacheRules(object):
+    """Resolves the expiration of a request from the cache settings."""
+
+    def __init__(self, settings):
+        self.rules = [
+            (method, re.compile(pattern), expiration)
+            for method, pattern, expiration in settings.getlist('HTTPCACHE_RULES')
+        ]
+        self.detail_expiration = settings.getint('HTTPCACHE_DETAIL_EXPIRATION_SECS', 24 * 60 * 60)
+        self.expiration_secs = settings.getint('HTTPCACHE_EXPIRATION_SECS')
+
+    def expiration(self, request):
+        """:return: The seconds after which the cached response expires, 0 for never, None if it is not cached."""
+        for method, pattern, expiration in self.rules:
+            if (method is None or method == request.method) and pattern.search(request.url):
+                return expiration
+        if is_detail_request(request):
+            return self.detail_expiration
+        return self.expiration_secs
+
+
+class JobBoardCachePolicy(DummyPolicy):
+    """Caches the requests the rules allow. Responses are fresh until they expire in the storage."""
+
+    def __init__(self, settings):
+        super(JobBoardCachePolicy, self).__init__(settings)
+        self.rules = CacheRules(settings)
+
+    def should_cache_request(self, request):
+        return super(JobBoardCachePolicy, self).should_cache_request(request) \
+               and self.rules.expiration(request) is not None
+
+    def should_cache_response(self, response, request):
+        # A '304 Not Modified' of a conditional request has no body to replay.
+        return response.status != 304 and super(JobBoardCachePolicy, self).should_cache_response(response, request)
+
+
+def compress(body, codec):
+    """:return: A tuple (codec, compressed body). Falls back to zlib if zstd is not available."""
+    if codec == 'zstd':
+        try:
+            import zstandard
+        except ImportError:
+            logger.warning('The zstandard package is not installed, compressing the HTTP cache with zlib.')
+            codec = 'zlib'
+        else:
+            return codec, zstandard.ZstdCompressor().compress(body)
+    if codec == 'zlib':
+        return codec, zlib.compress(body)
+    return None, body
+
+
+def decompress(body, codec):
+    if codec == 'zstd':
+        import zstandard
+        return zstandard.ZstdDecompressor().decompress(body)
+    if codec == 'zlib':
+        return zlib.decompress(body)
+    return body
+
+
+class SQLiteCacheStorage(SQLiteStore):
+    """Stores the compressed responses of each spider in a SQLite file, opened with the spider."""
+
+    TABLE = 'responses'
+    COLUMNS = ('fingerprint TEXT PRIMARY KEY, timestamp REAL, url TEXT, status INTEGER, headers BLOB, '
+               'codec TEXT, body BLOB')
+
+    def __init__(self, settings):
+        self.cache_dir = data_path(settings['HTTPCACHE_DIR'], createdir=True)
+        self.codec = settings.get('HTTPCACHE_COMPRESSION', 'zstd')
+        self.rules = CacheRules(settings)
+        self.path = None
+        self.connection = None
+        self.fingerprinter = None
+
+    def open_spider(self, spider):
+        self.open(os.path.join(self.cache_dir, '%s.sqlite' % spider.name))
+        # Newer versions of Scrapy provide the fingerprinter of the crawler.
+        self.fingerprinter = getattr(getattr(spider, 'crawler', None), 'request_fingerprinter', None)
+        logger.debug('Using SQLite cache storage in %s', self.cache_dir, extra={'spider': spider})
+
+    def close_spider(self, spider):
+        self.close()
+
+    def fingerprint(self, request):
+        if self.fingerprinter is not None:
+            return self.fingerprinter.fingerprint(request).hex()
+        return fingerprint(request).hex()
+
+    def retrieve_response(self, spider, request):
+        """:return: The cached response or None if it is not cached or has expired."""
+        row = self.connection.execute(
+            'SELECT timestamp, url, status, headers, codec, body FROM responses WHERE fingerprint = ?',
+            (self.fingerprint(request),)
+        ).fetchone()
+        if row is None:
+            return None
+
+        timestamp, url, status, raw_headers, codec, body = row
+        expiration = self.rules.expiration(request)
+        if expiration is None or 0 < expiration < time.time() - timestamp:
+            return None
+
+        headers = Headers(headers_raw_to_dict(raw_headers))
+        body = decompress(body, codec)
+        response_class = responsetypes.from_args(headers=headers, url=url, body=body)
+        return response_class(url=url, headers=headers, status=status, body=body)
+
+    def store_response(self, spider, request, response):
+        codec, body = compress(response.body, self.codec)
+        # Only warn once about the missing zstd package.
+        self.codec = codec
+        self.connection.execute(
+            'INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (self.fingerprint(request), time.time(), response.url, response.status,
+             headers_dict_to_raw(response.headers), codec, body)
+        )
+        self.written()
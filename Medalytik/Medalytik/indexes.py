@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+#
+#  indexes.py
+#  Medalytik
+#
+#  The indexes the MongoDBPipeline relies on.
+#
+#  Every lookup of the pipeline is an equality match:
+#      - Jobs by website id and title
+#      - Websites, Regions and Queries by name
+#      - Contacts by name, phone, field and email
+#  The obsolete pass queries the 'last updated' date of all collections.
+#
+#  Indexes are unique where the pipeline never stores two documents with the same values.
+#  If existing duplicates prevent a unique index, a regular one is created instead.
+#
+
+import logging
+
+import pymongo
+from pymongo.errors import OperationFailure
+
+logger = logging.getLogger(__name__)
+
+# (collection name, keys, unique)
+INDEXES = [
+    ('Jobs', [('website_id', pymongo.ASCENDING), ('title', pymongo.ASCENDING)], True),
+    ('Jobs', [('website_id', pymongo.ASCENDING), ('last_updated_date', pymongo.ASCENDING)], False),
+    ('Websites', [('name', pymongo.ASCENDING)], True),
+    ('Websites', [('last_updated_date', pymongo.ASCENDING)], False),
+    ('Regions', [('name', pymongo.ASCENDING)], True),
+    ('Regions', [('last_updated_date', pymongo.ASCENDING)], False),
+    ('Queries', [('name', pymongo.ASCENDING)], True),
+    ('Queries', [('last_updated_date', pymongo.ASCENDING)], False),
+    ('Contacts', [('name', pymongo.ASCENDING), ('phone', pymongo.ASCENDING),
+                  ('field', pymongo.ASCENDING), ('email', pymongo.ASCENDING)], True),
+    ('Contacts', [('last_updated_date', pymongo.ASCENDING)], False),
+]
+
+# The databases whose indexes have already been ensured by this process.
+_ensured = set()
+
+
+def ensure_indexes(db, key=None):
+    """
+    Creates all indexes of the pipeline on the database. Existing indexes are left untouched.
+    The indexes are only created once per process and key.
+    :param key: Identifies the database, defaults to the name of the database.
+    :return: False if the indexes had already been ensured by this process.
+    """
+    if key is None:
+        key = db.name
+    if key in _ensured:
+        return False
+
+    for collection_name, keys, unique in INDEXES:
+        create_index(db[collection_name], keys, unique)
+
+    _ensured.add(key)
+    return True
+
+
+def create_index(db_obj, keys, unique):
+    try:
+        db_obj.create_index(keys, unique=unique)
+    except OperationFailure as error:
+        if not unique:
+            logger.warning('Failed to create index %s on %s: %s', keys, db_obj.name, error)
+            return
+        # Duplicates or an existing regular index prevent the unique index.
+        logger.warning('Failed to create unique index %s on %s, creating a regular one: %s', keys, db_obj.name, error)
+        create_index(db_obj, keys, False)
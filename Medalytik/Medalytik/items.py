@@ -38,3 +38,5 @@ class Job(scrapy.Item):
     schedule = scrapy.Field()
     offering_type = scrapy.Field()
     organization = scrapy.Field()
+    # Set if the detail page has been skipped since the job did not change, only the listing fields are filled.
+    unchanged = scrapy.Field()
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+#
+#  known_jobs.py
+#  Medalytik
+#
+#  The jobs whose detail pages have already been crawled.
+#
+#  Every job is identified by its website, title and url, the values shown on the listing pages.
+#  Along with it the hash of all listing fields and the date of the last detail page fetch are stored,
+#  so the IncrementalCrawlMiddleware can tell if a listing entry changed since the detail page was fetched.
+#
+
+from datetime import date, datetime
+import hashlib
+import json
+
+from .storage import SQLiteStore
+
+
+def listing_hash(job):
+    """
+    :return: A stable hash of the fields of a job filled from a listing page.
+    The queries are left out, the same job is listed for every query it matches.
+    """
+    content = {key: value for key, value in job.items() if key not in ('queries', 'in_development')}
+    return hashlib.sha1(json.dumps(content, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+class KnownJobIndex(SQLiteStore):
+    """
+    Persistent index of the crawled jobs stored in a SQLite file.
+    Pass ':memory:' as path to keep the index for the current process only.
+    """
+
+    TABLE = 'known_jobs'
+    COLUMNS = ('website TEXT, title TEXT, url TEXT, development INTEGER, listing_hash TEXT, fetched TEXT, '
+               'PRIMARY KEY (website, title, url, development)')
+
+    @staticmethod
+    def key(job, url):
+        """
+        :param url: The url of the detail page, used if the listing does not set the url of the job.
+        :return: The identity of the job in the index.
+        """
+        return job.get('website_name'), job.get('title'), job.get('url') or url, bool(job.get('in_development'))
+
+    def get(self, key):
+        """:return: A tuple (listing hash, date of the last fetch) or None if the job is not known."""
+        row = self.connection.execute(
+            'SELECT listing_hash, fetched FROM known_jobs '
+            'WHERE website = ? AND title = ? AND url = ? AND development = ?', key
+        ).fetchone()
+        if row is None:
+            return None
+        return row[0], datetime.strptime(row[1], '%Y-%m-%d').date()
+
+    def put(self, key, job_listing_hash, fetched=None):
+        """Stores the listing hash of a job whose detail page has been fetched on 'fetched', defaults to today."""
+        fetched = fetched or date.today()
+        self.connection.execute(
+            'INSERT OR REPLACE INTO known_jobs VALUES (?, ?, ?, ?, ?, ?)',
+            tuple(key) + (job_listing_hash, fetched.isoformat())
+        )
+        self.written()
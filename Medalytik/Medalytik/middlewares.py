@@ -5,7 +5,29 @@
 # See documentation in:
 # https://doc.scrapy.org/en/latest/topics/spider-middleware.html
 
-from scrapy import signals
+from datetime import date
+from functools import partial
+import logging
+
+from scrapy import Request, signals
+from scrapy.exceptions import NotConfigured
+from scrapy.utils.spider import iterate_spider_output
+
+from .conditional_get import acquire_store, conditional_get_store_path, release_store
+from .items import Job
+from .known_jobs import KnownJobIndex, listing_hash
+from .storage import sqlite_path
+
+logger = logging.getLogger(__name__)
+
+
+def is_detail_request(request):
+    """
+    Detail requests download the detail page of a job found on a listing page.
+    They carry the job filled from the listing page in meta['job'], the callback completes it from the detail page.
+    :return: True if the request is a detail request.
+    """
+    return isinstance(request.meta.get('job'), Job)
 
 
 class MedalytikSpiderMiddleware(object):
@@ -101,3 +123,367 @@ class MedalytikDownloaderMiddleware(object):
 
     def spider_opened(self, spider):
         spider.logger.info('Spider opened: %s' % spider.name)
+
+
+class IncrementalCrawlMiddleware(object):
+    """
+    Skips the detail pages of jobs that have already been crawled on an earlier day.
+
+    If the job of a detail request (see is_detail_request) is known and its listing fields are unchanged,
+    the request is replaced by the listing job, marked as 'unchanged'.
+    The pipeline then only updates its date and queries.
+    Detail pages are fetched again once they are INCREMENTAL_REFETCH_DAYS old,
+    and always on the day they have been fetched, so a job is either fetched or skipped for all its queries.
+
+    Enable it for a spider with the INCREMENTAL_ENABLED setting.
+    """
+
+    def __init__(self, index, refetch_days=7, stats=None):
+        self.index = index
+        self.refetch_days = refetch_days
+        self.stats = stats
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('INCREMENTAL_ENABLED'):
+            raise NotConfigured
+
+        path = sqlite_path(crawler.settings.get('INCREMENTAL_INDEX_PATH', 'known_jobs.sqlite'))
+
+        s = cls(KnownJobIndex(path), crawler.settings.getint('INCREMENTAL_REFETCH_DAYS', 7), crawler.stats)
+        crawler.signals.connect(s.spider_closed, signal=signals.spider_closed)
+        return s
+
+    def process_spider_output(self, response, result, spider):
+        # Set on the detail requests, the jobs parsed from their responses are stored in the index.
+        known_job = response.meta.get('known_job')
+        for element in result:
+            if isinstance(element, Request):
+                element = self.process_detail_request(element)
+            elif isinstance(element, Job) and known_job is not None:
+                self.index.put(*known_job)
+            yield element
+
+    def process_detail_request(self, request):
+        """:return: The request, or the unchanged listing job if the detail page can be skipped."""
+        if not is_detail_request(request) or not request.meta['job'].get('title') or 'known_job' in request.meta:
+            return request
+        job = request.meta['job']
+
+        key = KnownJobIndex.key(job, request.url)
+        job_listing_hash = listing_hash(job)
+        known = self.index.get(key)
+        if known is not None and known[0] == job_listing_hash \
+                and 0 < (date.today() - known[1]).days < self.refetch_days:
+            self.inc_value('incremental/skipped')
+            job = job.copy()
+            job['unchanged'] = True
+            return job
+
+        request.meta['known_job'] = (key, job_listing_hash)
+        self.inc_value('incremental/fetched')
+        return request
+
+    def inc_value(self, key):
+        if self.stats is not None:
+            self.stats.inc_value(key)
+
+    def spider_closed(self, spider):
+        self.index.close()
+
+
+class DetailDedupMiddleware(object):
+    """
+    Downloads the detail page of a job only once, even if the job is listed for several queries.
+
+    While the detail page of a url is in flight, the detail requests (see is_detail_request) of other queries
+    for the same url are dropped and their queries are added to the job of the request in flight,
+    so a single job with all queries is returned.
+    Once the job has been returned, later detail requests for the url are answered with the identity of the job
+    and the additional queries, marked as unchanged, without downloading the page again.
+    The pipeline merges their queries into the stored job.
+
+    If the detail page fails or returns no job, the first dropped request is issued again with all the queries,
+    so they are not lost.
+
+    It runs after the IncrementalCrawlMiddleware, skipped detail pages are not deduplicated.
+    Enabled for all spiders with the DETAIL_DEDUP_ENABLED setting, it keeps the duplicate filter
+    from dropping the queries of duplicate detail requests.
+    """
+
+    # Fields that identify a stored job in the pipeline, they are kept for the returned jobs.
+    IDENTITY_FIELDS = ('website_name', 'title', 'date_availability', 'regions', 'in_development')
+
+    def __init__(self, stats=None):
+        self.stats = stats
+        # url -> job of the detail request in flight
+        self.in_flight = {}
+        # url -> first detail request dropped while the page is in flight
+        self.pending = {}
+        # url -> identity fields and queries of the job returned from the detail page
+        self.done = {}
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('DETAIL_DEDUP_ENABLED'):
+            raise NotConfigured
+        return cls(crawler.stats)
+
+    def process_spider_output(self, response, result, spider):
+        # Set on the detail requests in flight, also after redirects.
+        detail_url = response.meta.get('detail_url')
+        for element in result:
+            if isinstance(element, Request) and is_detail_request(element):
+                element = self.process_detail_request(element)
+                if element is None:
+                    continue
+            elif isinstance(element, Job) and detail_url is not None:
+                self.in_flight.pop(detail_url, None)
+                self.pending.pop(detail_url, None)
+                self.done[detail_url] = {field: element[field] for field in self.IDENTITY_FIELDS + ('queries',)
+                                         if field in element}
+            yield element
+
+        # The page returned no job.
+        if detail_url is not None:
+            request = self.release(detail_url, response.meta.get('job'))
+            if request is not None:
+                yield request
+
+    def process_spider_exception(self, response, exception, spider):
+        detail_url = response.meta.get('detail_url')
+        if detail_url is None:
+            return None
+        request = self.release(detail_url, response.meta.get('job'))
+        if request is None:
+            return None
+        # The exception is handled to issue the request, it is still logged.
+        spider.logger.error('Spider error processing %s', response,
+                            exc_info=(type(exception), exception, exception.__traceback__))
+        return [request]
+
+    def process_detail_request(self, request):
+        """:return: The request, a job merging the queries if the page is done or None if it is in flight."""
+        job = request.meta['job']
+        queries = job.get('queries') or []
+
+        done_job = self.done.get(request.url)
+        if done_job is not None:
+            self.inc_value('detail_dedup/returned')
+            done_job['queries'] = self.merge_queries(done_job.get('queries'), queries)
+            job = Job(done_job)
+            job['unchanged'] = True
+            return job
+
+        in_flight_job = self.in_flight.get(request.url)
+        if in_flight_job is job:
+            # Issued again by this middleware.
+            return request
+        if in_flight_job is not None:
+            in_flight_job['queries'] = self.merge_queries(in_flight_job.get('queries'), queries)
+            self.pending.setdefault(request.url, request)
+            self.inc_value('detail_dedup/merged')
+            return None
+
+        return self.register(request)
+
+    def register(self, request):
+        """Registers the request as in flight. :return: The request, its errback releases the page on failure."""
+        self.in_flight[request.url] = request.meta['job']
+        request.meta['detail_url'] = request.url
+        request.errback = partial(self.detail_failed, request.url, request.meta['job'], request.errback)
+        return request
+
+    def release(self, url, job):
+        """
+        Releases the page of a detail request that returned no job.
+        :return: The first dropped request for the page carrying all the queries, or None.
+        """
+        if job is None or self.in_flight.get(url) is not job:
+            return None
+        del self.in_flight[url]
+
+        request = self.pending.pop(url, None)
+        if request is None:
+            return None
+        self.inc_value('detail_dedup/reissued')
+        reissued_job = request.meta['job'].copy()
+        reissued_job['queries'] = job.get('queries')
+        # The failed request has the same fingerprint.
+        request = request.replace(meta=dict(request.meta, job=reissued_job), dont_filter=True)
+        return self.register(request)
+
+    def detail_failed(self, url, job, errback, failure):
+        """The errback of the detail requests, calls the original errback and issues a dropped request again."""
+        if errback is not None:
+            for element in iterate_spider_output(errback(failure)):
+                yield element
+        else:
+            logger.info('Detail page %s failed: %s', url, failure.getErrorMessage())
+
+        request = self.release(url, job)
+        if request is not None:
+            yield request
+
+    @staticmethod
+    def merge_queries(queries, new_queries):
+        """:return: The queries followed by the new queries that are not in them yet."""
+        queries = list(queries or [])
+        queries.extend(query for query in new_queries if query not in queries)
+        return queries
+
+    def inc_value(self, key):
+        if self.stats is not None:
+            self.stats.inc_value(key)
+
+
+class ConditionalGetMiddleware(object):
+    """
+    Sends conditional requests for the detail pages (see is_detail_request).
+
+    The next request of a page sends its stored ETag and Last-Modified values as If-None-Match and If-Modified-Since.
+    The response is only marked in its meta, the ConditionalGetSpiderMiddleware handles it:
+        - 'conditional_get_job' holds the stored fields of the job on '304 Not Modified'.
+        - 'conditional_get_validators' holds the url, ETag and Last-Modified values of a page that sent them.
+    The validators of a page that sent none are deleted.
+
+    Disable it with the CONDITIONAL_GET_ENABLED setting.
+    """
+
+    def __init__(self, store_path, stats=None):
+        self.store_path = store_path
+        self.store = acquire_store(store_path)
+        self.stats = stats
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('CONDITIONAL_GET_ENABLED', True):
+            raise NotConfigured
+
+        s = cls(conditional_get_store_path(crawler.settings), crawler.stats)
+        crawler.signals.connect(s.spider_closed, signal=signals.spider_closed)
+        return s
+
+    @staticmethod
+    def page_url(request):
+        """:return: The url the page has been requested with, before any redirect."""
+        return request.meta.get('redirect_urls', [request.url])[0]
+
+    def process_request(self, request, spider):
+        if request.method != 'GET' or not is_detail_request(request) or request.meta.get('conditional_get'):
+            return None
+
+        stored = self.store.get(self.page_url(request))
+        if stored is None:
+            return None
+
+        etag, last_modified, _ = stored
+        if etag:
+            request.headers.setdefault('If-None-Match', etag)
+        if last_modified:
+            request.headers.setdefault('If-Modified-Since', last_modified)
+        request.meta['conditional_get'] = True
+        # Let the 304 responses pass the HttpErrorMiddleware.
+        request.meta['handle_httpstatus_list'] = list(request.meta.get('handle_httpstatus_list', [])) + [304]
+        self.inc_value('conditional_get/requests')
+        return None
+
+    def process_response(self, request, response, spider):
+        if not is_detail_request(request):
+            return response
+
+        # The meta of the request is the meta of the response.
+        request.meta.pop('conditional_get_job', None)
+        request.meta.pop('conditional_get_validators', None)
+        url = self.page_url(request)
+        if response.status == 304 and request.meta.get('conditional_get'):
+            stored = self.store.get(url)
+            if stored is not None:
+                self.inc_value('conditional_get/not_modified')
+                request.meta['conditional_get_job'] = stored[2]
+            return response
+
+        if response.status == 200:
+            etag = response.headers.get('ETag')
+            last_modified = response.headers.get('Last-Modified')
+            if etag or last_modified:
+                request.meta['conditional_get_validators'] = (url, etag and etag.decode('latin-1'),
+                                                              last_modified and last_modified.decode('latin-1'))
+            else:
+                self.store.delete(url)
+        return response
+
+    def inc_value(self, key):
+        if self.stats is not None:
+            self.stats.inc_value(key)
+
+    def spider_closed(self, spider):
+        if self.stats is not None:
+            requests = self.stats.get_value('conditional_get/requests', 0)
+            if requests:
+                not_modified = self.stats.get_value('conditional_get/not_modified', 0)
+                self.stats.set_value('conditional_get/hit_ratio', not_modified / requests)
+        release_store(self.store_path)
+
+
+class ConditionalGetSpiderMiddleware(object):
+    """
+    Handles the detail pages marked by the ConditionalGetMiddleware.
+
+    On '304 Not Modified' the output of the callback is replaced by the listing job, completed with the stored fields
+    of the page. Errors of the callback parsing the empty page are dropped as well.
+    The jobs parsed from a page that sent validators are stored along with them.
+
+    It runs before the IncrementalCrawlMiddleware and the DetailDedupMiddleware, they handle the replayed jobs
+    like the parsed ones. Enabled together with the ConditionalGetMiddleware by the CONDITIONAL_GET_ENABLED setting.
+    """
+
+    # Fields that depend on the listing page the job has been found on, they are never replayed.
+    LISTING_FIELDS = ('queries', 'in_development')
+
+    def __init__(self, store_path):
+        self.store_path = store_path
+        self.store = acquire_store(store_path)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('CONDITIONAL_GET_ENABLED', True):
+            raise NotConfigured
+
+        s = cls(conditional_get_store_path(crawler.settings))
+        crawler.signals.connect(s.spider_closed, signal=signals.spider_closed)
+        return s
+
+    def process_spider_output(self, response, result, spider):
+        if 'conditional_get_job' in response.meta:
+            return self.replay_job(response)
+
+        validators = response.meta.get('conditional_get_validators')
+        if validators is not None:
+            return self.record_jobs(result, *validators)
+        return result
+
+    def process_spider_exception(self, response, exception, spider):
+        if 'conditional_get_job' in response.meta:
+            return self.replay_job(response)
+        return None
+
+    def record_jobs(self, result, url, etag, last_modified):
+        """Stores the jobs of the result along with the validators of their page."""
+        for element in result:
+            if isinstance(element, Job):
+                job_fields = {field: value for field, value in element.items() if field not in self.LISTING_FIELDS}
+                self.store.put(url, etag, last_modified, job_fields)
+            yield element
+
+    @staticmethod
+    def replay_job(response):
+        """:return: The listing job of the request, completed with the stored fields of the page."""
+        job = response.meta['job'].copy()
+        for field, value in response.meta['conditional_get_job'].items():
+            if field in job.fields and field not in job:
+                job[field] = value
+        return [job]
+
+    def spider_closed(self, spider):
+        release_store(self.store_path)
@@ -0,0 +1,6 @@
+# This package contains the migrations of the Medalytik databases.
+#
+# Each migration can be run more than once and migrates both the debug and the release database by default.
+# Invoke them from inside the Medalytik project with:
+#
+#     python -m Medalytik.migrations.<migration>
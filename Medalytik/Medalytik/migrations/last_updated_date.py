@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+#
+#  last_updated_date.py
+#  Medalytik
+#
+#  Backfills the 'last_updated_date' value of all documents from their 'last_updated' string
+#  and creates the indexes of the MongoDBPipeline, including the ones of the obsolete pass.
+#
+#  Documents are grouped by their 'last_updated' string, so only one update is sent per distinct day.
+#
+#      python -m Medalytik.migrations.last_updated_date
+#      python -m Medalytik.migrations.last_updated_date --uri mongodb://localhost:27017 --db Medalytik
+#
+
+import argparse
+from datetime import datetime
+import logging
+
+import pymongo
+from scrapy.utils.project import get_project_settings
+
+from ..indexes import ensure_indexes
+from ..pipelines import MongoDBPipeline, time_format
+
+logger = logging.getLogger(__name__)
+
+COLLECTION_NAMES = ['Jobs', 'Websites', 'Regions', 'Queries', 'Contacts']
+
+
+def backfill(db_obj):
+    """
+    Stores the 'last_updated_date' on every document of the collection that does not have one yet.
+    :return: The number of documents updated.
+    """
+    missing = {MongoDBPipeline.DB_LAST_UPDATED_DATE: {'$exists': False}}
+    count = 0
+    for last_updated in db_obj.distinct(MongoDBPipeline.DB_LAST_UPDATED, missing):
+        try:
+            last_updated_date = datetime.strptime(last_updated, time_format)
+        except (TypeError, ValueError):
+            logger.warning('Skipping %s documents with invalid last updated value %r', db_obj.name, last_updated)
+            continue
+
+        query = dict(missing)
+        query[MongoDBPipeline.DB_LAST_UPDATED] = last_updated
+        result = db_obj.update_many(query, {'$set': {MongoDBPipeline.DB_LAST_UPDATED_DATE: last_updated_date}})
+        count += result.modified_count
+    return count
+
+
+def migrate(db):
+    for collection_name in COLLECTION_NAMES:
+        count = backfill(db[collection_name])
+        logger.info('Backfilled %d %s.%s documents', count, db.name, collection_name)
+    ensure_indexes(db)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--uri', help='Migrate only the database at this uri, instead of the debug and release one.')
+    parser.add_argument('--db', help='The name of the database to migrate, if an uri is passed.')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    if args.uri:
+        databases = [(args.uri, args.db)]
+    else:
+        settings = get_project_settings()
+        debug_uri, release_uri = MongoDBPipeline.mongo_uris(settings)
+        databases = [(debug_uri, settings.get(MongoDBPipeline.MONGO_DEBUG_DATABASE_SETTINGS_NAME)),
+                     (release_uri, settings.get(MongoDBPipeline.MONGO_RELEASE_DATABASE_SETTINGS_NAME))]
+
+    for uri, db_name in databases:
+        client = pymongo.MongoClient(uri)
+        try:
+            migrate(client[db_name])
+        finally:
+            client.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,381 @@
+# -*- coding: utf-8 -*-
+#
+#  motor_pipeline.py
+#  Medalytik
+#
+#  An asynchronous version of the MongoDBPipeline, built on the Motor driver.
+#
+#  The MongoDBPipeline uses pymongo, every lookup and write blocks the reactor until Mongo has answered.
+#  This pipeline writes the same documents, but awaits the database on the asyncio event loop,
+#  so the writes overlap with the downloads. It needs Scrapy 2 or newer running on the asyncio reactor:
+#
+#      TWISTED_REACTOR = 'twisted.internet.asyncioreactor.AsyncioSelectorReactor'
+#      ITEM_PIPELINES = {'Medalytik.motor_pipeline.MotorMongoDBPipeline': 300}
+#
+#  The number of items written at the same time is limited by MONGO_ASYNC_CONCURRENCY.
+#
+
+import asyncio
+import logging
+import time
+
+import bson
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from scrapy.utils.defer import deferred_from_coro
+
+from .clients import acquire_client, release_client
+from .geocoding import GeocodeCache, GeocodeQueue, NominatimResolver
+from .indexes import ensure_indexes
+from .pipelines import MongoDBPipeline
+
+logger = logging.getLogger(__name__)
+
+
+class MotorMongoDBPipeline(MongoDBPipeline):
+    """
+    Writes the jobs to the same databases and with the same documents as the MongoDBPipeline,
+    without blocking the reactor.
+
+    Items are processed concurrently, up to 'concurrency' at a time.
+    Items of the same job are processed one after another, so they are still merged into one document.
+    """
+
+    MONGO_ASYNC_CONCURRENCY_SETTINGS_NAME = 'MONGO_ASYNC_CONCURRENCY'
+
+    def __init__(self, *args, concurrency=16, **kwargs):
+        super(MotorMongoDBPipeline, self).__init__(*args, **kwargs)
+        self.concurrency = concurrency
+        self.semaphore = None
+        # (in development, website name, title)
+        #     -> [lock held while the job is written, number of items holding or waiting for it]
+        self.job_locks = {}
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        pipeline = super(MotorMongoDBPipeline, cls).from_crawler(crawler)
+        pipeline.concurrency = crawler.settings.getint(cls.MONGO_ASYNC_CONCURRENCY_SETTINGS_NAME, 16)
+        return pipeline
+
+    def open_spider(self, spider):
+        return deferred_from_coro(self._open_spider(spider))
+
+    async def _open_spider(self, _):
+        """Connect to the Mongo Database."""
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+
+        # The clients are shared with the other spiders of the process, like the clients of the MongoBackend.
+        self.debug_client = acquire_client(self.mongo_debug_uri, self.max_pool_size, AsyncIOMotorClient)
+        self.debug_db = self.debug_client[self.mongo_debug_db]
+        self.release_client = acquire_client(self.mongo_release_uri, self.max_pool_size, AsyncIOMotorClient)
+        self.release_db = self.release_client[self.mongo_release_db]
+
+        if self.ensure_indexes_enabled:
+            await self.ensure_indexes(self.debug_db, (self.mongo_debug_uri, self.mongo_debug_db))
+            await self.ensure_indexes(self.release_db, (self.mongo_release_uri, self.mongo_release_db))
+
+        if self.geocode_cache is None:
+            self.geocode_cache = GeocodeCache(':memory:', NominatimResolver(self.USER_AGENT))
+        for db in (self.debug_db, self.release_db):
+            regions = await db.Regions.find({self.DB_REGION_LATITUDE: {'$nin': ["", None]}}).to_list(None)
+            self.geocode_cache.seed(regions)
+        self.geocode_queue = GeocodeQueue(self.geocode_cache, self.geocode_concurrency, self.geocode_rate, self.stats)
+
+    def close_spider(self, spider):
+        return deferred_from_coro(self._close_spider(spider))
+
+    async def _close_spider(self, _):
+        """Removes any old items and closes the connections."""
+        await self.obsolete_database(self.debug_db, 'debug')
+        await self.obsolete_database(self.release_db, 'release')
+
+        release_client(self.mongo_debug_uri, AsyncIOMotorClient)
+        release_client(self.mongo_release_uri, AsyncIOMotorClient)
+        self.geocode_cache.close()
+
+    async def ensure_indexes(self, db, key):
+        """
+        Creates the indexes with indexes.ensure_indexes, once per process like the MongoDBPipeline.
+        It runs on the pymongo database underneath the Motor one, in a thread of the event loop.
+        """
+        await asyncio.get_event_loop().run_in_executor(None, ensure_indexes, db.delegate, key)
+
+    async def process_item(self, item, _):
+        """
+        Adds the job and its reference documents to the database, like MongoDBPipeline.process_item.
+        The item is returned once the job has been written and its region has been geocoded.
+        """
+        async with self.semaphore:
+            # The same fields as the filter of the upsert, the items of a job with different dates or regions
+            # would otherwise upsert the same document at the same time.
+            key = (bool(item.get("in_development")), item.get(self.JOB_WEBSITE_NAME), item.get(self.JOB_TITLE))
+            entry = self.job_locks.get(key)
+            if entry is None:
+                entry = self.job_locks[key] = [asyncio.Lock(), 0]
+            entry[1] += 1
+            try:
+                async with entry[0]:
+                    region_id = await self.store_item(item)
+            finally:
+                # Locks are dropped once no item of the job is left, otherwise every job of the crawl keeps one.
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self.job_locks[key]
+
+        region_fill = self.region_fills.get(region_id)
+        if region_fill is not None:
+            await region_fill
+        return item
+
+    async def store_item(self, item):
+        """:return: The id of the region of the job."""
+        if item.get("in_development"):
+            db = self.debug_db
+            stored_items = self.stored_debug_items
+        else:
+            db = self.release_db
+            stored_items = self.stored_release_items
+
+        # Already stored job, only the queries have to be merged.
+        stored_job = stored_items.get(item)
+        if stored_job is not None:
+            if stored_job.merge_query_ids(await self.queries_id(item)):
+                await db.Jobs.update_one({self.DB_ID: bson.ObjectId(stored_job._id)},
+                                         {'$set': {self.DB_QUERY_IDS: stored_job.query_ids}})
+            return None
+
+        if item.get(self.JOB_UNCHANGED):
+            await self.touch_item(item, db, stored_items)
+            return None
+
+        website_id, region_id, query_ids, contact_id = await asyncio.gather(
+            self.website_id(item), self.regions_id(item), self.queries_id(item), self.contact_id(item)
+        )
+        job_dict = self.job_dict(item, website_id, region_id, query_ids, contact_id)
+
+        # An unchanged job only gets its date and queries updated.
+        job = await db.Jobs.find_one_and_update(
+            {self.DB_WEBSITE_ID: website_id, self.DB_TITLE: item.get(self.JOB_TITLE),
+             self.DB_CONTENT_HASH: job_dict[self.DB_CONTENT_HASH]},
+            {'$set': self.unchanged_job_dict(job_dict)},
+            projection={self.DB_ID: 1}
+        )
+        if job is not None:
+            self.count_job_write('unchanged')
+        else:
+            # Change the existing job or insert a new one.
+            # The job before the update is returned, None if it has been inserted with the id set on insert.
+            inserted_id = bson.ObjectId()
+            job = await db.Jobs.find_one_and_update(
+                {self.DB_WEBSITE_ID: website_id, self.DB_TITLE: item.get(self.JOB_TITLE)},
+                {'$set': job_dict, '$setOnInsert': {self.DB_ID: inserted_id}},
+                upsert=True,
+                projection={self.DB_ID: 1},
+                return_document=ReturnDocument.BEFORE
+            )
+            if job is None:
+                job = {self.DB_ID: inserted_id}
+                self.count_job_write('inserted')
+            else:
+                self.count_job_write('changed')
+        stored_items.add(item, job[self.DB_ID], query_ids)
+        return region_id
+
+    async def touch_item(self, item, db, stored_items):
+        """
+        Updates the date and the queries of the stored job of an unchanged item,
+        and touches the region and the contact of the stored job.
+        """
+        website_id, query_ids = await asyncio.gather(self.website_id(item), self.queries_id(item))
+        job = await db.Jobs.find_one_and_update(
+            {self.DB_WEBSITE_ID: website_id, self.DB_TITLE: item.get(self.JOB_TITLE)},
+            {'$set': self.touch_job_dict(query_ids)},
+            projection={self.DB_ID: 1, self.DB_REGION_IDS: 1, self.DB_CONTACT_ID: 1}
+        )
+        if job is None:
+            logger.warning('Unchanged job %r of %r is not stored, it is added once its detail page is fetched again.',
+                           item.get(self.JOB_TITLE), item.get(self.JOB_WEBSITE_NAME))
+            self.count_job_write('missing')
+            return
+        _, references = self.database(item)
+        await self.touch_job_references(db, references, [job])
+        stored_items.add(item, job[self.DB_ID], query_ids)
+        self.count_job_write('touched')
+
+    async def touch_job_references(self, db, references, jobs):
+        """Sets the 'last updated' value of the regions and contacts of the stored jobs to today."""
+        for collection_name, ids in self.untouched_reference_ids(references, jobs).items():
+            await db[collection_name].update_many(
+                {self.DB_ID: {'$in': ids}},
+                {'$set': {self.DB_LAST_UPDATED: self.today,
+                          self.DB_LAST_UPDATED_DATE: self.today_date}}
+            )
+
+    def database(self, item):
+        if item.get("in_development"):
+            return self.debug_db, self.debug_references
+        return self.release_db, self.release_references
+
+    async def reference_id(self, db_obj, references, key, query, document):
+        """
+        Returns the id of the reference document matching the query, inserting 'document' if there is none.
+        :return: A tuple of the id and whether the document has been inserted.
+        """
+        _id = references.get(db_obj.name, key, self.today)
+        if _id is not None:
+            return _id, False
+
+        inserted = False
+        existing = await db_obj.find_one(query)
+        if existing:
+            await self.touch(db_obj, existing)
+            _id = existing[self.DB_ID]
+        else:
+            try:
+                _id = (await db_obj.insert_one(document)).inserted_id
+                inserted = True
+            except DuplicateKeyError:
+                # Inserted by another item in the meantime.
+                _id = (await db_obj.find_one(query))[self.DB_ID]
+        references.set(db_obj.name, key, _id, self.today)
+        return _id, inserted
+
+    async def touch(self, db_obj, document):
+        """Sets the 'last updated' value of the passed document to today, unless it already is."""
+        if document.get(self.DB_LAST_UPDATED) != self.today or self.DB_LAST_UPDATED_DATE not in document:
+            await db_obj.update_one(
+                {self.DB_ID: document[self.DB_ID]},
+                {'$set': {self.DB_LAST_UPDATED: self.today,
+                          self.DB_LAST_UPDATED_DATE: self.today_date}}
+            )
+
+    async def website_id(self, item):
+        db, references = self.database(item)
+        website_name = item.get(self.JOB_WEBSITE_NAME) or "None Specified"
+        website_dict = {self.DB_WEBSITE_NAME: website_name,
+                        self.DB_WEBSITE_LAST_UPDATED: self.today,
+                        self.DB_LAST_UPDATED_DATE: self.today_date}
+        if item.get(self.JOB_WEBSITE_NAME):
+            website_dict[self.DB_WEBSITE_URL] = item.get(self.JOB_WEBSITE_URL)
+
+        website_id, _ = await self.reference_id(db.Websites, references, website_name,
+                                                {self.DB_WEBSITE_NAME: website_name}, website_dict)
+        return website_id
+
+    async def regions_id(self, item):
+        db, references = self.database(item)
+        region_name = item.get(self.JOB_REGION) or "None Specified"
+        region_dict = {self.DB_REGION_NAME: region_name,
+                       self.DB_REGION_LAST_UPDATED: self.today,
+                       self.DB_LAST_UPDATED_DATE: self.today_date}
+
+        cached = True
+        if item.get(self.JOB_REGION):
+            cached, coordinates = self.geocode_cache.get(region_name)
+            region_dict.update({self.DB_REGION_LATITUDE: "",
+                                self.DB_REGION_LONGITUDE: "",
+                                self.DB_REGION_ADDRESS: "",
+                                self.DB_REGION_STATE: ""})
+            if coordinates is not None:
+                region_dict.update({self.DB_REGION_LATITUDE: coordinates.latitude,
+                                    self.DB_REGION_LONGITUDE: coordinates.longitude,
+                                    self.DB_REGION_ADDRESS: coordinates.address,
+                                    self.DB_REGION_STATE: coordinates.state})
+
+        region_id, inserted = await self.reference_id(db.Regions, references, region_name,
+                                                      {self.DB_REGION_NAME: region_name}, region_dict)
+
+        # Regions that have never been looked up are filled in once the geocoder has answered.
+        if inserted and not cached:
+            loop = asyncio.get_event_loop()
+            self.region_fills[region_id] = asyncio.ensure_future(
+                self.fill_region(self.location(region_name).asFuture(loop), db.Regions, region_id, region_name)
+            )
+        return region_id
+
+    async def fill_region(self, coordinates, db_obj, region_id, region_name):
+        try:
+            coordinates = await coordinates
+            if coordinates is None:
+                return
+
+            await db_obj.update_one(
+                {self.DB_ID: region_id},
+                {'$set': {self.DB_REGION_LATITUDE: coordinates.latitude,
+                          self.DB_REGION_LONGITUDE: coordinates.longitude,
+                          self.DB_REGION_ADDRESS: coordinates.address,
+                          self.DB_REGION_STATE: coordinates.state}}
+            )
+        except Exception:
+            # Like MongoDBPipeline.fill_region_failed, the region keeps no coordinates.
+            logger.exception('Failed to store the coordinates of %s', region_name)
+            if self.stats is not None:
+                self.stats.inc_value('geocode/errors')
+        finally:
+            del self.region_fills[region_id]
+
+    async def queries_id(self, item):
+        db, references = self.database(item)
+        query_names = item.get(self.JOB_QUERIES)
+        if not query_names or MongoDBPipeline.is_empty_list(query_names):
+            query_names = ["None Specified"]
+
+        query_ids = []
+        for query_name in query_names:
+            query_id, _ = await self.reference_id(db.Queries, references, query_name,
+                                                  {self.DB_QUERY_NAME: query_name},
+                                                  {self.DB_QUERY_NAME: query_name,
+                                                   self.DB_QUERY_LAST_UPDATED: self.today,
+                                                   self.DB_LAST_UPDATED_DATE: self.today_date})
+            query_ids.append(query_id)
+        return query_ids
+
+    async def contact_id(self, item):
+        db, references = self.database(item)
+        contact_key = (item.get(self.JOB_CONTACT_NAME),
+                       item.get(self.JOB_CONTACT_PHONE),
+                       item.get(self.JOB_CONTACT_FIELD),
+                       item.get(self.JOB_CONTACT_MAIL))
+
+        if not any(contact_key):
+            query = {self.DB_CONTACT_NAME: "None Specified"}
+        else:
+            query = {
+                self.DB_CONTACT_NAME: item.get(self.JOB_CONTACT_NAME),
+                self.DB_CONTACT_PHONE: item.get(self.JOB_CONTACT_PHONE),
+                self.DB_CONTACT_FIELD: item.get(self.JOB_CONTACT_FIELD),
+                self.DB_CONTACT_MAIL: item.get(self.JOB_CONTACT_MAIL)
+            }
+        contact_dict = dict(query)
+        contact_dict[self.DB_CONTACT_LAST_UPDATED] = self.today
+        contact_dict[self.DB_LAST_UPDATED_DATE] = self.today_date
+
+        contact_id, _ = await self.reference_id(db.Contacts, references, contact_key, query, contact_dict)
+        return contact_id
+
+    async def obsolete_database(self, db, name):
+        """Updates the 'active' value of all collections, see MongoDBPipeline.obsolete_database."""
+        start = time.time()
+        async for website in db.Websites.find({}, {self.DB_WEBSITE_LAST_UPDATED: 1, self.DB_LAST_UPDATED_DATE: 1}):
+            await self.set_active(db.Jobs, {self.DB_WEBSITE_ID: website[self.DB_ID]},
+                                  self.last_updated_date(website))
+        website_ids = await db.Websites.distinct(self.DB_ID)
+        await self.set_active(db.Jobs, {self.DB_WEBSITE_ID: {'$nin': website_ids}}, self.today_date)
+        self.report_time(name, 'Jobs', start)
+
+        for collection_name in ('Websites', 'Contacts', 'Queries', 'Regions'):
+            start = time.time()
+            await self.set_active(db[collection_name], {}, self.today_date)
+            self.report_time(name, collection_name, start)
+
+    async def set_active(self, db_obj, query, last_updated_date):
+        active_query, inactive_query = self.active_queries(query, last_updated_date)
+        await db_obj.update_many(active_query, {'$set': {self.DB_ACTIVE: True}})
+        await db_obj.update_many(inactive_query, {'$set': {self.DB_ACTIVE: False}})
+
+    def report_time(self, db_name, collection_name, start):
+        elapsed = time.time() - start
+        logger.info('Updated the active values of %s.%s in %.3f s', db_name, collection_name, elapsed)
+        if self.stats is not None:
+            self.stats.set_value('obsolete/%s/%s/seconds' % (db_name, collection_name), elapsed)
@@ -5,19 +5,269 @@
 # Don't forget to add your pipeline to the ITEM_PIPELINES setting
 # See: https://doc.scrapy.org/en/latest/topics/item-pipeline.html
 
-from datetime import datetime
+from datetime import datetime, timedelta
+from functools import partial
+import hashlib
+import logging
+import time
 import pymongo
-from . import mongoConstants
 import bson
-from geopy.geocoders import Nominatim
+from bson import json_util
+from scrapy.utils.log import failure_to_exc_info
+from scrapy.utils.misc import load_object
+from twisted.internet import task
+from .indexes import ensure_indexes
+from .storage import MongoBackend, sqlite_path
+from .geocoding import GeocodeCache, GeocodeQueue, NominatimResolver, when_done
+
+try:
+    # Not part of the repository, holds the uris of the production databases.
+    from . import mongoConstants
+except ImportError:
+    mongoConstants = None
 
 time_format = '%d %m %Y'
 
+logger = logging.getLogger(__name__)
+
+
+class StoredJob(object):
+    """
+    A job that has already been written during the current crawl.
+    Holds the database id of the job and the ids of all the queries the job has been found with so far.
+    """
+
+    __slots__ = ('_id', 'query_ids')
+
+    def __init__(self, _id, query_ids):
+        self._id = _id
+        self.query_ids = list(query_ids)
+
+    def merge_query_ids(self, query_ids):
+        """
+        Adds the passed query ids to the already known ones.
+        :return: True if at least one new query id has been added.
+        """
+        changed = False
+        for query_id in query_ids:
+            if query_id not in self.query_ids:
+                self.query_ids.append(query_id)
+                changed = True
+        return changed
+
+
+class StoredJobIndex(object):
+    """
+    Index of all the jobs stored during the current crawl.
+
+    Two items are treated as the same job if the website name, title, date availability and regions match.
+    These fields are combined to a key, so finding an already stored job is a single dictionary lookup
+    instead of a comparison against every stored job.
+    """
+
+    def __init__(self):
+        self._jobs = {}
+
+    def __len__(self):
+        return len(self._jobs)
+
+    @staticmethod
+    def key(item):
+        """:return: The identity of the passed job item."""
+        regions = item.get(MongoDBPipeline.JOB_REGION)
+        if isinstance(regions, list):
+            regions = tuple(regions)
+        return (item.get(MongoDBPipeline.JOB_WEBSITE_NAME),
+                item.get(MongoDBPipeline.JOB_TITLE),
+                item.get(MongoDBPipeline.JOB_DATE_AVAILABILITY),
+                regions)
+
+    def get(self, item):
+        """:return: The stored job matching the passed item, or None if it has not been stored yet."""
+        return self._jobs.get(self.key(item))
+
+    def add(self, item, _id, query_ids):
+        """Registers the passed item as stored under the database id '_id'."""
+        stored_job = StoredJob(_id, query_ids)
+        self._jobs[self.key(item)] = stored_job
+        return stored_job
+
+
+class ReferenceCache(object):
+    """
+    Remembers the ids of the reference documents (Websites, Regions, Queries and Contacts) of one database.
+
+    A crawl only touches a handful of websites and a few dozen regions and queries,
+    so after the first lookup of a document its id is returned without asking the database.
+    Entries are only valid on the day they were stored,
+    this way the 'last updated' value of each document is still touched once a day.
+    """
+
+    def __init__(self):
+        # (collection name, key) -> (id, day)
+        self._ids = {}
+        # (collection name, id) -> day the document has been touched on
+        self._touched = {}
+
+    def get(self, collection_name, key, today):
+        """:return: The id stored for the key today, or None."""
+        entry = self._ids.get((collection_name, key))
+        if entry is not None and entry[1] == today:
+            return entry[0]
+        return None
+
+    def set(self, collection_name, key, _id, today):
+        """Stores the id for the key. :return: The stored id."""
+        self._ids[(collection_name, key)] = (_id, today)
+        return _id
+
+    def first_touch(self, collection_name, _id, today):
+        """:return: True if the document with the id has not been touched today yet, it counts as touched from now."""
+        if self._touched.get((collection_name, _id)) == today:
+            return False
+        self._touched[(collection_name, _id)] = today
+        return True
+
+
+class JobWriteBuffer(object):
+    """
+    Collects the job writes for one database and sends them as a single unordered bulk write.
+
+    Jobs are matched by their website id and title, the same way the unbuffered pipeline looks them up.
+    Stored jobs whose content hash has not changed only get their date and queries updated.
+    Job dicts without a content hash belong to unchanged items, they only update jobs that are already stored.
+    The ids of the written jobs are only known after the buffer has been flushed,
+    until then the stored jobs of the buffered writes have no id.
+    The stored jobs of unchanged items are passed to 'touched' after the write, to touch their reference documents.
+    """
+
+    def __init__(self, collection, size, interval, stats=None, touched=None):
+        self.collection = collection
+        self.size = size
+        self.interval = interval
+        self.stats = stats
+        self.touched = touched
+
+        # (website id, title) -> (job dict, stored jobs written with that dict)
+        self._pending = {}
+        self._last_flush = time.time()
+
+    def __len__(self):
+        return len(self._pending)
+
+    def add(self, website_id, title, job_dict, stored_job):
+        """Buffers the write of 'job_dict'. The id of 'stored_job' is resolved once the buffer is flushed."""
+        key = (website_id, title)
+        if key in self._pending:
+            buffered_job_dict, stored_jobs = self._pending[key]
+            # The date and queries of an unchanged job are written along with the job buffered before.
+            if MongoDBPipeline.DB_CONTENT_HASH not in job_dict:
+                job_dict = buffered_job_dict
+        else:
+            stored_jobs = []
+        stored_jobs.append(stored_job)
+        self._pending[key] = (job_dict, stored_jobs)
+
+    def should_flush(self):
+        """:return: True if either the size or the time threshold has been reached."""
+        return len(self._pending) >= self.size or time.time() - self._last_flush >= self.interval
+
+    def flush(self):
+        """
+        Writes all buffered jobs and assigns the ids to their stored jobs.
+        The jobs stay buffered until the bulk write has succeeded, if it fails they are written with the next flush.
+        """
+        self._last_flush = time.time()
+        if not self._pending:
+            return
+
+        pending = list(self._pending.items())
+
+        # The ids and content hashes of the already stored jobs, looked up in one query.
+        existing_jobs = self.find_jobs([key for key, _ in pending])
+
+        requests = []
+        # (index of the request, key) of the jobs that are not stored yet.
+        upserted = []
+        # The stored jobs of the unchanged items.
+        touched_jobs = []
+        # The kinds of the writes, counted once the write has succeeded.
+        counts = []
+        for key, (job_dict, stored_jobs) in pending:
+            # Duplicates may have added queries while the job was buffered.
+            query_ids = []
+            for stored_job in stored_jobs:
+                for query_id in stored_job.query_ids:
+                    if query_id not in query_ids:
+                        query_ids.append(query_id)
+            job_dict[MongoDBPipeline.DB_QUERY_IDS] = query_ids
 
-geolocation_map = {
-    "Halle": "Halle Deutschland",
-    "Gauting": "Gauting Deutschland"
-}
+            existing_job = existing_jobs.get(key)
+            if MongoDBPipeline.DB_CONTENT_HASH not in job_dict:
+                if existing_job is None:
+                    logger.warning('Unchanged job %r is not stored, it is added once its detail page is fetched again.',
+                                   key[1])
+                    counts.append('missing')
+                else:
+                    requests.append(pymongo.UpdateOne(
+                        {MongoDBPipeline.DB_ID: existing_job[MongoDBPipeline.DB_ID]},
+                        {'$set': job_dict}
+                    ))
+                    touched_jobs.append(existing_job)
+                    counts.append('touched')
+            elif existing_job is None:
+                upserted.append((len(requests), key))
+                requests.append(pymongo.UpdateOne(
+                    {MongoDBPipeline.DB_WEBSITE_ID: key[0], MongoDBPipeline.DB_TITLE: key[1]},
+                    {'$set': job_dict},
+                    upsert=True
+                ))
+                counts.append('inserted')
+            else:
+                unchanged = existing_job.get(MongoDBPipeline.DB_CONTENT_HASH) == job_dict[MongoDBPipeline.DB_CONTENT_HASH]
+                requests.append(pymongo.UpdateOne(
+                    {MongoDBPipeline.DB_ID: existing_job[MongoDBPipeline.DB_ID]},
+                    {'$set': MongoDBPipeline.unchanged_job_dict(job_dict) if unchanged else job_dict}
+                ))
+                counts.append('unchanged' if unchanged else 'changed')
+        upserted_ids = self.collection.bulk_write(requests, ordered=False).upserted_ids if requests else {}
+        self._pending = {}
+        for kind in counts:
+            self.count(kind)
+        if touched_jobs and self.touched is not None:
+            self.touched(touched_jobs)
+
+        ids = {key: existing_job[MongoDBPipeline.DB_ID] for key, existing_job in existing_jobs.items()}
+        missing = []
+        for i, key in upserted:
+            if i in upserted_ids:
+                ids[key] = upserted_ids[i]
+            else:
+                # Inserted by someone else since the lookup, the upsert matched it.
+                missing.append(key)
+        if missing:
+            for key, existing_job in self.find_jobs(missing).items():
+                ids[key] = existing_job[MongoDBPipeline.DB_ID]
+
+        for key, (_, stored_jobs) in pending:
+            for stored_job in stored_jobs:
+                stored_job._id = ids.get(key)
+
+    def find_jobs(self, keys):
+        """:return: The id, content hash and reference ids of the stored jobs by (website id, title)."""
+        existing_jobs = self.collection.find(
+            {'$or': [{MongoDBPipeline.DB_WEBSITE_ID: key[0], MongoDBPipeline.DB_TITLE: key[1]} for key in keys]},
+            {MongoDBPipeline.DB_ID: 1, MongoDBPipeline.DB_WEBSITE_ID: 1, MongoDBPipeline.DB_TITLE: 1,
+             MongoDBPipeline.DB_CONTENT_HASH: 1, MongoDBPipeline.DB_REGION_IDS: 1, MongoDBPipeline.DB_CONTACT_ID: 1}
+        )
+        return {
+            (existing_job[MongoDBPipeline.DB_WEBSITE_ID], existing_job[MongoDBPipeline.DB_TITLE]): existing_job
+            for existing_job in existing_jobs
+        }
+
+    def count(self, kind):
+        if self.stats is not None:
+            self.stats.inc_value('jobs/%s' % kind)
 
 
 class MongoDBPipeline(object):
@@ -30,6 +280,18 @@ class MongoDBPipeline(object):
     COLLECTION_NAME = 'Medalytik'
     MONGO_RELEASE_DATABASE_SETTINGS_NAME = 'MONGO_RELEASE_DB'
     MONGO_DEBUG_DATABASE_SETTINGS_NAME = 'MONGO_DEBUG_DB'
+    MONGO_RELEASE_URI_SETTINGS_NAME = 'MONGO_RELEASE_URI'
+    MONGO_DEBUG_URI_SETTINGS_NAME = 'MONGO_DEBUG_URI'
+    STORAGE_BACKEND_SETTINGS_NAME = 'STORAGE_BACKEND'
+    MONGO_BULK_WRITE_ENABLED_SETTINGS_NAME = 'MONGO_BULK_WRITE_ENABLED'
+    MONGO_BULK_WRITE_SIZE_SETTINGS_NAME = 'MONGO_BULK_WRITE_SIZE'
+    MONGO_BULK_WRITE_INTERVAL_SETTINGS_NAME = 'MONGO_BULK_WRITE_INTERVAL'
+    MONGO_ENSURE_INDEXES_SETTINGS_NAME = 'MONGO_ENSURE_INDEXES'
+    MONGO_MAX_POOL_SIZE_SETTINGS_NAME = 'MONGO_MAX_POOL_SIZE'
+    GEOCODE_CACHE_PATH_SETTINGS_NAME = 'GEOCODE_CACHE_PATH'
+    GEOCODE_RESOLVER_SETTINGS_NAME = 'GEOCODE_RESOLVER'
+    GEOCODE_CONCURRENCY_SETTINGS_NAME = 'GEOCODE_CONCURRENCY'
+    GEOCODE_RATE_SETTINGS_NAME = 'GEOCODE_RATE'
 
     USER_AGENT = "Medalytik"
 
@@ -45,6 +307,7 @@ class MongoDBPipeline(object):
     DB_CONTACT_FIELD = 'field'
     DB_CONTACT_MAIL = 'email'
     DB_CONTACT_LAST_UPDATED = 'last_updated'
+    DB_CONTENT_HASH = 'content_hash'
     DB_DATE_AVAILABILITY = 'date_available'
     DB_DESCRIPTION = 'desc'
     DB_ENVIRONMENT = 'environment'
@@ -54,6 +317,7 @@ class MongoDBPipeline(object):
     DB_INFO_PHONE = 'info_phone'
     DB_INFO_MAIL = 'info_email'
     DB_LAST_UPDATED = 'last_updated'
+    DB_LAST_UPDATED_DATE = 'last_updated_date'
     DB_OFFER = 'offer'
     DB_QUERY_IDS = 'query_ids'
     DB_QUERY_NAME = 'name'
@@ -74,6 +338,10 @@ class MongoDBPipeline(object):
     DB_WEBSITE_URL = 'url'
     DB_WEBSITE_LAST_UPDATED = 'last_updated'
 
+    # The fields of a job that change without the job itself changing on the website.
+    # They are not part of the content hash and are the only ones updated on unchanged jobs.
+    DB_UNHASHED_FIELDS = (DB_ACTIVE, DB_LAST_UPDATED, DB_LAST_UPDATED_DATE, DB_QUERY_IDS)
+
     # -- ITEM NAMES --
 
     JOB_ABOUT = 'about'
@@ -99,6 +367,7 @@ class MongoDBPipeline(object):
     JOB_REQUIREMENTS = 'requirements'
     JOB_SUMMARY = 'summary'
     JOB_TITLE = 'title'
+    JOB_UNCHANGED = 'unchanged'
     JOB_URL = 'url'
     JOB_WEBSITE_ID = 'website_id'
     JOB_WEBSITE_NAME = 'website_name'
@@ -108,7 +377,15 @@ class MongoDBPipeline(object):
     def today(self):
         return datetime.now().strftime(time_format)
 
-    def __init__(self, mongo_debug_uri, mongo_release_uri, mongo_debug_db, mongo_release_db):
+    @property
+    def today_date(self):
+        """Today as a date, stored next to the 'last updated' string so it can be range queried and indexed."""
+        return datetime.combine(datetime.now().date(), datetime.min.time())
+
+    def __init__(self, mongo_debug_uri, mongo_release_uri, mongo_debug_db, mongo_release_db,
+                 bulk_write_enabled=False, bulk_write_size=500, bulk_write_interval=5.0, geocode_cache=None,
+                 geocode_concurrency=1, geocode_rate=1.0, stats=None, ensure_indexes_enabled=True,
+                 max_pool_size=100, storage_backend=None):
         self.mongo_debug_uri = mongo_debug_uri
         self.mongo_debug_db = mongo_debug_db
         self.debug_client = None
@@ -119,42 +396,143 @@ class MongoDBPipeline(object):
         self.release_client = None
         self.release_db = None
 
-        self.stored_debug_items = {}
-        self.stored_release_items = {}
+        # The backend the databases are opened with, see storage.py.
+        self.max_pool_size = max_pool_size
+        self.storage_backend = storage_backend or MongoBackend(max_pool_size)
+
+        self.stored_debug_items = StoredJobIndex()
+        self.stored_release_items = StoredJobIndex()
+
+        self.debug_references = ReferenceCache()
+        self.release_references = ReferenceCache()
+
+        # Job writes are buffered and flushed as bulk writes if enabled.
+        self.bulk_write_enabled = bulk_write_enabled
+        self.bulk_write_size = bulk_write_size
+        self.bulk_write_interval = bulk_write_interval
+        self.debug_job_writes = None
+        self.release_job_writes = None
+        # Flushes the buffers every 'bulk_write_interval' seconds, also while no items come in.
+        self.job_writes_loop = None
+
+        # Persistent cache of the region coordinates. Only kept in memory if none is passed.
+        self.geocode_cache = geocode_cache
+        self.geocode_concurrency = geocode_concurrency
+        self.geocode_rate = geocode_rate
+        self.geocode_queue = None
+        # region id -> deferred firing once the coordinates of the region have been stored
+        self.region_fills = {}
+        self.stats = stats
+
+        # Create the indexes of the lookups once per process.
+        self.ensure_indexes_enabled = ensure_indexes_enabled
 
     @classmethod
     def from_crawler(cls, crawler):
         """Initiate the URI and database strings."""
+        resolver_class = load_object(crawler.settings.get(MongoDBPipeline.GEOCODE_RESOLVER_SETTINGS_NAME,
+                                                          'Medalytik.geocoding.NominatimResolver'))
+        geocode_cache_path = sqlite_path(crawler.settings.get(MongoDBPipeline.GEOCODE_CACHE_PATH_SETTINGS_NAME,
+                                                              'geocode.sqlite'))
+
+        mongo_debug_uri, mongo_release_uri = MongoDBPipeline.mongo_uris(crawler.settings)
+        storage_backend_class = load_object(crawler.settings.get(MongoDBPipeline.STORAGE_BACKEND_SETTINGS_NAME,
+                                                                 'Medalytik.storage.MongoBackend'))
+
         return cls(
-            mongo_debug_uri=mongoConstants.MONGO_DEBUG_URI,
-            mongo_release_uri=mongoConstants.MONGO_RELEASE_URI,
+            mongo_debug_uri=mongo_debug_uri,
+            mongo_release_uri=mongo_release_uri,
             mongo_debug_db=crawler.settings.get(MongoDBPipeline.MONGO_DEBUG_DATABASE_SETTINGS_NAME),
-            mongo_release_db=crawler.settings.get(MongoDBPipeline.MONGO_RELEASE_DATABASE_SETTINGS_NAME)
+            mongo_release_db=crawler.settings.get(MongoDBPipeline.MONGO_RELEASE_DATABASE_SETTINGS_NAME),
+            bulk_write_enabled=crawler.settings.getbool(MongoDBPipeline.MONGO_BULK_WRITE_ENABLED_SETTINGS_NAME),
+            bulk_write_size=crawler.settings.getint(MongoDBPipeline.MONGO_BULK_WRITE_SIZE_SETTINGS_NAME, 500),
+            bulk_write_interval=crawler.settings.getfloat(MongoDBPipeline.MONGO_BULK_WRITE_INTERVAL_SETTINGS_NAME, 5.0),
+            geocode_cache=GeocodeCache(geocode_cache_path, resolver_class()),
+            geocode_concurrency=crawler.settings.getint(MongoDBPipeline.GEOCODE_CONCURRENCY_SETTINGS_NAME, 1),
+            geocode_rate=crawler.settings.getfloat(MongoDBPipeline.GEOCODE_RATE_SETTINGS_NAME, 1.0),
+            stats=crawler.stats,
+            ensure_indexes_enabled=crawler.settings.getbool(MongoDBPipeline.MONGO_ENSURE_INDEXES_SETTINGS_NAME, True),
+            max_pool_size=crawler.settings.getint(MongoDBPipeline.MONGO_MAX_POOL_SIZE_SETTINGS_NAME, 100),
+            storage_backend=storage_backend_class.from_settings(crawler.settings)
         )
 
+    @staticmethod
+    def mongo_uris(settings):
+        """
+        The uris can be set in the settings, otherwise they are taken from the mongoConstants module.
+        :return: The uris of the debug and the release database.
+        """
+        mongo_debug_uri = settings.get(MongoDBPipeline.MONGO_DEBUG_URI_SETTINGS_NAME)
+        if mongo_debug_uri is None and mongoConstants is not None:
+            mongo_debug_uri = mongoConstants.MONGO_DEBUG_URI
+        mongo_release_uri = settings.get(MongoDBPipeline.MONGO_RELEASE_URI_SETTINGS_NAME)
+        if mongo_release_uri is None and mongoConstants is not None:
+            mongo_release_uri = mongoConstants.MONGO_RELEASE_URI
+        return mongo_debug_uri, mongo_release_uri
+
     def open_spider(self, _):
-        """Connect to the Mongo Database."""
-        self.debug_client = pymongo.MongoClient(self.mongo_debug_uri)
-        self.debug_db = self.debug_client[self.mongo_debug_db]
+        """
+        Connect to the Mongo Database, or whatever the storage backend provides.
+        The clients are shared with the other spiders of the process. If both uris are the same, so is the client.
+        """
+        self.debug_db = self.storage_backend.open_database(self.mongo_debug_uri, self.mongo_debug_db)
+        self.release_db = self.storage_backend.open_database(self.mongo_release_uri, self.mongo_release_db)
+
+        if self.ensure_indexes_enabled:
+            ensure_indexes(self.debug_db, (self.mongo_debug_uri, self.mongo_debug_db))
+            ensure_indexes(self.release_db, (self.mongo_release_uri, self.mongo_release_db))
+
+        # Regions geocoded in earlier crawls do not have to be looked up again.
+        if self.geocode_cache is None:
+            self.geocode_cache = GeocodeCache(':memory:', NominatimResolver(self.USER_AGENT))
+        self.geocode_cache.seed(self.debug_db.Regions.find({self.DB_REGION_LATITUDE: {'$nin': ["", None]}}))
+        self.geocode_cache.seed(self.release_db.Regions.find({self.DB_REGION_LATITUDE: {'$nin': ["", None]}}))
+        self.geocode_queue = GeocodeQueue(self.geocode_cache, self.geocode_concurrency, self.geocode_rate, self.stats)
+
+        if self.bulk_write_enabled:
+            self.debug_job_writes = JobWriteBuffer(
+                self.debug_db.Jobs, self.bulk_write_size, self.bulk_write_interval, self.stats,
+                partial(self.touch_job_references, self.debug_db, self.debug_references)
+            )
+            self.release_job_writes = JobWriteBuffer(
+                self.release_db.Jobs, self.bulk_write_size, self.bulk_write_interval, self.stats,
+                partial(self.touch_job_references, self.release_db, self.release_references)
+            )
+            # An interval of 0 flushes on every item already.
+            if self.bulk_write_interval > 0:
+                self.job_writes_loop = task.LoopingCall(self.flush_job_writes_periodically)
+                self.job_writes_loop.start(self.bulk_write_interval, now=False)
 
-        self.release_client = pymongo.MongoClient(self.mongo_release_uri)
-        self.release_db = self.release_client[self.mongo_release_db]
+    def flush_job_writes(self):
+        """Writes the buffered jobs of both databases."""
+        self.debug_job_writes.flush()
+        self.release_job_writes.flush()
+
+    def flush_job_writes_periodically(self):
+        """Called by the loop, a failed flush is logged and retried with the next one instead of stopping the loop."""
+        try:
+            self.flush_job_writes()
+        except Exception:
+            logger.exception('Flushing the buffered jobs failed, they are written with the next flush.')
 
     def close_spider(self, _):
-        """Close the connection to prevent memory leaks. Also removes any old items"""
-        self.obsolete_items(self.debug_db)
-        self.obsolete_database_object(self.debug_db.Websites)
-        self.obsolete_database_object(self.debug_db.Contacts)
-        self.obsolete_database_object(self.debug_db.Queries)
-        self.obsolete_database_object(self.debug_db.Regions)
-        self.debug_client.close()
-
-        self.obsolete_items(self.release_db)
-        self.obsolete_database_object(self.release_db.Websites)
-        self.obsolete_database_object(self.release_db.Contacts)
-        self.obsolete_database_object(self.release_db.Queries)
-        self.obsolete_database_object(self.release_db.Regions)
-        self.release_client.close()
+        """
+        Close the connection to prevent memory leaks. Also removes any old items.
+        The clients are only closed once no other spider of the process uses them.
+        """
+        # Write the remaining buffered jobs before checking for obsolete ones.
+        if self.bulk_write_enabled:
+            if self.job_writes_loop is not None and self.job_writes_loop.running:
+                self.job_writes_loop.stop()
+            self.flush_job_writes()
+
+        self.obsolete_database(self.debug_db, 'debug')
+        self.storage_backend.close_database(self.mongo_debug_uri, self.mongo_debug_db)
+
+        self.obsolete_database(self.release_db, 'release')
+        self.storage_backend.close_database(self.mongo_release_uri, self.mongo_release_db)
+
+        self.geocode_cache.close()
 
     def process_item(self, item, _):
         """
@@ -180,6 +558,12 @@ class MongoDBPipeline(object):
 
         Queries work differently as, multiple search terms can have the same job.
         For this reason, if an already uploaded job comes through here, we just update the query parameter.
+
+        Regions that have never been geocoded are resolved in the background.
+        For their jobs a deferred is returned, which fires with the item once the coordinates have been stored.
+
+        Jobs marked as unchanged only hold the listing fields, their detail page has not been fetched.
+        For them only the last updated date and the queries of the stored job are updated.
         """
 
         # Already stored job
@@ -187,6 +571,9 @@ class MongoDBPipeline(object):
         if stored_item is not None:
             return stored_item
 
+        if item.get(self.JOB_UNCHANGED):
+            return self.touch_item(item)
+
         # Job has not yet been saved today
 
         website_id = self.website_id(item)
@@ -194,6 +581,53 @@ class MongoDBPipeline(object):
         query_ids = self.queries_id(item)
         contact_id = self.contact_id(item)
 
+        job_dict = self.job_dict(item, website_id, region_ids, query_ids, contact_id)
+
+        if item.get("in_development"):
+            db = self.debug_db
+            stored_items = self.stored_debug_items
+            job_writes = self.debug_job_writes
+        else:
+            db = self.release_db
+            stored_items = self.stored_release_items
+            job_writes = self.release_job_writes
+
+        if self.bulk_write_enabled:
+            # The id of the job is assigned once the buffer is flushed.
+            stored_job = stored_items.add(item, None, query_ids)
+            job_writes.add(website_id, item.get(self.JOB_TITLE), job_dict, stored_job)
+            if job_writes.should_flush():
+                job_writes.flush()
+            return self.wait_for_region(region_ids, item)
+
+        existing_job = db.Jobs.find_one(
+            {self.DB_WEBSITE_ID: website_id,
+             self.DB_TITLE: item.get(self.JOB_TITLE)},
+            {self.DB_ID: 1, self.DB_CONTENT_HASH: 1}
+        )
+
+        if existing_job:
+            if existing_job.get(self.DB_CONTENT_HASH) == job_dict[self.DB_CONTENT_HASH]:
+                # The job has not changed, skip rewriting its texts.
+                update = self.unchanged_job_dict(job_dict)
+                self.count_job_write('unchanged')
+            else:
+                update = job_dict
+                self.count_job_write('changed')
+            db.Jobs.update_one(
+                {self.DB_ID: bson.ObjectId(existing_job[self.DB_ID])},
+                {'$set': update}
+            )
+            _id = existing_job[self.DB_ID]
+        else:
+            _id = db.Jobs.insert_one(job_dict).inserted_id
+            self.count_job_write('inserted')
+
+        stored_items.add(item, _id, query_ids)
+        return self.wait_for_region(region_ids, item)
+
+    def job_dict(self, item, website_id, region_ids, query_ids, contact_id):
+        """:return: The document of the job stored in the 'Jobs' collection."""
         # Leave the query setting, since it is not complete.
         # A job can have multiple queries, but only one query is passed per item.
         # So me have to make sure the queries are up to date each day.
@@ -211,6 +645,7 @@ class MongoDBPipeline(object):
             self.DB_INFO_PHONE: item.get(self.JOB_INFO_PHONE),
             self.DB_INFO_MAIL: item.get(self.JOB_INFO_MAIL),
             self.DB_LAST_UPDATED: self.today,
+            self.DB_LAST_UPDATED_DATE: self.today_date,
             self.DB_OFFER: item.get(self.JOB_OFFER),
             self.DB_REGION_IDS: region_ids,
             self.DB_REQUIREMENTS: item.get(self.JOB_REQUIREMENTS),
@@ -220,62 +655,140 @@ class MongoDBPipeline(object):
             self.DB_URL: item.get(self.JOB_URL),
             self.DB_WEBSITE_ID: website_id,
         }
+        job_dict[self.DB_CONTENT_HASH] = self.content_hash(job_dict)
+        return job_dict
 
+    @classmethod
+    def content_hash(cls, job_dict):
+        """:return: A stable hash of all the fields of the job, except the unhashed ones."""
+        content = [(key, value) for key, value in sorted(job_dict.items())
+                   if key not in cls.DB_UNHASHED_FIELDS and key != cls.DB_CONTENT_HASH]
+        return hashlib.sha1(json_util.dumps(content).encode('utf-8')).hexdigest()
+
+    @classmethod
+    def unchanged_job_dict(cls, job_dict):
+        """:return: The fields of 'job_dict' to update on a stored job with the same content hash."""
+        return {key: job_dict[key] for key in cls.DB_UNHASHED_FIELDS}
+
+    def count_job_write(self, kind):
+        """Counts the written jobs by kind, like 'inserted', 'changed' or 'unchanged', in the crawl stats."""
+        if self.stats is not None:
+            self.stats.inc_value('jobs/%s' % kind)
+
+    def touch_item(self, item):
+        """
+        Updates the date and the queries of the stored job of an unchanged item.
+        The region and the contact of the stored job are touched as well, otherwise they would become inactive.
+        """
         if item.get("in_development"):
             db = self.debug_db
             stored_items = self.stored_debug_items
+            job_writes = self.debug_job_writes
+            references = self.debug_references
         else:
             db = self.release_db
             stored_items = self.stored_release_items
+            job_writes = self.release_job_writes
+            references = self.release_references
 
-        existing_job = db.Jobs.find_one(
+        website_id = self.website_id(item)
+        query_ids = self.queries_id(item)
+        touch_dict = self.touch_job_dict(query_ids)
+
+        if self.bulk_write_enabled:
+            stored_job = stored_items.add(item, None, query_ids)
+            job_writes.add(website_id, item.get(self.JOB_TITLE), touch_dict, stored_job)
+            if job_writes.should_flush():
+                job_writes.flush()
+            return item
+
+        existing_job = db.Jobs.find_one_and_update(
             {self.DB_WEBSITE_ID: website_id,
-             self.DB_TITLE: item.get(self.JOB_TITLE)}
+             self.DB_TITLE: item.get(self.JOB_TITLE)},
+            {'$set': touch_dict},
+            {self.DB_ID: 1, self.DB_REGION_IDS: 1, self.DB_CONTACT_ID: 1}
         )
+        if existing_job is None:
+            logger.warning('Unchanged job %r of %r is not stored, it is added once its detail page is fetched again.',
+                           item.get(self.JOB_TITLE), item.get(self.JOB_WEBSITE_NAME))
+            self.count_job_write('missing')
+            return item
 
-        if existing_job:
-            # Change the last updated only. This way we allow for user changes.
-            db.Jobs.update(
-                {self.DB_ID: bson.ObjectId(existing_job[self.DB_ID])},
-                {'$set': job_dict}
+        self.touch_job_references(db, references, [existing_job])
+        stored_items.add(item, existing_job[self.DB_ID], query_ids)
+        self.count_job_write('touched')
+        return item
+
+    def touch_job_dict(self, query_ids):
+        """:return: The fields updated on the stored job of an unchanged item."""
+        return {
+            self.DB_ACTIVE: True,
+            self.DB_LAST_UPDATED: self.today,
+            self.DB_LAST_UPDATED_DATE: self.today_date,
+            self.DB_QUERY_IDS: query_ids,
+        }
+
+    def untouched_reference_ids(self, references, jobs):
+        """
+        :param jobs: Stored jobs with their region and contact ids.
+        :return: A dict of collection name -> ids of the regions and contacts not touched today yet.
+        """
+        reference_ids = {}
+        for collection_name, field in (('Regions', self.DB_REGION_IDS), ('Contacts', self.DB_CONTACT_ID)):
+            ids = []
+            for job in jobs:
+                values = job.get(field)
+                for _id in values if isinstance(values, list) else [values]:
+                    if _id is not None and _id not in ids and references.first_touch(collection_name, _id, self.today):
+                        ids.append(_id)
+            if ids:
+                reference_ids[collection_name] = ids
+        return reference_ids
+
+    def touch_job_references(self, db, references, jobs):
+        """Sets the 'last updated' value of the regions and contacts of the stored jobs to today."""
+        for collection_name, ids in self.untouched_reference_ids(references, jobs).items():
+            db[collection_name].update_many(
+                {self.DB_ID: {'$in': ids}},
+                {'$set': {self.DB_LAST_UPDATED: self.today,
+                          self.DB_LAST_UPDATED_DATE: self.today_date}}
             )
-            _id = existing_job[self.DB_ID]
-        else:
-            _id = db.Jobs.insert(job_dict)
 
-        stored_items[item] = _id
-        return item
+    def wait_for_region(self, region_id, item):
+        """
+        :return: A deferred firing with the item if the region is still being geocoded, otherwise the item.
+        """
+        region_fill = self.region_fills.get(region_id)
+        if region_fill is None:
+            return item
+        return when_done(region_fill, item)
 
     def update_stored_item(self, item):
-        # Check if the passed item is already stored.
-        # This way we only have to update the query parameter.
+        """
+        Check if the passed item is already stored.
+        This way we only have to update the query parameter.
+        :return: The item if it has already been stored, otherwise None.
+        """
 
+        # Parse correct database.
         if item.get("in_development"):
-            stored_item_list = self.stored_debug_items
+            db = self.debug_db
+            stored_items = self.stored_debug_items
         else:
-            stored_item_list = self.stored_release_items
-
-        for stored_item, _id in stored_item_list.items():
-            # Check for the title and the website name.
-            # If they are the same we treat the job as equals.
-            if item.get(self.JOB_WEBSITE_NAME) == stored_item.get(self.JOB_WEBSITE_NAME) \
-                    and item.get(self.JOB_TITLE) == stored_item.get(self.JOB_TITLE) \
-                    and item.get(self.JOB_DATE_AVAILABILITY) == stored_item.get(self.JOB_DATE_AVAILABILITY) \
-                    and item.get(self.JOB_REGION) == stored_item.get(self.JOB_REGION):
-                # Item is already stored, just update the query.
-                # Merge old queries with new ones.
-                new_query_ids = self.queries_id(item)
-                old_query_ids = self.queries_id(stored_item)
-                query_ids = list(set(new_query_ids) | set(old_query_ids))
-
-                # Parse correct database.
-                if item.get("in_development"):
-                    db = self.debug_db
-                else:
-                    db = self.release_db
+            db = self.release_db
+            stored_items = self.stored_release_items
 
-                db.Jobs.update_one({'_id': bson.ObjectId(_id)}, {'$set': {self.DB_QUERY_IDS: query_ids}})
-                return item
+        stored_job = stored_items.get(item)
+        if stored_job is None:
+            return None
+
+        # Item is already stored, just update the query.
+        # The queries of the stored job are kept in memory, so only the new ones have to be looked up.
+        # If the job is still buffered, the merged queries are written along with it.
+        if stored_job.merge_query_ids(self.queries_id(item)) and stored_job._id is not None:
+            db.Jobs.update_one({'_id': bson.ObjectId(stored_job._id)},
+                               {'$set': {self.DB_QUERY_IDS: stored_job.query_ids}})
+        return item
 
     def website_id(self, item):
         """
@@ -286,8 +799,15 @@ class MongoDBPipeline(object):
 
         if item.get("in_development"):
             db = self.debug_db
+            references = self.debug_references
         else:
             db = self.release_db
+            references = self.release_references
+
+        website_name = item.get(self.JOB_WEBSITE_NAME) or "None Specified"
+        website_id = references.get('Websites', website_name, self.today)
+        if website_id is not None:
+            return website_id
 
         # No website has been specified
         if not item.get(self.JOB_WEBSITE_NAME):
@@ -297,16 +817,15 @@ class MongoDBPipeline(object):
             )
             if existing_none_specified_website:
                 # Update last updated
-                db.Websites.update(
-                    {self.DB_ID: bson.ObjectId(existing_none_specified_website[self.DB_ID])},
-                    {'$set': {self.DB_WEBSITE_LAST_UPDATED: self.today}}
-                )
-                return existing_none_specified_website[self.DB_ID]
+                self.touch(db.Websites, existing_none_specified_website)
+                website_id = existing_none_specified_website[self.DB_ID]
             else:
                 # Create new none specified website
                 none_website_specified_dict = {self.DB_WEBSITE_NAME: "None Specified",
-                                               self.DB_WEBSITE_LAST_UPDATED: self.today}
-                return db.Websites.insert(none_website_specified_dict)
+                                               self.DB_WEBSITE_LAST_UPDATED: self.today,
+                                               self.DB_LAST_UPDATED_DATE: self.today_date}
+                website_id = db.Websites.insert_one(none_website_specified_dict).inserted_id
+            return references.set('Websites', website_name, website_id, self.today)
 
         # Website has been specified, parse it from the database
         existing_website = db.Websites.find_one(
@@ -316,18 +835,16 @@ class MongoDBPipeline(object):
         # Website already exists in database
         if existing_website:
             # Update last updated time.
-            if existing_website[self.DB_WEBSITE_LAST_UPDATED] != self.today:
-                db.Websites.update(
-                    {self.DB_ID: existing_website[self.DB_ID]},
-                    {'$set': {self.DB_WEBSITE_LAST_UPDATED: self.today}}
-                )
-            return existing_website[self.DB_ID]
+            self.touch(db.Websites, existing_website)
+            website_id = existing_website[self.DB_ID]
         else:
             # Website does not yet exist in database
             website_dict = {self.DB_WEBSITE_NAME: item.get(self.JOB_WEBSITE_NAME),
                             self.DB_WEBSITE_URL: item.get(self.JOB_WEBSITE_URL),
-                            self.DB_WEBSITE_LAST_UPDATED: self.today}
-            return db.Websites.insert(website_dict)
+                            self.DB_WEBSITE_LAST_UPDATED: self.today,
+                            self.DB_LAST_UPDATED_DATE: self.today_date}
+            website_id = db.Websites.insert_one(website_dict).inserted_id
+        return references.set('Websites', website_name, website_id, self.today)
 
     def regions_id(self, item):
         """
@@ -338,8 +855,15 @@ class MongoDBPipeline(object):
 
         if item.get("in_development"):
             db = self.debug_db
+            references = self.debug_references
         else:
             db = self.release_db
+            references = self.release_references
+
+        region_name = item.get(self.JOB_REGION) or "None Specified"
+        region_id = references.get('Regions', region_name, self.today)
+        if region_id is not None:
+            return region_id
 
         # No region has been specified
         if not item.get(self.JOB_REGION):
@@ -347,28 +871,24 @@ class MongoDBPipeline(object):
                 {self.DB_REGION_NAME: "None Specified"}
             )
             if existing_none_specified_region:
-                db.Regions.update(
-                    {self.DB_ID: bson.ObjectId(existing_none_specified_region[self.DB_ID])},
-                    {'$set': {self.DB_REGION_LAST_UPDATED: self.today}}
-                )
-                return existing_none_specified_region[self.DB_ID]
+                self.touch(db.Regions, existing_none_specified_region)
+                region_id = existing_none_specified_region[self.DB_ID]
             else:
                 none_region_specified_dict = {self.DB_REGION_NAME: "None Specified",
-                                              self.DB_REGION_LAST_UPDATED: self.today}
-                return db.Regions.insert(none_region_specified_dict)
+                                              self.DB_REGION_LAST_UPDATED: self.today,
+                                              self.DB_LAST_UPDATED_DATE: self.today_date}
+                region_id = db.Regions.insert_one(none_region_specified_dict).inserted_id
+            return references.set('Regions', region_name, region_id, self.today)
 
         existing_region = db.Regions.find_one(
             {self.DB_REGION_NAME: item.get(self.JOB_REGION)}
         )
 
         if existing_region:
-            db.Regions.update(
-                {self.DB_ID: existing_region[self.DB_ID]},
-                {'$set': {self.DB_REGION_LAST_UPDATED: self.today}}
-            )
+            self.touch(db.Regions, existing_region)
             region_id = existing_region[self.DB_ID]
         else:
-            coordinates = self.location(item.get(self.JOB_REGION))
+            cached, coordinates = self.geocode_cache.get(item.get(self.JOB_REGION))
             latitude = ""
             longitude = ""
             address = ""
@@ -377,26 +897,54 @@ class MongoDBPipeline(object):
                 latitude = coordinates.latitude
                 longitude = coordinates.longitude
                 address = coordinates.address
-                a = coordinates.raw.get('address')
-                state = None
-                if a is not None:
-                    state = a.get('state')
+                state = coordinates.state
             region_dict = {self.DB_REGION_NAME: item.get(self.JOB_REGION),
                            self.DB_REGION_LAST_UPDATED: self.today,
+                           self.DB_LAST_UPDATED_DATE: self.today_date,
                            self.DB_REGION_LATITUDE: latitude,
                            self.DB_REGION_LONGITUDE: longitude,
                            self.DB_REGION_ADDRESS: address,
                            self.DB_REGION_STATE: state
                            }
-            region_id = db.Regions.insert(region_dict)
-        return region_id
+            region_id = db.Regions.insert_one(region_dict).inserted_id
+
+            # Regions that have never been looked up are stored without coordinates
+            # and filled in once the geocoder has answered.
+            if not cached:
+                region_fill = self.location(item.get(self.JOB_REGION))
+                region_fill.addCallback(self.fill_region, db.Regions, region_id)
+                region_fill.addErrback(self.fill_region_failed, region_name, region_id)
+                self.region_fills[region_id] = region_fill
+        return references.set('Regions', region_name, region_id, self.today)
 
     def location(self, region_name):
-        if geolocation_map.get(region_name) is not None:
-            region_name = geolocation_map[region_name]
-        geo_locator = Nominatim(user_agent=self.USER_AGENT)
-        location = geo_locator.geocode(region_name, addressdetails=True)
-        return location
+        """
+        Looks up the coordinates of the region in the geocode cache.
+        Only regions that have never been looked up are passed to the resolver, without blocking the reactor.
+        :return: A deferred firing with a GeocodeResult or None if the region could not be found.
+        """
+        return self.geocode_queue.lookup(region_name)
+
+    def fill_region(self, coordinates, db_obj, region_id):
+        """Stores the coordinates of a region, that has been inserted without them."""
+        del self.region_fills[region_id]
+        if coordinates is None:
+            return
+
+        db_obj.update_one(
+            {self.DB_ID: region_id},
+            {'$set': {self.DB_REGION_LATITUDE: coordinates.latitude,
+                      self.DB_REGION_LONGITUDE: coordinates.longitude,
+                      self.DB_REGION_ADDRESS: coordinates.address,
+                      self.DB_REGION_STATE: coordinates.state}}
+        )
+
+    def fill_region_failed(self, failure, region_name, region_id):
+        """Logs a region whose coordinates could not be stored, it keeps no coordinates."""
+        self.region_fills.pop(region_id, None)
+        logger.error('Failed to store the coordinates of %s', region_name, exc_info=failure_to_exc_info(failure))
+        if self.stats is not None:
+            self.stats.inc_value('geocode/errors')
 
     def queries_id(self, item):
         """
@@ -407,39 +955,46 @@ class MongoDBPipeline(object):
 
         if item.get("in_development"):
             db = self.debug_db
+            references = self.debug_references
         else:
             db = self.release_db
+            references = self.release_references
 
         if not item.get(self.JOB_QUERIES) or MongoDBPipeline.is_empty_list(item.get(self.JOB_QUERIES)):
+            query_id = references.get('Queries', "None Specified", self.today)
+            if query_id is not None:
+                return [query_id]
+
             existing_none_specified_query = db.Queries.find_one(
                 {self.DB_QUERY_NAME: "None Specified"}
             )
             if existing_none_specified_query:
-                db.Queries.update(
-                    {self.DB_ID: bson.ObjectId(existing_none_specified_query[self.DB_ID])},
-                    {'$set': {self.DB_WEBSITE_LAST_UPDATED: self.today}}
-                )
-                return [existing_none_specified_query[self.DB_ID]]
+                self.touch(db.Queries, existing_none_specified_query)
+                query_id = existing_none_specified_query[self.DB_ID]
             else:
                 none_query_specified_dict = {self.DB_QUERY_NAME: "None Specified",
-                                             self.DB_QUERY_LAST_UPDATED: self.today}
-                return [db.Queries.insert(none_query_specified_dict)]
+                                             self.DB_QUERY_LAST_UPDATED: self.today,
+                                             self.DB_LAST_UPDATED_DATE: self.today_date}
+                query_id = db.Queries.insert_one(none_query_specified_dict).inserted_id
+            return [references.set('Queries', "None Specified", query_id, self.today)]
 
         query_ids = []
         for query_name in item.get(self.JOB_QUERIES):
-            existing_query = db.Queries.find_one(
-                {self.DB_QUERY_NAME: query_name}
-            )
-            if existing_query:
-                db.Queries.update(
-                    {self.DB_ID: existing_query[self.DB_ID]},
-                    {'$set': {self.DB_QUERY_LAST_UPDATED: self.today}}
+            query_id = references.get('Queries', query_name, self.today)
+            if query_id is None:
+                existing_query = db.Queries.find_one(
+                    {self.DB_QUERY_NAME: query_name}
                 )
-                query_ids.append(existing_query[self.DB_ID])
-            else:
-                query_dict = {self.DB_QUERY_NAME: query_name, self.DB_QUERY_LAST_UPDATED: self.today}
-                query_id = db.Queries.insert(query_dict)
-                query_ids.append(query_id)
+                if existing_query:
+                    self.touch(db.Queries, existing_query)
+                    query_id = existing_query[self.DB_ID]
+                else:
+                    query_dict = {self.DB_QUERY_NAME: query_name,
+                                  self.DB_QUERY_LAST_UPDATED: self.today,
+                                  self.DB_LAST_UPDATED_DATE: self.today_date}
+                    query_id = db.Queries.insert_one(query_dict).inserted_id
+                references.set('Queries', query_name, query_id, self.today)
+            query_ids.append(query_id)
         return query_ids
 
     @staticmethod
@@ -458,8 +1013,18 @@ class MongoDBPipeline(object):
 
         if item.get("in_development"):
             db = self.debug_db
+            references = self.debug_references
         else:
             db = self.release_db
+            references = self.release_references
+
+        contact_key = (item.get(self.JOB_CONTACT_NAME),
+                       item.get(self.JOB_CONTACT_PHONE),
+                       item.get(self.JOB_CONTACT_FIELD),
+                       item.get(self.JOB_CONTACT_MAIL))
+        contact_id = references.get('Contacts', contact_key, self.today)
+        if contact_id is not None:
+            return contact_id
 
         if not item.get(self.JOB_CONTACT_FIELD)\
                 and not item.get(self.JOB_CONTACT_MAIL) \
@@ -469,15 +1034,14 @@ class MongoDBPipeline(object):
                 {self.DB_CONTACT_NAME: "None Specified"}
             )
             if existing_none_specified_contact:
-                db.Contacts.update(
-                    {self.DB_ID: bson.ObjectId(existing_none_specified_contact[self.DB_ID])},
-                    {'$set': {self.DB_CONTACT_LAST_UPDATED: self.today}}
-                )
-                return existing_none_specified_contact[self.DB_ID]
+                self.touch(db.Contacts, existing_none_specified_contact)
+                contact_id = existing_none_specified_contact[self.DB_ID]
             else:
                 none_contact_specified_dict = {self.DB_CONTACT_NAME: "None Specified",
-                                               self.DB_CONTACT_LAST_UPDATED: self.today}
-                return db.Contacts.insert(none_contact_specified_dict)
+                                               self.DB_CONTACT_LAST_UPDATED: self.today,
+                                               self.DB_LAST_UPDATED_DATE: self.today_date}
+                contact_id = db.Contacts.insert_one(none_contact_specified_dict).inserted_id
+            return references.set('Contacts', contact_key, contact_id, self.today)
 
         contact_dict = {
             self.DB_CONTACT_NAME: item.get(self.JOB_CONTACT_NAME),
@@ -490,36 +1054,103 @@ class MongoDBPipeline(object):
             contact_dict
         )
         if existing_contact:
-            db.Contacts.update(
-                {self.DB_ID: existing_contact[self.DB_ID]},
-                {'$set': {self.DB_QUERY_LAST_UPDATED: self.today}}
-            )
-            return existing_contact[self.DB_ID]
+            self.touch(db.Contacts, existing_contact)
+            contact_id = existing_contact[self.DB_ID]
         else:
             contact_dict[self.DB_QUERY_LAST_UPDATED] = self.today
-            return db.Contacts.insert(contact_dict)
+            contact_dict[self.DB_LAST_UPDATED_DATE] = self.today_date
+            contact_id = db.Contacts.insert_one(contact_dict).inserted_id
+        return references.set('Contacts', contact_key, contact_id, self.today)
 
-    def obsolete_items(self, db):
-        jobs = db.Jobs.find()
-        for job in jobs:
-            website_id = job[self.DB_WEBSITE_ID]
-            website = db.Websites.find_one({'_id': website_id})
-            if not website:
-                active = job[self.DB_LAST_UPDATED] == datetime.now().strftime(time_format)
-            else:
-                active = website[self.DB_WEBSITE_LAST_UPDATED] == job[self.DB_LAST_UPDATED]
-            db.Jobs.update(
-                {self.DB_ID: bson.ObjectId(job[self.DB_ID])},
-                {'$set': {self.DB_ACTIVE: active}}
+    def touch(self, db_obj, document):
+        """Sets the 'last updated' value of the passed document to today, unless it already is."""
+        if document.get(self.DB_LAST_UPDATED) != self.today or self.DB_LAST_UPDATED_DATE not in document:
+            db_obj.update_one(
+                {self.DB_ID: bson.ObjectId(document[self.DB_ID])},
+                {'$set': {self.DB_LAST_UPDATED: self.today,
+                          self.DB_LAST_UPDATED_DATE: self.today_date}}
             )
 
+    def obsolete_items(self, db):
+        """
+        Updates the 'active' value of all jobs.
+        A job is active if it has been updated on the same day as its website.
+        Jobs whose website does not exist anymore are active if they have been updated today.
+
+        The jobs are updated on the server, with two updates per website instead of one per job.
+        """
+        website_ids = []
+        for website in db.Websites.find({}, {self.DB_WEBSITE_LAST_UPDATED: 1, self.DB_LAST_UPDATED_DATE: 1}):
+            website_ids.append(website[self.DB_ID])
+            self.set_active(db.Jobs,
+                            {self.DB_WEBSITE_ID: website[self.DB_ID]},
+                            self.last_updated_date(website))
+
+        self.set_active(db.Jobs, {self.DB_WEBSITE_ID: {'$nin': website_ids}}, self.today_date)
+
+    def last_updated_date(self, document):
+        """:return: The day the document has been updated on, parsed from the string if the date is missing."""
+        last_updated_date = document.get(self.DB_LAST_UPDATED_DATE)
+        if last_updated_date is None:
+            last_updated_date = datetime.strptime(document[self.DB_LAST_UPDATED], time_format)
+        return last_updated_date
+
+    def set_active(self, db_obj, query, last_updated_date):
+        """
+        Marks the documents matching the query as active if they have been updated on the day 'last_updated_date',
+        all others as inactive. Documents that already have the correct value are not written.
+        """
+        active_query, inactive_query = self.active_queries(query, last_updated_date)
+        db_obj.update_many(active_query, {'$set': {self.DB_ACTIVE: True}})
+        db_obj.update_many(inactive_query, {'$set': {self.DB_ACTIVE: False}})
+
+    def active_queries(self, query, last_updated_date):
+        """
+        Splits the documents matching the query by whether they have been updated on the day 'last_updated_date'.
+        Documents without a 'last updated' date have not been updated since it has been introduced,
+        their 'last updated' string is compared instead.
+        :return: The queries of the documents to mark active and inactive.
+        """
+        start = datetime.combine(last_updated_date.date(), datetime.min.time())
+        end = start + timedelta(days=1)
+        last_updated = last_updated_date.strftime(time_format)
+
+        active_query = dict(query)
+        active_query['$or'] = [{self.DB_LAST_UPDATED_DATE: {'$gte': start, '$lt': end}},
+                               {self.DB_LAST_UPDATED_DATE: {'$exists': False},
+                                self.DB_LAST_UPDATED: last_updated}]
+        active_query[self.DB_ACTIVE] = {'$ne': True}
+
+        inactive_query = dict(query)
+        inactive_query['$or'] = [{self.DB_LAST_UPDATED_DATE: {'$lt': start}},
+                                 {self.DB_LAST_UPDATED_DATE: {'$gte': end}},
+                                 {self.DB_LAST_UPDATED_DATE: {'$exists': False},
+                                  self.DB_LAST_UPDATED: {'$ne': last_updated}}]
+        inactive_query[self.DB_ACTIVE] = {'$ne': False}
+        return active_query, inactive_query
+
+    def obsolete_database(self, db, name):
+        """
+        Updates the 'active' value of the jobs and all reference collections of the database.
+        The time spent on each collection is logged and stored in the crawl stats.
+        :param name: The name of the database in the report, 'debug' or 'release'.
+        """
+        self.report_obsolete_time(name, 'Jobs', self.obsolete_items, db)
+        for collection_name in ('Websites', 'Contacts', 'Queries', 'Regions'):
+            self.report_obsolete_time(name, collection_name, self.obsolete_database_object, db[collection_name])
+
+    def report_obsolete_time(self, db_name, collection_name, obsolete, *args):
+        start = time.time()
+        obsolete(*args)
+        elapsed = time.time() - start
+
+        logger.info('Updated the active values of %s.%s in %.3f s', db_name, collection_name, elapsed)
+        if self.stats is not None:
+            self.stats.set_value('obsolete/%s/%s/seconds' % (db_name, collection_name), elapsed)
+
     def obsolete_database_object(self, db_obj):
-        objects = db_obj.find()
-        for cur_object in objects:
-            last_updated = cur_object[self.DB_LAST_UPDATED]
-            today = datetime.now().strftime(time_format)
-            active = last_updated == today
-            db_obj.update(
-                {self.DB_ID: bson.ObjectId(cur_object[self.DB_ID])},
-                {'$set': {self.DB_ACTIVE: active}}
-            )
+        """
+        Updates the 'active' value of a reference collection.
+        Documents are active if they have been updated today.
+        """
+        self.set_active(db_obj, {}, self.today_date)
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+#
+#  prefetch.py
+#  Medalytik
+#
+#  Speculative prefetching of the listing pages of sites that do not tell the number of pages up front.
+#
+#  Requesting the next page after the current one has been parsed turns the pagination into a serial chain
+#  of round trips. The PagePrefetcher keeps up to 'depth' pages ahead of the last parsed page requested instead,
+#  so these pages are downloaded concurrently:
+#
+#      page 0 parsed  ->  pages 1 .. depth requested
+#      page 1 parsed  ->  page depth + 1 requested
+#      ...
+#
+#  Every listing is keyed, for example by its query, and its end is reported by the spider,
+#  once a page is empty or is the last one. No pages beyond the end are requested from then on,
+#  and the pages beyond the end already requested are dropped by the spider, they are counted as wasted.
+#  A depth of 1 requests one page after the other.
+#
+#  The depth is set with the PREFETCH_MAX_DEPTH setting.
+#
+
+DEFAULT_DEPTH = 5
+
+
+class PagePrefetcher(object):
+    """Tracks the requested pages and the end of every listing."""
+
+    def __init__(self, depth=DEFAULT_DEPTH):
+        self.depth = max(1, depth)
+        # key -> highest requested page
+        self.frontier = {}
+        # key -> first page without results
+        self.ends = {}
+        self.requested = 0
+        self.wasted = 0
+
+    @classmethod
+    def from_spider(cls, spider, default=DEFAULT_DEPTH):
+        """:return: A prefetcher with the depth of the settings, spiders created without a crawler use the default."""
+        settings = getattr(spider, 'settings', None)
+        if settings is None:
+            return cls(default)
+        return cls(settings.getint('PREFETCH_MAX_DEPTH', default))
+
+    def start(self, key):
+        """Starts a listing. :return: The first page to request."""
+        self.frontier[key] = 0
+        self.requested += 1
+        return 0
+
+    def end(self, key, page):
+        """Sets the end of the listing, 'page' is the first page without results."""
+        self.ends[key] = min(self.ends.get(key, page), page)
+
+    def is_beyond_end(self, key, page):
+        """:return: True if the page lies beyond the end of the listing. Counts the page as wasted."""
+        end = self.ends.get(key)
+        if end is not None and page >= end:
+            self.wasted += 1
+            return True
+        return False
+
+    def advance(self, key, page):
+        """
+        Called once a page with results has been parsed.
+        :return: The pages to request, up to 'depth' pages ahead of the parsed one.
+        """
+        target = page + self.depth
+        end = self.ends.get(key)
+        if end is not None:
+            target = min(target, end - 1)
+        frontier = self.frontier[key]
+        if target <= frontier:
+            return []
+        self.frontier[key] = target
+        self.requested += target - frontier
+        return list(range(frontier + 1, target + 1))
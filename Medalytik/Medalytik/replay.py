@@ -0,0 +1,346 @@
+# -*- coding: utf-8 -*-
+#
+#  replay.py
+#  Medalytik
+#
+#  Records the responses of a crawl and replays them through the spider callbacks without any network access.
+#
+#  A corpus consists of two files per spider inside the corpus directory:
+#      - '<spider>.jsonl.gz' holds the arguments of the spider in the first line,
+#        followed by one line per request with the recorded response.
+#      - '<spider>.items.json' holds the items the spider returned while recording.
+#
+#  Record a corpus, this runs a real crawl without writing to the database:
+#      python -m Medalytik.replay record usz -a queries=[Bildung/Praktika]
+#  Replay it, compare the items with the recorded ones and report the parse times of each callback:
+#      python -m Medalytik.replay check usz
+#  Pass --update to accept the items of the replay as the new expected items, for example after fixing a parser.
+#
+#  The replay starts with the start requests of the spider and follows every request the callbacks return,
+#  requests whose response has not been recorded are counted as missing.
+#  Like the crawl, duplicate requests are filtered by their fingerprints, the output of the callbacks passes
+#  the DetailDedupMiddleware and error responses are passed to the errbacks.
+#
+
+import argparse
+import base64
+from collections import OrderedDict
+import gzip
+import hashlib
+import json
+import os
+import sys
+import time
+
+from scrapy import Request, signals
+from scrapy.crawler import CrawlerProcess
+from scrapy.exceptions import NotConfigured
+from scrapy.http import Headers
+from scrapy.responsetypes import responsetypes
+from scrapy.spidermiddlewares.httperror import HttpError, HttpErrorMiddleware
+from scrapy.spiderloader import SpiderLoader
+from scrapy.utils.project import get_project_settings
+from scrapy.utils.spider import iterate_spider_output
+from twisted.python.failure import Failure
+
+from .fingerprints import fingerprint
+from .middlewares import DetailDedupMiddleware
+
+DEFAULT_CORPUS_DIR = 'corpus'
+
+
+def corpus_path(directory, spider_name):
+    return os.path.join(directory, spider_name + '.jsonl.gz')
+
+
+def items_path(directory, spider_name):
+    return os.path.join(directory, spider_name + '.items.json')
+
+
+def request_key(request):
+    """
+    :return: The key of the recorded response of a request.
+    Requests of different cookie sessions are told apart, spiders like MTADialog request the same url in each session.
+    """
+    body_hash = hashlib.sha1(request.body).hexdigest() if request.body else ''
+    return '%s %s %s %s' % (request.method, request.url, body_hash, request.meta.get('cookiejar', ''))
+
+
+def canonical_item(item):
+    """
+    :return: The item as a JSON string with sorted keys, so items can be compared and sorted.
+    The queries are sorted as well, the order they are merged in depends on the order of the responses.
+    """
+    item = dict(item)
+    if item.get('queries'):
+        item['queries'] = sorted(item['queries'])
+    return json.dumps(item, sort_keys=True, default=str, ensure_ascii=False)
+
+
+class RecorderMiddleware(object):
+    """
+    Downloader middleware that writes every response to the corpus of the spider.
+    Enabled by the 'record' command through the REPLAY_RECORD_DIR setting.
+    """
+
+    def __init__(self, directory, spider_args):
+        self.directory = directory
+        self.spider_args = spider_args
+        self.file = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        directory = crawler.settings.get('REPLAY_RECORD_DIR')
+        if not directory:
+            raise NotConfigured
+        s = cls(directory, crawler.settings.getdict('REPLAY_SPIDER_ARGS'))
+        crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(s.spider_closed, signal=signals.spider_closed)
+        return s
+
+    def spider_opened(self, spider):
+        os.makedirs(self.directory, exist_ok=True)
+        self.file = gzip.open(corpus_path(self.directory, spider.name), 'wt', encoding='utf-8')
+        self.write({'spider': spider.name, 'args': self.spider_args})
+
+    def spider_closed(self, spider):
+        self.file.close()
+
+    def write(self, record):
+        self.file.write(json.dumps(record) + '\n')
+
+    def process_request(self, request, spider):
+        # Redirected requests keep the key of the request the spider returned.
+        request.meta.setdefault('replay_key', request_key(request))
+        return None
+
+    def process_response(self, request, response, spider):
+        self.write({
+            'key': request.meta.get('replay_key', request_key(request)),
+            'url': response.url,
+            'status': response.status,
+            'headers': {key.decode('latin-1'): [value.decode('latin-1') for value in values]
+                        for key, values in response.headers.items()},
+            'body': base64.b64encode(response.body).decode('ascii'),
+        })
+        return response
+
+
+class CallbackStats(object):
+    """The parse times of one callback."""
+
+    def __init__(self):
+        self.pages = 0
+        self.items = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+
+    def add(self, seconds, items):
+        self.pages += 1
+        self.items += items
+        self.seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+
+
+class Replay(object):
+    """Replays a recorded corpus through a spider."""
+
+    def __init__(self, spider_class, directory=DEFAULT_CORPUS_DIR, settings=None):
+        self.spider_class = spider_class
+        self.directory = directory
+        self.settings = settings if settings is not None else get_project_settings()
+
+        with gzip.open(corpus_path(directory, spider_class.name), 'rt', encoding='utf-8') as file:
+            self.spider_args = json.loads(next(file))['args']
+            self.records = {}
+            for line in file:
+                record = json.loads(line)
+                self.records[record['key']] = record
+
+    def response(self, request):
+        """:return: The recorded response of the request or None if it has not been recorded."""
+        record = self.records.get(request_key(request))
+        if record is None:
+            return None
+        headers = Headers(record['headers'])
+        body = base64.b64decode(record['body'])
+        response_class = responsetypes.from_args(headers=headers, url=record['url'], body=body)
+        return response_class(url=record['url'], status=record['status'], headers=headers, body=body,
+                              request=request)
+
+    def run(self):
+        """
+        Follows all requests of the spider through the recorded responses.
+        :return: A tuple (items, missing requests, stats by callback name).
+        """
+        spider = self.spider_class(**self.spider_args)
+        http_error = HttpErrorMiddleware(self.settings)
+        detail_dedup = DetailDedupMiddleware() if self.settings.getbool('DETAIL_DEDUP_ENABLED') else None
+        requests = []
+        fingerprints = set()
+        items = []
+        missing = 0
+        stats = OrderedDict()
+
+        def schedule(request):
+            if not request.dont_filter:
+                request_fingerprint = fingerprint(request)
+                if request_fingerprint in fingerprints:
+                    return
+                fingerprints.add(request_fingerprint)
+            requests.append(request)
+
+        for request in spider.start_requests():
+            schedule(request)
+
+        while requests:
+            request = requests.pop(0)
+            response = self.response(request)
+            if response is None:
+                missing += 1
+                continue
+
+            callback = request.callback or spider.parse
+            start = time.perf_counter()
+            try:
+                http_error.process_spider_input(response, spider)
+            except HttpError as error:
+                output = iterate_spider_output(request.errback(Failure(error))) if request.errback else []
+            else:
+                output = iterate_spider_output(callback(response))
+                if detail_dedup is not None:
+                    output = detail_dedup.process_spider_output(response, output, spider)
+            output = list(output)
+            elapsed = time.perf_counter() - start
+
+            page_items = 0
+            for element in output:
+                if isinstance(element, Request):
+                    schedule(element)
+                else:
+                    items.append(element)
+                    page_items += 1
+            stats.setdefault(callback.__name__, CallbackStats()).add(elapsed, page_items)
+
+        return items, missing, stats
+
+    def expected_items(self):
+        with open(items_path(self.directory, self.spider_class.name), encoding='utf-8') as file:
+            return json.load(file)
+
+    def write_items(self, items):
+        with open(items_path(self.directory, self.spider_class.name), 'w', encoding='utf-8') as file:
+            json.dump(sorted(canonical_item(item) for item in items), file, indent=1, ensure_ascii=False)
+
+
+def compare_items(expected, items):
+    """:return: A tuple (missing, unexpected) of the canonical items that differ."""
+    expected = sorted(expected)
+    actual = sorted(canonical_item(item) for item in items)
+    missing = [item for item in expected if item not in actual]
+    unexpected = [item for item in actual if item not in expected]
+    return missing, unexpected
+
+
+def report(spider_name, stats, missing):
+    pages = sum(callback_stats.pages for callback_stats in stats.values())
+    seconds = sum(callback_stats.seconds for callback_stats in stats.values())
+    print('%s: %d pages in %.3f s, %.0f pages/s, %d requests not recorded' % (
+        spider_name, pages, seconds, pages / seconds if seconds else 0, missing))
+    print('  %-24s %8s %10s %8s %12s %12s' % ('callback', 'pages', 'pages/s', 'items', 'ms/item', 'max ms/page'))
+    for name, callback_stats in stats.items():
+        print('  %-24s %8d %10.0f %8d %12.3f %12.3f' % (
+            name,
+            callback_stats.pages,
+            callback_stats.pages / callback_stats.seconds if callback_stats.seconds else 0,
+            callback_stats.items,
+            1000 * callback_stats.seconds / callback_stats.items if callback_stats.items else 0,
+            1000 * callback_stats.max_seconds,
+        ))
+
+
+def record(spider_name, spider_args, directory):
+    """Crawls with the spider and records its responses and items, nothing is written to the database."""
+    settings = get_project_settings()
+    downloader_middlewares = settings.getdict('DOWNLOADER_MIDDLEWARES')
+    # After the decompression and the redirects, so the final body of the page is recorded.
+    downloader_middlewares['Medalytik.replay.RecorderMiddleware'] = 560
+    settings.setdict({
+        'REPLAY_RECORD_DIR': directory,
+        'REPLAY_SPIDER_ARGS': spider_args,
+        'DOWNLOADER_MIDDLEWARES': downloader_middlewares,
+        'ITEM_PIPELINES': {},
+        # Every page has to be downloaded to be recorded.
+        'INCREMENTAL_ENABLED': False,
+        'CONDITIONAL_GET_ENABLED': False,
+        'HTTPCACHE_ENABLED': False,
+    }, priority='cmdline')
+
+    items = []
+
+    def item_scraped(item):
+        items.append(item)
+
+    process = CrawlerProcess(settings)
+    crawler = process.create_crawler(SpiderLoader.from_settings(settings).load(spider_name))
+    crawler.signals.connect(item_scraped, signal=signals.item_scraped)
+    process.crawl(crawler, **spider_args)
+    process.start()
+
+    replay = Replay(crawler.spidercls, directory, settings)
+    replay.write_items(items)
+    print('Recorded %d responses and %d items of %s.' % (len(replay.records), len(items), spider_name))
+
+
+def check(spider_name, directory, update):
+    """Replays the corpus of the spider. :return: True if the items match the recorded ones."""
+    settings = get_project_settings()
+    replay = Replay(SpiderLoader.from_settings(settings).load(spider_name), directory, settings)
+    items, missing, stats = replay.run()
+    report(spider_name, stats, missing)
+
+    if update:
+        replay.write_items(items)
+        print('  Updated the expected items, %d items.' % len(items))
+        return True
+
+    missing_items, unexpected_items = compare_items(replay.expected_items(), items)
+    for item in missing_items:
+        print('  - %s' % item)
+    for item in unexpected_items:
+        print('  + %s' % item)
+    if missing_items or unexpected_items:
+        print('  %d expected items missing, %d unexpected items.' % (len(missing_items), len(unexpected_items)))
+        return False
+    print('  All %d items match.' % len(items))
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--corpus', default=DEFAULT_CORPUS_DIR, help='The directory of the corpus.')
+    subparsers = parser.add_subparsers(dest='command')
+
+    record_parser = subparsers.add_parser('record')
+    record_parser.add_argument('spider')
+    record_parser.add_argument('-a', dest='arguments', action='append', default=[], metavar='NAME=VALUE',
+                               help='An argument of the spider, like with scrapy crawl.')
+
+    check_parser = subparsers.add_parser('check')
+    check_parser.add_argument('spiders', nargs='*', help='Defaults to all spiders with a corpus.')
+    check_parser.add_argument('--update', action='store_true')
+
+    args = parser.parse_args()
+    if args.command == 'record':
+        record(args.spider, dict(argument.split('=', 1) for argument in args.arguments), args.corpus)
+    elif args.command == 'check':
+        spiders = args.spiders or sorted(name[:-len('.jsonl.gz')] for name in os.listdir(args.corpus)
+                                         if name.endswith('.jsonl.gz'))
+        results = [check(spider_name, args.corpus, args.update) for spider_name in spiders]
+        sys.exit(0 if all(results) else 1)
+    else:
+        parser.print_help()
+
+
+if __name__ == '__main__':
+    main()
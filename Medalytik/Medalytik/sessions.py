@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+#
+#  sessions.py
+#  Medalytik
+#
+#  A pool of cookie sessions for the sites that keep the search state in the session and only page with 'next'.
+#
+#  One session per query walks the result pages strictly one after another.
+#  The pool opens up to 'size' sessions per query instead, each one seeded with the same search
+#  and started at a different page, so the pages of one query are downloaded in parallel:
+#
+#      session 0   1 -> 2 -> 3                 walks from the first page until the start of session 1
+#      session 1   search, jump to 4 -> 5 -> 6 walks until the start of session 2
+#      session 2   search, jump to 7 -> 8 ...  walks until the last page
+#
+#  A session only ends another one once its jump has been confirmed, its first page differs from the first page
+#  of the search. If the site ignores the jump, the previous session walks on and nothing is lost.
+#  The jobs of the sessions are merged by their url, pages seen twice while the sessions overtake each other
+#  are dropped.
+#
+#  The pool also measures the throughput of every query: pages, jobs and the time from the first request
+#  to the last response.
+#
+
+import time
+
+
+class QuerySessions(object):
+    """The sessions and the throughput of one query."""
+
+    def __init__(self, query):
+        self.query = query
+        # session -> page the session starts at
+        self.starts = {0: 1}
+        self.confirmed = {0}
+        self.first_page_urls = None
+        self.seen_urls = set()
+        self.pages = 0
+        self.jobs = 0
+        self.started = time.time()
+        self.finished = self.started
+
+    @property
+    def seconds(self):
+        return self.finished - self.started
+
+
+class SessionPool(object):
+    """Splits the result pages of every query over several cookie sessions."""
+
+    def __init__(self, size):
+        self.size = max(1, size)
+        # query -> QuerySessions
+        self.queries = {}
+
+    def query(self, query):
+        sessions = self.queries.get(query)
+        if sessions is None:
+            sessions = self.queries[query] = QuerySessions(query)
+        return sessions
+
+    @staticmethod
+    def cookiejar(query, session):
+        """:return: The cookiejar of a session, the same for every crawl so recorded responses can be replayed."""
+        return '%s#%d' % (query, session)
+
+    def assign(self, query, first_page_urls, pages):
+        """
+        Assigns the start pages of the other sessions of a query, once its first page has been parsed.
+        :param first_page_urls: The job urls of the first page, to confirm the jumps of the other sessions.
+        :param pages: The page numbers the first page links to directly.
+        :return: A list of (session, start page) tuples of the sessions to open.
+        """
+        sessions = self.query(query)
+        sessions.first_page_urls = set(first_page_urls)
+        # Session 0 walks on to page 2 itself.
+        pages = sorted(page for page in set(pages) if page > 2)
+        count = min(self.size - 1, len(pages))
+        starts = [pages[(i * len(pages)) // count] for i in range(count)] if count else []
+        assigned = list(enumerate(starts, 1))
+        sessions.starts.update(assigned)
+        return assigned
+
+    def confirm(self, query, session, urls):
+        """
+        Confirms the jump of a session with the job urls of its first page.
+        :return: True if the session reached its start page, False if the site ignored the jump.
+        """
+        sessions = self.query(query)
+        if set(urls) == sessions.first_page_urls:
+            return False
+        sessions.confirmed.add(session)
+        return True
+
+    def end(self, query, session):
+        """:return: The page the session stops before, the start of the next confirmed session, or None."""
+        sessions = self.query(query)
+        start = sessions.starts[session]
+        ends = [sessions.starts[other] for other in sessions.confirmed if sessions.starts[other] > start]
+        return min(ends) if ends else None
+
+    def add_page(self, query, urls):
+        """
+        Counts a parsed page of the query.
+        :return: The urls not seen on any other page of the query.
+        """
+        sessions = self.query(query)
+        sessions.pages += 1
+        sessions.finished = time.time()
+        new_urls = [url for url in urls if url not in sessions.seen_urls]
+        sessions.seen_urls.update(new_urls)
+        sessions.jobs += len(new_urls)
+        return new_urls
+
+    def stats(self):
+        """:return: A dict of query -> (pages, jobs, seconds)."""
+        return {query: (sessions.pages, sessions.jobs, sessions.seconds) for query, sessions in self.queries.items()}
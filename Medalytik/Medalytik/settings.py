@@ -24,6 +24,10 @@ ROBOTSTXT_OBEY = True
 # Configure maximum concurrent requests performed by Scrapy (default: 16)
 #CONCURRENT_REQUESTS = 32
 
+# Number of listing pages requested ahead of the last parsed one by the spiders that prefetch their pagination.
+# 1 requests one page after the other.
+#PREFETCH_MAX_DEPTH = 5
+
 # Configure a delay for requests for the same website (default: 0)
 # See https://doc.scrapy.org/en/latest/topics/settings.html#download-delay
 # See also autothrottle settings and docs
@@ -46,15 +50,39 @@ ROBOTSTXT_OBEY = True
 
 # Enable or disable spider middlewares
 # See https://doc.scrapy.org/en/latest/topics/spider-middleware.html
-#SPIDER_MIDDLEWARES = {
-#    'Medalytik.middlewares.MedalytikSpiderMiddleware': 543,
-#}
+SPIDER_MIDDLEWARES = {
+    'Medalytik.middlewares.ConditionalGetSpiderMiddleware': 560,
+    'Medalytik.middlewares.IncrementalCrawlMiddleware': 550,
+    'Medalytik.middlewares.DetailDedupMiddleware': 540,
+}
+
+# Spiders enable incremental crawling with INCREMENTAL_ENABLED in their custom settings.
+# The crawled jobs are stored in a SQLite file inside the project data directory,
+# their detail pages are fetched again once they are INCREMENTAL_REFETCH_DAYS old.
+#INCREMENTAL_ENABLED = False
+#INCREMENTAL_INDEX_PATH = 'known_jobs.sqlite'
+#INCREMENTAL_REFETCH_DAYS = 7
+
+# The detail page of a job listed for several queries is downloaded only once, the queries are merged into a single job.
+# Needed by every spider now that duplicate requests are filtered, the filter would drop the queries of the duplicates.
+DETAIL_DEDUP_ENABLED = True
+
+# Duplicate requests are filtered with the fingerprints of fingerprints.py, the spiders do not set 'dont_filter'.
+# The filtered detail and listing requests are counted in the stats.
+REQUEST_FINGERPRINTER_CLASS = 'Medalytik.fingerprints.RequestFingerprinter'
+DUPEFILTER_CLASS = 'Medalytik.fingerprints.JobBoardDupeFilter'
 
 # Enable or disable downloader middlewares
 # See https://doc.scrapy.org/en/latest/topics/downloader-middleware.html
-#DOWNLOADER_MIDDLEWARES = {
-#    'Medalytik.middlewares.MedalytikDownloaderMiddleware': 543,
-#}
+DOWNLOADER_MIDDLEWARES = {
+    'Medalytik.middlewares.ConditionalGetMiddleware': 580,
+}
+
+# Detail pages are requested with the ETag and Last-Modified values of their last response.
+# The validators and the parsed jobs are stored in a SQLite file inside the project data directory.
+# Enables the ConditionalGetMiddleware and the ConditionalGetSpiderMiddleware, which replays the unmodified pages.
+#CONDITIONAL_GET_ENABLED = True
+#CONDITIONAL_GET_STORE_PATH = 'validators.sqlite'
 
 # Enable or disable extensions
 # See https://doc.scrapy.org/en/latest/topics/extensions.html
@@ -83,13 +111,65 @@ ITEM_PIPELINES = {
 
 # Enable and configure HTTP caching (disabled by default)
 # See https://doc.scrapy.org/en/latest/topics/downloader-middleware.html#httpcache-middleware-settings
+# Enable it while working on the parsers, for example with 'scrapy crawl usz -s HTTPCACHE_ENABLED=1'.
+# The responses of each spider are stored compressed in '<HTTPCACHE_DIR>/<spider>.sqlite'.
+# HTTPCACHE_RULES is a list of (method, url pattern, expiration) tuples, spiders set their own in their custom settings.
+# An expiration of None never caches the matching requests, 0 never expires them.
+# Detail pages expire after HTTPCACHE_DETAIL_EXPIRATION_SECS, all other pages after HTTPCACHE_EXPIRATION_SECS.
 #HTTPCACHE_ENABLED = True
 #HTTPCACHE_EXPIRATION_SECS = 0
+#HTTPCACHE_DETAIL_EXPIRATION_SECS = 86400
+#HTTPCACHE_RULES = []
 #HTTPCACHE_DIR = 'httpcache'
 #HTTPCACHE_IGNORE_HTTP_CODES = []
-#HTTPCACHE_STORAGE = 'scrapy.extensions.httpcache.FilesystemCacheStorage'
+#HTTPCACHE_COMPRESSION = 'zstd'
+HTTPCACHE_STORAGE = 'Medalytik.httpcache.SQLiteCacheStorage'
+HTTPCACHE_POLICY = 'Medalytik.httpcache.JobBoardCachePolicy'
 
 # Database configuration
 
 MONGO_RELEASE_DB = 'Medalytik'
 MONGO_DEBUG_DB = 'Medalytik'
+
+# The uris of the databases. If not set, they are taken from the 'mongoConstants' module.
+#MONGO_RELEASE_URI = 'mongodb://localhost:27017'
+#MONGO_DEBUG_URI = 'mongodb://localhost:27017'
+
+# Where the databases are stored.
+# 'Medalytik.storage.EmbeddedBackend' keeps them in memory with mongomock, no Mongo server is needed.
+# Set STORAGE_EMBEDDED_PATH to keep the embedded databases between crawls.
+#STORAGE_BACKEND = 'Medalytik.storage.MongoBackend'
+#STORAGE_EMBEDDED_PATH = 'embedded_db'
+
+# All spiders of a process share one Mongo client per uri.
+# The maximum number of connections of each client.
+#MONGO_MAX_POOL_SIZE = 100
+
+# To write without blocking the reactor, use the Motor based pipeline on the asyncio reactor.
+# The number of items written at the same time is limited by MONGO_ASYNC_CONCURRENCY.
+#TWISTED_REACTOR = 'twisted.internet.asyncioreactor.AsyncioSelectorReactor'
+#ITEM_PIPELINES = {
+#    'Medalytik.motor_pipeline.MotorMongoDBPipeline': 300,
+#}
+#MONGO_ASYNC_CONCURRENCY = 16
+
+# Create the indexes of the pipeline lookups when the first spider opens.
+#MONGO_ENSURE_INDEXES = True
+
+# Buffer the job writes and send them as bulk writes.
+# The buffer is flushed once it holds MONGO_BULK_WRITE_SIZE jobs,
+# every MONGO_BULK_WRITE_INTERVAL seconds, also while no items come in, and when the spider closes.
+#MONGO_BULK_WRITE_ENABLED = True
+#MONGO_BULK_WRITE_SIZE = 500
+#MONGO_BULK_WRITE_INTERVAL = 5
+
+# Geocoded regions are stored in a SQLite file inside the project data directory,
+# so every region only has to be looked up once.
+# Set the resolver to 'Medalytik.geocoding.StaticResolver' to run without network access.
+#GEOCODE_CACHE_PATH = 'geocode.sqlite'
+#GEOCODE_RESOLVER = 'Medalytik.geocoding.NominatimResolver'
+
+# Regions that are not cached yet are geocoded in the background by at most GEOCODE_CONCURRENCY threads,
+# limited to GEOCODE_RATE lookups per second. Nominatim allows one request per second.
+#GEOCODE_CONCURRENCY = 1
+#GEOCODE_RATE = 1.0
@@ -7,6 +7,9 @@
 #  Copyright © 2018 Jorge Paravicini. All rights reserved.
 #
 
+import re
+import time
+
 import scrapy
 from ..items import Job
 
@@ -142,12 +145,39 @@ id_query = "tx_dmmjobcontrol_pi1%5Bsearch%5D%5Bdiscipline%5D%5B%5D="
 page_query = "tx_dmmjobcontrol_pi1%5Bpage%5D="
 
 
+# The page number of a link of the page browser, the brackets may or may not be escaped.
+page_link_pattern = re.compile(r'tx_dmmjobcontrol_pi1(?:%5B|\[)page(?:%5D|\])=(\d+)')
+
+
 def url_from_query(query, page=1):
     return url + "?" + search_query + "&" + id_query + str(query) + "&" + page_query + str(page)
 
 
+JOB_CONTAINERS_XPATH = "//*[@class='dmmjobcontrol_list_item']"
+NEXT_PAGE_XPATH = '//*[@class="dmmjobcontrol_pagebrowser_next"]'
+# The links of the page browser only, the page browser and its parts all carry a dmmjobcontrol_pagebrowser class.
+PAGE_LINKS_XPATH = '//*[contains(@class, "dmmjobcontrol_pagebrowser")]//a/@href'
+REGION_XPATH = 'string(div[@class="dmmjobcontrol_list_regio"])'
+TITLE_XPATH = "div[@class='dmmjobcontrol_list_title']"
+LINK_XPATH = "div[@class='dmmjobcontrol_list_title']/h2/a/@href"
+
+DATE_AVAILABILITY_XPATH = '//*[@id="jobdetail_crdate"]/div/text()'
+ENVIRONMENT_XPATH = '//*[@id="jobdetail_employer_description"]'
+DESCRIPTION_XPATH = '//*[@id="jobdetail_job_description"]/div/ul/li/text()'
+REQUIREMENTS_XPATH = '//*[@id="jobdetail_job_requirements"]/div/ul/li/text()'
+OFFER_XPATH = '//*[@id="jobdetail_benefits"]/div/ul/li/text()'
+INFO_XPATH = 'string(//*[@id="jobdetail_apply_information"]/div)'
+AREA_XPATH = '//*[@id="right"]/div/div'
+AREA_NAME_XPATH = 'span/text()'
+CONTACT_NAME_XPATH = '//*[@id="jobdetail_rightcolumn_contactname"]/text()'
+CONTACT_ADDRESS_XPATH = '//*[@id="jobdetail_rightcolumn_contactaddress"]/text()'
+CONTACT_PHONE_XPATH = '//*[@id="jobdetail_rightcolumn_contactphone"]/text()'
+
+
 class AmedesSpider(scrapy.Spider):
     name = 'amedes'
+    # Skip the detail pages of the jobs that did not change since they have been fetched.
+    custom_settings = {'INCREMENTAL_ENABLED': True}
 
     def __init__(self, queries, debug="1"):
         super(AmedesSpider, self).__init__(self.name)
@@ -165,33 +195,52 @@ class AmedesSpider(scrapy.Spider):
             self.queries.append(query_id_map[query])
 
     def start_requests(self):
+        # query -> highest requested listing page
+        self.last_pages = {}
+        # query -> [listing pages parsed, start time, time of the last parsed listing page]
+        self.listing_stats = {}
         for query in self.queries:
-            yield scrapy.FormRequest(url_from_query(query),
-                                     callback=self.parse,
-                                     dont_filter=True,
-                                     meta={'query': query,
-                                           'page': 1})
+            self.last_pages[query] = 1
+            self.listing_stats[query] = [0, time.time(), time.time()]
+            yield self.page_request(query, 1)
+
+    def page_request(self, query, page):
+        return scrapy.FormRequest(url_from_query(query, page),
+                                  callback=self.parse,
+                                  meta={'query': query,
+                                        'page': page})
 
     def parse(self, response):
-        job_container_xpath = "//*[@class='dmmjobcontrol_list_item']"
-        job_container_element = response.xpath(job_container_xpath)
-        for job_container in job_container_element:
-            for element in self.parse_job_container(job_container, response.meta['query']):
-                yield element
+        listing_stats = self.listing_stats[response.meta['query']]
+        listing_stats[0] += 1
+        listing_stats[2] = time.time()
 
-        for element in self.load_next_page(response):
+        for element in self.load_next_pages(response):
             yield element
 
-    def load_next_page(self, response):
-        next_page_element = response.xpath('//*[@class="dmmjobcontrol_pagebrowser_next"]')
-        if next_page_element:
-            query = response.meta['query']
-            page = response.meta['page'] + 1
-            yield scrapy.FormRequest(url_from_query(query, page),
-                                     callback=self.parse,
-                                     dont_filter=True,
-                                     meta={'query': query,
-                                           'page': page})
+        for job_container in response.xpath(JOB_CONTAINERS_XPATH):
+            for element in self.parse_job_container(job_container, response.meta['query']):
+                yield element
+
+    def load_next_pages(self, response):
+        """
+        Requests all pages the page browser links to at once, the first page links to the other pages.
+        If the page count can not be found, the pages are walked one after another with the next page link.
+        """
+        query = response.meta['query']
+        links = response.xpath(PAGE_LINKS_XPATH).extract()
+        pages = [int(page) for link in links for page in page_link_pattern.findall(link)]
+        if response.xpath(NEXT_PAGE_XPATH):
+            pages.append(response.meta['page'] + 1)
+
+        last_page = max(pages, default=0)
+        for page in range(self.last_pages[query] + 1, last_page + 1):
+            yield self.page_request(query, page)
+        self.last_pages[query] = max(self.last_pages[query], last_page)
+
+    def closed(self, reason):
+        for query, (pages, started, finished) in sorted(self.listing_stats.items()):
+            self.logger.info('Listing of %s: %d pages in %.1f s', query_id_map[query], pages, finished - started)
 
     def parse_job_container(self, job_container, query):
         job = Job()
@@ -200,17 +249,17 @@ class AmedesSpider(scrapy.Spider):
         job['website_url'] = self.website_url
         job['queries'] = [query_id_map[query]]
 
-        region = job_container.xpath('div[@class="dmmjobcontrol_list_regio"]').xpath("string()").extract_first()
+        region = job_container.xpath(REGION_XPATH).extract_first()
         if region:
             job['regions'] = region.strip()
 
-        title = job_container.xpath("div[@class='dmmjobcontrol_list_title']").xpath("string()").extract_first()
+        title = job_container.xpath(TITLE_XPATH).xpath('string()').extract_first()
         if title:
             job['title'] = title.strip()
 
-        link = job_container.xpath("div[@class='dmmjobcontrol_list_title']").xpath("h2/a/@href").extract_first()
+        link = job_container.xpath(LINK_XPATH).extract_first()
 
-        yield scrapy.Request(url=link, callback=self.parse_job_website, dont_filter=True, meta={'job': job})
+        yield scrapy.Request(url=link, callback=self.parse_job_website, meta={'job': job})
 
     def parse_job_website(self, response):
         job = response.meta['job']
@@ -228,63 +277,63 @@ class AmedesSpider(scrapy.Spider):
 
     @staticmethod
     def parse_date_availability(response, job):
-        date = response.xpath('//*[@id="jobdetail_crdate"]/div/text()').extract_first()
+        date = response.xpath(DATE_AVAILABILITY_XPATH).extract_first()
         if date:
             job['date_availability'] = date.strip()
         return job
 
     @staticmethod
     def parse_environment(response, job):
-        environment = response.xpath('//*[@id="jobdetail_employer_description"]').xpath('string()').extract_first()
+        environment = response.xpath(ENVIRONMENT_XPATH).xpath('string()').extract_first()
         if environment:
             job['environment'] = environment.strip()
         return job
 
     @staticmethod
     def parse_description(response, job):
-        description_list = response.xpath('//*[@id="jobdetail_job_description"]/div/ul/li/text()').extract()
+        description_list = response.xpath(DESCRIPTION_XPATH).extract()
         if description_list:
             job['desc'] = '- ' + '\n-'.join(description_list)
         return job
 
     @staticmethod
     def parse_requirements(response, job):
-        requirements = response.xpath('//*[@id="jobdetail_job_requirements"]/div/ul/li/text()').extract()
+        requirements = response.xpath(REQUIREMENTS_XPATH).extract()
         if requirements:
             job['requirements'] = '- ' + '\n-'.join(requirements)
         return job
 
     @staticmethod
     def parse_offer(response, job):
-        offer = response.xpath('//*[@id="jobdetail_benefits"]/div/ul/li/text()').extract()
+        offer = response.xpath(OFFER_XPATH).extract()
         if offer:
             job['offer'] = '- ' + '\n-'.join(offer)
         return job
 
     @staticmethod
     def parse_info(response, job):
-        info = response.xpath('string(//*[@id="jobdetail_apply_information"]/div)').extract_first()
+        info = response.xpath(INFO_XPATH).extract_first()
         if info:
             job['info'] = info.strip()
         return job
 
     @staticmethod
     def parse_area(response, job):
-        area = response.xpath('//*[@id="right"]/div/div')
+        area = response.xpath(AREA_XPATH)
         for i in area:
-            if i.xpath('span/text()').extract_first() == 'Kategorie':
+            if i.xpath(AREA_NAME_XPATH).extract_first() == 'Kategorie':
                 job['area'] = i.xpath('string()')
         return job
 
     @staticmethod
     def parse_contact(response, job):
-        contact_name = response.xpath('//*[@id="jobdetail_rightcolumn_contactname"]/text()').extract_first()
+        contact_name = response.xpath(CONTACT_NAME_XPATH).extract_first()
         if contact_name:
             job['contact_name'] = " ".join(contact_name.split())
-        contact_mail = response.xpath('//*[@id="jobdetail_rightcolumn_contactaddress"]/text()').extract_first()
+        contact_mail = response.xpath(CONTACT_ADDRESS_XPATH).extract_first()
         if contact_mail:
             job['contact_field'] = " ".join(contact_mail.split())
-        contact_phone = response.xpath('//*[@id="jobdetail_rightcolumn_contactphone"]/text()').extract_first()
+        contact_phone = response.xpath(CONTACT_PHONE_XPATH).extract_first()
         if contact_phone:
             job['contact_phone'] = " ".join(contact_phone.split())
         return job
@@ -18,8 +18,7 @@ class DiagnosticumSpider(scrapy.Spider):
 
     def start_requests(self):
         yield scrapy.Request(self.url,
-                             callback=self.parse,
-                             dont_filter=True)
+                             callback=self.parse)
 
     def parse(self, response):
         container_xpath = "//div[@id='accordion_ba33b4dd747ef380d858b17b6862cdb6']/child::*"
@@ -27,7 +27,7 @@ class IMDBBerlin(scrapy.Spider):
         self.debug = debug
 
     def start_requests(self):
-        yield scrapy.Request(url, dont_filter=True)
+        yield scrapy.Request(url)
 
     def parse(self, response):
         job_container_xpath = "//div[@class='ajjobs-job']"
@@ -35,7 +35,7 @@ class IMDBBerlin(scrapy.Spider):
         for job in job_container:
             link = job.xpath(".//a/@href").extract_first()
             uri = domain + link
-            yield scrapy.Request(uri, callback=self.parse_job, dont_filter=True)
+            yield scrapy.Request(uri, callback=self.parse_job)
 
     def parse_job(self, response):
         job_element = response.xpath("//div[@class='tx-aj-jobs']")
@@ -29,7 +29,7 @@ class LADRSpider(scrapy.Spider):
         self.debug = debug == "1"
 
     def start_requests(self):
-        yield scrapy.Request(url=self.data_url, callback=self.parse, dont_filter=True)
+        yield scrapy.Request(url=self.data_url, callback=self.parse)
 
     def parse(self, response):
         body = self.decode(response.text)
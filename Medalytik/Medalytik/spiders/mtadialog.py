@@ -12,6 +12,7 @@
 import scrapy
 
 from ..items import Job
+from ..sessions import SessionPool
 
 
 class MTADialogSpider(scrapy.Spider):
@@ -38,9 +39,15 @@ class MTADialogSpider(scrapy.Spider):
     If that returns true, the next page can be called by sending a request with the 'next_url'
     Just make sure to add the current cookie context.
 
+    Walking the pages of a query with 'next_url' is strictly serial, so the pages of each query are split
+    over a pool of sessions (see sessions.py). Every session searches the query on its own,
+    jumps to its start page with one of the page links of the first page and walks on with 'next_url'.
+    The number of sessions per query is set with the 'sessions' argument, 1 walks every query in a single session.
+    The pages, jobs and seconds of each query are logged and stored in the stats when the spider closes.
+
     To invoke this spider, from inside the Medalytik project run the following command.
 
-        scrapy crawl mta_dialog -a queries="YOUR_QUERIES_SEPARATED_BY_A_COMMA"
+        scrapy crawl mta_dialog -a queries="YOUR_QUERIES_SEPARATED_BY_A_COMMA" -a sessions=4
     """
     # The name of the spider, needed to be invoked.
     name: str = 'mta_dialog'
@@ -65,7 +72,7 @@ class MTADialogSpider(scrapy.Spider):
         """
         return 'https://www.mta-dialog.de/stellenmarkt.html?tx_jobs_pi1[action]=next'
 
-    def __init__(self, queries: str="", debug: str="1"):
+    def __init__(self, queries: str="", debug: str="1", sessions: str="4"):
         """
         Initialize a new spider to crawl MTA Dialog.
 
@@ -73,15 +80,17 @@ class MTADialogSpider(scrapy.Spider):
         (See docstring of spider for further information)
 
         The queries parameter, should be a string object that separates multiple queries with a comma.
-        Each query will generate its own cookie session, this way we can filter the different jobs.
+        Each query will generate its own cookie sessions, this way we can filter the different jobs.
 
         :param queries: Queries separated by a comma to be searched.
         :param debug: Should the result be stored in the debug, or release database.
+        :param sessions: The maximum number of parallel cookie sessions per query.
         """
         super(MTADialogSpider, self).__init__(self.name)
 
         self.debug = debug == "1"
         self.queries = queries.split(',')
+        self.session_pool = SessionPool(int(sessions))
 
     @staticmethod
     def query_url(query: str) -> str:
@@ -100,41 +109,118 @@ class MTADialogSpider(scrapy.Spider):
         """
         Starts the scraper.
 
-        Here we initiate all sessions.
-        One session is created for each query. The session data are stored inside the 'cookiejar' metadata.
+        Here we initiate the first session of every query. The session data are stored inside the 'cookiejar' metadata.
+        The other sessions of a query are opened once its first page has been parsed.
 
         * THIS IS A GENERATOR *
 
         :return: All session requests. They are passed to the scrapy framework to be processed.
         """
-        for i, query in enumerate(self.queries):
-            url = self.query_url(query)
-            yield scrapy.Request(url,
-                                 meta={'cookiejar': i,
-                                       'queries': [query]},
-                                 dont_filter=True)
+        for query in self.queries:
+            self.session_pool.query(query)
+            yield scrapy.Request(self.query_url(query),
+                                 meta={'cookiejar': self.session_pool.cookiejar(query, 0),
+                                       'queries': [query],
+                                       'session': 0,
+                                       'page': 1})
 
     def parse(self, response: scrapy.http.Response):
         """
         After the request has been processed by the scrapy framework, the response will be passed here.
 
-        First we yield all job items from the current response html body.
-        Afterwards if there is a next page, we request the next page
-        making sure to use the same session from the cookiejar.
+        First we yield all job items from the current response html body, that no other session of the query returned.
+        The first page of a query opens the other sessions of the query.
+        Afterwards if there is a next page and the next page is not the start page of another session,
+        we request the next page making sure to use the same session from the cookiejar.
 
         * THIS IS A GENERATOR *
 
         :param response: The response of the scrapy request.
         """
-        for job in self.parse_jobs(response):
-            yield job
-
-        if self.has_next_page(response):
+        query = response.meta['queries'][0]
+        session = response.meta.get('session', 0)
+        page = response.meta.get('page', 1)
+
+        elements = list(self.parse_jobs(response))
+        urls = [self.element_job(element)['url'] for element in elements]
+
+        if session == 0 and page == 1:
+            page_links = self.page_links(response)
+            for other_session, start in self.session_pool.assign(query, urls, page_links):
+                yield scrapy.Request(self.query_url(query),
+                                     callback=self.parse_seed,
+                                     meta={'cookiejar': self.session_pool.cookiejar(query, other_session),
+                                           'queries': response.meta['queries'],
+                                           'session': other_session,
+                                           'page': start,
+                                           'page_url': page_links[start]})
+        elif page == self.session_pool.query(query).starts[session] \
+                and not self.session_pool.confirm(query, session, urls):
+            # The site ignored the jump, the previous session walks on.
+            return
+
+        new_urls = set(self.session_pool.add_page(query, urls))
+        for element, url in zip(elements, urls):
+            if url in new_urls:
+                yield element
+
+        end = self.session_pool.end(query, session)
+        if self.has_next_page(response) and (end is None or page + 1 < end):
             yield scrapy.Request(self.next_url,
                                  meta={'cookiejar': response.meta['cookiejar'],
-                                       'queries': response.meta['queries']},
+                                       'queries': response.meta['queries'],
+                                       'session': session,
+                                       'page': page + 1},
+                                 # The next page url is the same for every page, the page is kept in the session.
                                  dont_filter=True)
 
+    def parse_seed(self, response: scrapy.http.Response):
+        """
+        The search of a new session has been stored in its cookiejar, jump to the start page of the session.
+
+        * THIS IS A GENERATOR *
+
+        :param response: The response of the search request.
+        """
+        yield scrapy.Request(response.meta['page_url'],
+                             meta={'cookiejar': response.meta['cookiejar'],
+                                   'queries': response.meta['queries'],
+                                   'session': response.meta['session'],
+                                   'page': response.meta['page']})
+
+    def closed(self, reason):
+        """Logs the throughput of every query."""
+        for query, (pages, jobs, seconds) in sorted(self.session_pool.stats().items()):
+            self.logger.info('Query %s: %d pages, %d jobs in %.1f s with up to %d sessions',
+                             query, pages, jobs, seconds, self.session_pool.size)
+            crawler = getattr(self, 'crawler', None)
+            if crawler is not None:
+                crawler.stats.set_value('sessions/%s/pages' % query, pages)
+                crawler.stats.set_value('sessions/%s/jobs' % query, jobs)
+                crawler.stats.set_value('sessions/%s/pages_per_second' % query, pages / seconds if seconds else 0)
+
+    @staticmethod
+    def element_job(element) -> Job:
+        """:return: The job of an element returned by 'parse_jobs', a job or the request of its details."""
+        if isinstance(element, scrapy.Request):
+            return element.meta['job']
+        return element
+
+    @staticmethod
+    def page_links(response: scrapy.http.Response) -> dict:
+        """
+        Finds the links of the pagination that lead directly to a page, the links showing a page number.
+
+        :param response: The response of the scrapy request.
+        :return: A dict of page number -> absolute url.
+        """
+        page_links = {}
+        for link in response.xpath('//a[contains(@href, "tx_jobs_pi1")]'):
+            text = link.xpath('normalize-space(string())').extract_first()
+            if text.isdigit():
+                page_links[int(text)] = response.urljoin(link.xpath('@href').extract_first())
+        return page_links
+
     @staticmethod
     def has_next_page(response: scrapy.http.Response):
         """
@@ -222,8 +308,7 @@ class MTADialogSpider(scrapy.Spider):
         :return: The fully filled job item.
         """
         if job['organization'].casefold() == "ORGENTEC Diagnostika GmbH".casefold():
-            yield scrapy.Request(job['url'], callback=MTADialogSpider.parse_orgentec, meta={'job': job},
-                                 dont_filter=True)
+            yield scrapy.Request(job['url'], callback=MTADialogSpider.parse_orgentec, meta={'job': job})
         else:
             yield job
 
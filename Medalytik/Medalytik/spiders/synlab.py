@@ -15,31 +15,42 @@ import scrapy.shell
 
 from ..items import Job
 
+# The panels of the job ad, each with a heading and a body.
+SECTIONS_XPATH = '//div[@id="jobad"]//div[@class="col-sm-12"]'
+SECTION_HEADING_XPATH = 'string(.//div[@class="panel-heading"])'
+SECTION_BODY_XPATH = 'string(.//div[@class="panel-body"])'
+
 
 class SynlabSpider(scrapy.Spider):
     name = "synlab"
+    # Skip the detail pages of the jobs that did not change since they have been fetched.
+    custom_settings = {'INCREMENTAL_ENABLED': True}
 
     url = "https://api-synlab.beesite.de/search/"
     website_name = "Synlab"
     website_url = "https://www.karriere-synlab.de"
 
-    MAX_RESPONSE_SIZE = 2147483647
+    # Number of jobs requested per page of the search.
+    PAGE_SIZE = 100
 
-    def __init__(self, queries="", debug="1"):
+    def __init__(self, queries="", debug="1", page_size=str(PAGE_SIZE)):
         super(SynlabSpider, self).__init__(self.name)
 
         self.queries = queries.split(',')
         self.debug = debug == "1"
+        self.page_size = int(page_size)
 
-    def url_from(self, query):
+    def url_from(self, query, first_item=1):
         """
         Creates a request url with the form data integrated.
         :param query: The job areas to search.
+        :param first_item: The position of the first job of the page, starting at 1.
         :return: The generated url with integrated form data.
         """
         url = self.url \
               + "?data={" \
-              + "\"SearchParameters\":{\"FirstItem\":1,\"CountItem\":" + str(self.MAX_RESPONSE_SIZE) + "}," \
+              + "\"SearchParameters\":{\"FirstItem\":" + str(first_item) \
+              + ",\"CountItem\":" + str(self.page_size) + "}," \
               + "\"SearchCriteria\":["
 
         if query is not None:
@@ -49,21 +60,41 @@ class SynlabSpider(scrapy.Spider):
         url += "]}"
         return url
 
+    def page_request(self, query, first_item):
+        return scrapy.Request(url=self.url_from(query, first_item),
+                              callback=self.parse,
+                              meta={'query': query, 'first_item': first_item}
+                              )
+
     def start_requests(self):
         for query in self.queries:
-            yield scrapy.Request(url=self.url_from(query),
-                                 callback=self.parse,
-                                 dont_filter=True,
-                                 meta={'query': query}
-                                 )
+            yield self.page_request(query, 1)
 
     def parse(self, response):
-        json_response = json.loads(response.body_as_unicode())
-        response_items = json_response['SearchResult']['SearchResultItems']
+        """
+        Parses one page of the search.
+        The first page requests all other pages at once, so they are downloaded concurrently
+        and a failed page is retried on its own.
+        """
+        json_response = json.loads(response.text)
+        search_result = json_response['SearchResult']
+        response_items = search_result['SearchResultItems']
+        query = response.meta['query']
+        first_item = response.meta.get('first_item', 1)
+
+        total = search_result.get('SearchResultCountAll')
+        if total is not None:
+            if first_item == 1:
+                for next_item in range(1 + self.page_size, total + 1, self.page_size):
+                    yield self.page_request(query, next_item)
+        elif len(response_items) == self.page_size:
+            # Without the total count the pages are requested one after another until a page is not full.
+            yield self.page_request(query, first_item + self.page_size)
+
         for response_item in response_items:
             job = self.init_job_item()
             response_item = response_item['MatchedObjectDescriptor']
-            job['queries'] = [response.meta['query']]
+            job['queries'] = [query]
             for element in self.parse_job(response_item, job):
                 yield element
 
@@ -90,7 +121,6 @@ class SynlabSpider(scrapy.Spider):
 
         yield scrapy.Request(job['url'],
                              callback=self.parse_job_uri,
-                             dont_filter=True,
                              meta={'job': job}
                              )
 
@@ -99,10 +129,12 @@ class SynlabSpider(scrapy.Spider):
 
         job = self.parse_base_info(response, job)
         job = self.parse_environment(response, job)
-        job = self.parse_description(response, job)
-        job = self.parse_requirements(response, job)
-        job = self.parse_offer(response, job)
-        job = self.parse_contact(response, job)
+
+        sections = self.section_map(response)
+        job = self.parse_description(sections, job)
+        job = self.parse_requirements(sections, job)
+        job = self.parse_offer(sections, job)
+        job = self.parse_contact(sections, job)
 
         yield job
 
@@ -128,61 +160,62 @@ class SynlabSpider(scrapy.Spider):
         return job
 
     @staticmethod
-    def job_divisions(response):
-        return response.xpath('//div[@id="jobad"]//div[@class="col-sm-12"]')
-
-    @staticmethod
-    def get_division(response, name):
-        divisions = SynlabSpider.job_divisions(response)
-        for division in divisions:
-            path = division.xpath('string(.//div[@class="panel-heading"])')
-            title = path.extract_first().strip().rstrip(':')
-            if title.casefold() == name.casefold():
-                return division
+    def section_map(response):
+        """
+        Walks the panels of the job ad once.
+        :return: A dict of the case folded panel headings to the text of their bodies.
+        """
+        sections = {}
+        for division in response.xpath(SECTIONS_XPATH):
+            title = division.xpath(SECTION_HEADING_XPATH).extract_first().strip().rstrip(':')
+            # The first panel with a heading wins, like the lookup of the headings did before.
+            if title.casefold() not in sections:
+                sections[title.casefold()] = division.xpath(SECTION_BODY_XPATH).extract_first()
+        return sections
 
     @staticmethod
-    def get_division_from_names(response, names):
+    def get_section(sections, names):
+        """:return: The body text of the first panel with one of the headings or None."""
         for name in names:
-            division = SynlabSpider.get_division(response, name)
-            if division is not None:
-                return division
+            text = sections.get(name.casefold())
+            if text is not None:
+                return text
 
     @staticmethod
-    def parse_description(response, job):
-        division = SynlabSpider.get_division_from_names(response, [
+    def parse_description(sections, job):
+        text = SynlabSpider.get_section(sections, [
             "Das sind Ihre Aufgaben"
         ])
-        if division is not None:
-            job['desc'] = division.xpath('string(.//div[@class="panel-body"])').extract_first().strip()
+        if text is not None:
+            job['desc'] = text.strip()
         return job
 
     @staticmethod
-    def parse_requirements(response, job):
-        division = SynlabSpider.get_division_from_names(response, [
+    def parse_requirements(sections, job):
+        text = SynlabSpider.get_section(sections, [
             "Das bringen Sie mit"
         ])
-        if division is not None:
-            job['requirements'] = division.xpath('string(.//div[@class="panel-body"])').extract_first().strip()
+        if text is not None:
+            job['requirements'] = text.strip()
         return job
 
     @staticmethod
-    def parse_offer(response, job):
-        division = SynlabSpider.get_division_from_names(response, [
+    def parse_offer(sections, job):
+        text = SynlabSpider.get_section(sections, [
             "Das können Sie von uns erwarten"
         ])
-        if division is not None:
-            job['offer'] = division.xpath('string(.//div[@class="panel-body"])').extract_first().strip()
+        if text is not None:
+            job['offer'] = text.strip()
         return job
 
     @staticmethod
-    def parse_contact(response, job):
-        division = SynlabSpider.get_division_from_names(response, [
+    def parse_contact(sections, job):
+        text = SynlabSpider.get_section(sections, [
             "Kontakt & Bewerbung"
         ])
-        if division is None:
+        if text is None:
             return job
 
-        text = division.xpath('string(.//div[@class="panel-body"])').extract_first()
         split_text = text.split()
         for i, word in enumerate(split_text):
             if (word == "Herr" or word == "Frau") and i < len(split_text - 1):
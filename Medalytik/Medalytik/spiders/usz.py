@@ -13,6 +13,7 @@ import re
 import scrapy
 
 from ..items import Job
+from ..prefetch import PagePrefetcher
 from . import error_back
 
 query_id_map = {
@@ -115,9 +116,44 @@ id_query_name_map = {
     "1140546": "Technischer Dienst"
 }
 
+JOB_CONTAINERS_XPATH = '//*[@id="itemlist"]/div[1]/div'
+NEXT_PAGE_XPATH = '//*[@id="btn-forward"]'
+CLASS_XPATH = '@class'
+TITLE_XPATH = 'div[1]/a/text()'
+GROUP_XPATH = 'div[2]/a/text()'
+AREA_XPATH = 'div[3]/a/text()'
+SUMMARY_XPATH = 'a/div/text()'
+LINK_XPATH = 'div[1]/a/@href'
+
+DATE_AVAILABILITY_XPATH = '//*[@id="vereinbarung"]/text()'
+DESCRIPTION_XPATH = '//*[@id="job-description"]/div/div[1]'
+LIST_ITEMS_XPATH = 'ul/li'
+DESCRIPTION_LINES_XPATH = ("//div[@class='group']/div[@class='span_1_of_2']/text() | "
+                           "//div[@class='group']/div[@class='span_1_of_2']/br")
+REQUIREMENTS_XPATH = "//div[@class='group']/div[@class='span_2_of_2']"
+REQUIREMENTS_LINES_XPATH = ("//div[@class='group']/div[@class='span_2_of_2']/text() | "
+                            "//div[@class='group']/div[@class='span_2_of_2']/br")
+CONTACT_XPATH = '//*[@id="contact-box"]//div[@class="contact_span_2_of_2"]/text()'
+MAIN_INFO_XPATH = '//*[@id="contact-box"]/div[1]/text()'
+CONTACT_LINES_XPATH = "//div[@class='contact_span_2_of_2']/text()"
+MAIL_XPATH = "//div[@id='phone-box']/a[@title='E-Mail']/text()"
+PHONE_XPATH = "//div[@id='phone-box']/img[@class='icon-phone']/.."
+OFFER_XPATH = '//*[@id="angebot"]/text()'
+ENVIRONMENT_XPATH = '//div[@id="ueber-usz"]/text()'
+BENEFITS_XPATH = '//div[@class="benefit-text"]'
+
 
 class USZSpider(scrapy.Spider):
     name = 'usz'
+    custom_settings = {
+        # Skip the detail pages of the jobs that did not change since they have been fetched.
+        'INCREMENTAL_ENABLED': True,
+        # The listing pages are paginated POST requests, caching them would hide new jobs.
+        'HTTPCACHE_RULES': [('POST', r'^https?://jobs\.usz\.ch', None)],
+    }
+
+    # Number of jobs per listing page.
+    PAGE_SIZE = 10
 
     def __init__(self, queries, debug="1"):
         super(USZSpider, self).__init__(self.name)
@@ -137,48 +173,58 @@ class USZSpider(scrapy.Spider):
             self.queries.append(query_id_map[query.strip()])
 
     def start_requests(self):
+        # The listing pages of every query are prefetched concurrently, the number of pages is not known up front.
+        self.prefetcher = PagePrefetcher.from_spider(self)
         for query in self.queries:
-            yield scrapy.FormRequest(self.url,
-                                     callback=self.parse,
-                                     errback=error_back,
-                                     formdata={'filter_10': query},
-                                     dont_filter=True,
-                                     meta={'query': query, 'offset': 0})
+            yield self.page_request(query, self.prefetcher.start(query))
+
+    def page_request(self, query, page):
+        offset = page * self.PAGE_SIZE
+        formdata = {'filter_10': query}
+        if offset:
+            formdata['offset'] = str(offset)
+        return scrapy.FormRequest(self.url,
+                                  callback=self.parse,
+                                  errback=error_back,
+                                  formdata=formdata,
+                                  meta={'query': query, 'offset': offset})
 
     def parse(self, response):
-        job_container_xpath = '//*[@id="itemlist"]/div[1]/div'
-        job_container_element = response.xpath(job_container_xpath)
-        for job_container in job_container_element:
-            for element in self.parse_job_container(job_container, response.meta['query']):
-                yield element
+        query = response.meta['query']
+        page = response.meta['offset'] // self.PAGE_SIZE
+        if self.prefetcher.is_beyond_end(query, page):
+            return
 
-        for element in self.load_next_page(response):
-            yield element
+        job_containers = response.xpath(JOB_CONTAINERS_XPATH)
+        if not job_containers:
+            self.prefetcher.end(query, page)
+            return
+        if not self.has_next_page(response):
+            self.prefetcher.end(query, page + 1)
+
+        for next_page in self.prefetcher.advance(query, page):
+            yield self.page_request(query, next_page)
 
-    def load_next_page(self, response):
+        for job_container in job_containers:
+            for element in self.parse_job_container(job_container, query):
+                yield element
+
+    @staticmethod
+    def has_next_page(response):
         # Check if there is a next website. The btn-forward's class is 'disableClick' if it's the last page.
-        next_page_element = response.xpath('//*[@id="btn-forward"]')
+        next_page_element = response.xpath(NEXT_PAGE_XPATH)
         try:
             first_next_page_element = next_page_element[0]
-            next_page_class_element = first_next_page_element.xpath('@class')
+            next_page_class_element = first_next_page_element.xpath(CLASS_XPATH)
             next_page_class = next_page_class_element[0].extract()
-
-            # Load the next page if the next page button is active.
-            if next_page_class != 'disableClick':
-                offset = response.meta['offset'] + 10
-                yield scrapy.FormRequest(self.url,
-                                         formdata={'filter_10': response.meta['query'],
-                                                   'offset': offset,
-                                                   },
-                                         meta={'query': response.meta['query'], 'offset': offset},
-                                         callback=self.parse,
-                                         dont_filter=True,
-                                         errback=error_back
-                                         )
-
         except IndexError:
             # In case the extraction of the next page button fails, we assume there is no next page.
-            return
+            return False
+        return next_page_class != 'disableClick'
+
+    def closed(self, reason):
+        self.logger.info('Requested %d listing pages, %d of them beyond the last page',
+                         self.prefetcher.requested, self.prefetcher.wasted)
 
     def parse_job_container(self, job_container, query):
         job = Job()
@@ -189,30 +235,30 @@ class USZSpider(scrapy.Spider):
         job['regions'] = self.regions
 
         # Make a null check before stripping the string, to prevent strip on none, type errors.
-        title_container = job_container.xpath('div[1]/a/text()').extract_first()
+        title_container = job_container.xpath(TITLE_XPATH).extract_first()
         if title_container:
             job['title'] = title_container.strip()
 
-        group_container = job_container.xpath('div[2]/a/text()').extract_first()
+        group_container = job_container.xpath(GROUP_XPATH).extract_first()
         if group_container:
             group_container = group_container.strip()
             if group_container.startswith("Berufsgruppe:"):
                 group_container = group_container[13:]
             job['group'] = group_container.strip()
 
-        area_container = job_container.xpath('div[3]/a/text()').extract_first()
+        area_container = job_container.xpath(AREA_XPATH).extract_first()
         if area_container:
             area_container = area_container.strip()
             if area_container.startswith("Bereich:"):
                 area_container = area_container[8:]
             job['area'] = area_container.strip()
 
-        summary_container = job_container.xpath('a/div/text()').extract_first()
+        summary_container = job_container.xpath(SUMMARY_XPATH).extract_first()
         if summary_container:
             job['summary'] = summary_container.strip()
 
-        link = job_container.xpath('div[1]/a/@href').extract_first()
-        yield scrapy.Request(url=link, callback=self.parse_job_website, dont_filter=True, meta={'job': job})
+        link = job_container.xpath(LINK_XPATH).extract_first()
+        yield scrapy.Request(url=link, callback=self.parse_job_website, meta={'job': job})
 
     def parse_job_website(self, response):
         job = response.meta['job']
@@ -230,15 +276,15 @@ class USZSpider(scrapy.Spider):
 
     @staticmethod
     def parse_date_availability(response, job):
-        date_availability = response.xpath('//*[@id="vereinbarung"]/text()').extract_first()
+        date_availability = response.xpath(DATE_AVAILABILITY_XPATH).extract_first()
         if date_availability:
             job['date_availability'] = date_availability.strip()
         return job
 
     @staticmethod
     def parse_description(response, job):
-        description_content = response.xpath('//*[@id="job-description"]/div/div[1]')
-        description_list = description_content.xpath('ul/li')
+        description_content = response.xpath(DESCRIPTION_XPATH)
+        description_list = description_content.xpath(LIST_ITEMS_XPATH)
         description = ''
         if len(description_list):
             for description_element in description_list:
@@ -247,8 +293,7 @@ class USZSpider(scrapy.Spider):
                     description += '\n- '
                     description += extracted_text.strip()
         else:
-            description_list = response.xpath("//div[@class='group']/div[@class='span_1_of_2']/text() | "
-                                              "//div[@class='group']/div[@class='span_1_of_2']/br")
+            description_list = response.xpath(DESCRIPTION_LINES_XPATH)
             for item in description_list:
                 if type(item.root) is str:
                     description += item.root
@@ -260,16 +305,15 @@ class USZSpider(scrapy.Spider):
 
     @staticmethod
     def parse_requirements(response, job):
-        requirements_content = response.xpath("//div[@class='group']/div[@class='span_2_of_2']")
-        requirements_list = requirements_content.xpath("ul/li")
+        requirements_content = response.xpath(REQUIREMENTS_XPATH)
+        requirements_list = requirements_content.xpath(LIST_ITEMS_XPATH)
         requirements = ""
         if len(requirements_list) > 0:
             for i in requirements_list:
                 requirements += "\n- "
-                requirements += i.xpath("string()").extract_first()
+                requirements += i.xpath('string()').extract_first()
         else:
-            requirements_list = response.xpath("//div[@class='group']/div[@class='span_2_of_2']/text() | "
-                                               "//div[@class='group']/div[@class='span_2_of_2']/br")
+            requirements_list = response.xpath(REQUIREMENTS_LINES_XPATH)
             for item in requirements_list:
                 if type(item.root) is str:
                     requirements += item.root
@@ -286,7 +330,7 @@ class USZSpider(scrapy.Spider):
 
     @staticmethod
     def parse_contact_name(response, job):
-        contact_list = response.xpath('//*[@id="contact-box"]//div[@class="contact_span_2_of_2"]/text()')
+        contact_list = response.xpath(CONTACT_XPATH)
         if len(contact_list) == 3:
             contact = contact_list[0].extract()
             field = contact_list[1].extract()
@@ -320,7 +364,7 @@ class USZSpider(scrapy.Spider):
 
     @staticmethod
     def parse_main_info(response, job):
-        info = response.xpath('//*[@id="contact-box"]/div[1]/text()')[1].extract()
+        info = response.xpath(MAIN_INFO_XPATH)[1].extract()
         if info:
             job['info'] = info.strip()
         return job
@@ -328,7 +372,7 @@ class USZSpider(scrapy.Spider):
     @staticmethod
     def parse_info_mail(response, job):
         replaced_body = response.replace(body=response.body.replace(b'<br>', b'\n'))
-        contact_list = replaced_body.xpath("//div[@class='contact_span_2_of_2']/text()")
+        contact_list = replaced_body.xpath(CONTACT_LINES_XPATH)
         contact = ""
         for i in contact_list:
             if type(i.root) is str:
@@ -337,7 +381,7 @@ class USZSpider(scrapy.Spider):
                 contact += "\n"
         email = next(iter(re.findall(r"[\w.-]+@[\w.-]+", contact.strip())), None)
         if email is None:
-            email = response.xpath("//div[@id='phone-box']/a[@title='E-Mail']/text()").extract_first()
+            email = response.xpath(MAIL_XPATH).extract_first()
 
         if email is not None:
             email = email.strip()
@@ -346,8 +390,7 @@ class USZSpider(scrapy.Spider):
 
     @staticmethod
     def parse_phone(response, job):
-        phone = response.xpath("//div[@id='phone-box']/img[@class='icon-phone']") \
-            .xpath('..').xpath('string()').extract_first()
+        phone = response.xpath(PHONE_XPATH).xpath('string()').extract_first()
         if phone is not None:
             phone = phone.strip()
         job['info_phone'] = phone
@@ -355,21 +398,21 @@ class USZSpider(scrapy.Spider):
 
     @staticmethod
     def parse_offer(response, job):
-        offer = response.xpath('//*[@id="angebot"]/text()')[1].extract()
+        offer = response.xpath(OFFER_XPATH)[1].extract()
         if offer:
             job['offer'] = offer.strip()
         return job
 
     @staticmethod
     def parse_environment(response, job):
-        environment = response.xpath('//div[@id="ueber-usz"]/text()')[1].extract()
+        environment = response.xpath(ENVIRONMENT_XPATH)[1].extract()
         if environment:
             job['environment'] = environment.strip()
         return job
 
     @staticmethod
     def parse_benefits(response, job):
-        benefits_list = response.xpath('//div[@class="benefit-text"]')
+        benefits_list = response.xpath(BENEFITS_XPATH)
         benefits = []
         for benefit_container in benefits_list:
             benefit = benefit_container.xpath('text()').extract()
@@ -18,6 +18,8 @@ from ..items import Job
 class WisplinghoffSpider(scrapy.Spider):
 
     name = "wisplinghoff"
+    # Skip the detail pages of the jobs that did not change since they have been fetched.
+    custom_settings = {'INCREMENTAL_ENABLED': True}
     website_name = "Wisplinghoff"
     website_url = "https://www.wisplinghoff.de/das-labor/job-karriere/"
     domain = "https://www.wisplinghoff.de/"
@@ -27,7 +29,7 @@ class WisplinghoffSpider(scrapy.Spider):
         self.debug = debug == "1"
 
     def start_requests(self):
-        yield scrapy.Request(url=self.website_url, callback=self.parse, dont_filter=True)
+        yield scrapy.Request(url=self.website_url, callback=self.parse)
 
     def parse(self, response):
         jobs = response.xpath("//article[@class='news-item']")
@@ -61,7 +63,7 @@ class WisplinghoffSpider(scrapy.Spider):
         if isinstance(link, str):
             link = link.strip()
             job['url'] = link
-            yield scrapy.Request(url=link, callback=self.parse_article, dont_filter=True, meta={"job": job})
+            yield scrapy.Request(url=link, callback=self.parse_article, meta={"job": job})
 
     def parse_article(self, response):
         job = response.meta['job']
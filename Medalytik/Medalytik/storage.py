@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+#
+#  storage.py
+#  Medalytik
+#
+#  The storage backends of the MongoDBPipeline.
+#
+#  The pipeline normalizes every job into the Websites, Regions, Queries, Contacts and Jobs collections.
+#  Where these collections live is up to the backend:
+#      - MongoBackend stores them in a Mongo server, this is the default.
+#      - EmbeddedBackend keeps them in memory with mongomock, so a crawl can be run,
+#        profiled and regression tested without any service running.
+#
+#  The backend is chosen with the STORAGE_BACKEND setting.
+#
+#  SQLiteStore is the base of the stores kept in SQLite files, like the geocode cache and the known jobs index.
+#
+
+from abc import ABC, abstractmethod
+import os
+import sqlite3
+import threading
+
+from bson import json_util
+from scrapy.utils.project import data_path
+
+from .clients import acquire_client, release_client
+
+
+def sqlite_path(path):
+    """
+    Resolves the path of a SQLite file inside the project data directory and creates its directory.
+    'data_path(path, createdir=True)' can not be used, it creates a directory at the path of the file itself.
+    :return: The absolute path of the file, ':memory:' is returned as is.
+    """
+    if path == ':memory:':
+        return path
+    path = data_path(path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return path
+
+
+class SQLiteStore(object):
+    """
+    Base of the stores kept in a single table of a SQLite file.
+    Pass ':memory:' as path to keep the store for the current process only.
+    Subclasses set the TABLE and its COLUMNS, the table is created when the file is opened.
+    """
+
+    TABLE = None
+    # The column definitions and constraints of the table.
+    COLUMNS = None
+    # Number of writes after which the changes are committed.
+    COMMIT_INTERVAL = 100
+
+    def __init__(self, path):
+        self.open(path)
+
+    def open(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS %s (%s)' % (self.TABLE, self.COLUMNS))
+        self.connection.commit()
+        self._uncommitted = 0
+
+    def close(self):
+        self.connection.commit()
+        self.connection.close()
+
+    def __len__(self):
+        return self.connection.execute('SELECT COUNT(*) FROM %s' % self.TABLE).fetchone()[0]
+
+    def commit(self):
+        self.connection.commit()
+        self._uncommitted = 0
+
+    def written(self):
+        """Counts a write, the changes are committed every COMMIT_INTERVAL writes."""
+        self._uncommitted += 1
+        if self._uncommitted >= self.COMMIT_INTERVAL:
+            self.commit()
+
+
+class StorageBackend(ABC):
+    """
+    Opens the databases the pipeline writes to.
+    The returned databases have to provide the pymongo database interface,
+    the pipeline normalizes the jobs into their collections with it.
+    """
+
+    @classmethod
+    def from_settings(cls, settings):
+        return cls()
+
+    @abstractmethod
+    def open_database(self, uri, name):
+        """:return: The database 'name' at 'uri'."""
+
+    def close_database(self, uri, name):
+        """Called once the pipeline is done with a database returned by 'open_database'."""
+        pass
+
+
+class MongoBackend(StorageBackend):
+    """Stores the documents in a Mongo server. The clients are shared by all spiders of the process."""
+
+    def __init__(self, max_pool_size=100):
+        self.max_pool_size = max_pool_size
+
+    @classmethod
+    def from_settings(cls, settings):
+        return cls(max_pool_size=settings.getint('MONGO_MAX_POOL_SIZE', 100))
+
+    def open_database(self, uri, name):
+        return acquire_client(uri, self.max_pool_size)[name]
+
+    def close_database(self, uri, name):
+        release_client(uri)
+
+
+class EmbeddedBackend(StorageBackend):
+    """
+    Stores the documents in memory with mongomock, no Mongo server is needed.
+
+    All spiders of the process share the same databases, the uri is ignored.
+    The databases are kept until the process ends, so they can be inspected after a crawl.
+    If a path is set, every database is loaded from '<path>/<name>.json' when opened
+    and written back when the last spider using it closes, so consecutive crawls build upon each other.
+    """
+
+    # database name -> [database, reference count]
+    _databases = {}
+    _client = None
+    _lock = threading.Lock()
+
+    def __init__(self, path=None):
+        self.path = path
+
+    @classmethod
+    def from_settings(cls, settings):
+        return cls(path=settings.get('STORAGE_EMBEDDED_PATH'))
+
+    def open_database(self, uri, name):
+        with self._lock:
+            entry = self._databases.get(name)
+            if entry is None:
+                if EmbeddedBackend._client is None:
+                    # Imported here so mongomock is only needed when the embedded backend is used.
+                    import mongomock
+                    EmbeddedBackend._client = mongomock.MongoClient()
+                entry = [EmbeddedBackend._client[name], 0]
+                self._databases[name] = entry
+                self.load(entry[0])
+            entry[1] += 1
+            return entry[0]
+
+    def close_database(self, uri, name):
+        with self._lock:
+            entry = self._databases.get(name)
+            if entry is None:
+                return
+            entry[1] -= 1
+            if entry[1] <= 0:
+                del self._databases[name]
+                self.dump(entry[0])
+
+    def file_path(self, db):
+        return os.path.join(self.path, db.name + '.json')
+
+    def load(self, db):
+        if not self.path or not os.path.exists(self.file_path(db)):
+            return
+        with open(self.file_path(db)) as file:
+            collections = json_util.loads(file.read())
+        for collection_name, documents in collections.items():
+            db[collection_name].delete_many({})
+            if documents:
+                db[collection_name].insert_many(documents)
+
+    def dump(self, db):
+        if not self.path:
+            return
+        os.makedirs(self.path, exist_ok=True)
+        collections = {}
+        for collection_name in db.list_collection_names():
+            collections[collection_name] = list(db[collection_name].find())
+        with open(self.file_path(db), 'w') as file:
+            file.write(json_util.dumps(collections))
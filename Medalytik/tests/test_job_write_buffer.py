@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+#
+#  test_job_write_buffer.py
+#  Medalytik
+#
+#  The bulk writes of the JobWriteBuffer against mongomock.
+#
+
+import mongomock
+from pymongo.errors import AutoReconnect
+import pytest
+
+from Medalytik.pipelines import JobWriteBuffer, StoredJob
+
+
+class FailingCollection(object):
+    """A collection whose first bulk write fails."""
+
+    def __init__(self, collection):
+        self.collection = collection
+        self.failures = 1
+
+    def bulk_write(self, requests, ordered=True):
+        if self.failures:
+            self.failures -= 1
+            raise AutoReconnect('connection lost')
+        return self.collection.bulk_write(requests, ordered=ordered)
+
+    def __getattr__(self, name):
+        return getattr(self.collection, name)
+
+
+def test_failed_flush_keeps_the_jobs():
+    collection = mongomock.MongoClient().db.Jobs
+    buffer = JobWriteBuffer(FailingCollection(collection), size=10, interval=5)
+    stored_job = StoredJob(None, ['query'])
+    buffer.add('website', 'Nurse', {'website_id': 'website', 'title': 'Nurse', 'content_hash': 'a'}, stored_job)
+
+    with pytest.raises(AutoReconnect):
+        buffer.flush()
+    assert len(buffer) == 1
+    assert collection.count_documents({}) == 0
+
+    buffer.flush()
+    assert len(buffer) == 0
+    assert stored_job._id == collection.find_one({'title': 'Nurse'})['_id']
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+#
+#  test_motor_pipeline.py
+#  Medalytik
+#
+#  Runs the MotorMongoDBPipeline against a fake Motor client, an asyncio facade over mongomock.
+#
+
+import asyncio
+
+import mongomock
+from scrapy.utils.test import get_crawler
+from twisted.internet import defer
+
+from Medalytik import motor_pipeline
+from Medalytik.geocoding import GeocodeCache, GeocodeResult, StaticResolver
+from Medalytik.items import Job
+from Medalytik.motor_pipeline import MotorMongoDBPipeline
+
+
+class FakeCursor(object):
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    async def to_list(self, length):
+        return list(self.cursor)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self.cursor)
+        except StopIteration:
+            raise StopAsyncIteration
+
+
+class FakeCollection(object):
+
+    def __init__(self, collection):
+        self.delegate = collection
+        self.name = collection.name
+
+    def find(self, *args, **kwargs):
+        return FakeCursor(self.delegate.find(*args, **kwargs))
+
+    def __getattr__(self, name):
+        method = getattr(self.delegate, name)
+
+        async def call(*args, **kwargs):
+            return method(*args, **kwargs)
+        return call
+
+
+class FakeDatabase(object):
+
+    def __init__(self, database):
+        self.delegate = database
+
+    def __getitem__(self, name):
+        return FakeCollection(self.delegate[name])
+
+    def __getattr__(self, name):
+        return self[name]
+
+
+class FakeMotorClient(object):
+    """Stands in for AsyncIOMotorClient, every client has its own mongomock databases."""
+
+    def __init__(self, uri, maxPoolSize=100):
+        self.delegate = mongomock.MongoClient()
+
+    def __getitem__(self, name):
+        return FakeDatabase(self.delegate[name])
+
+    def close(self):
+        pass
+
+
+def job(title, query, region='Zürich'):
+    item = Job()
+    item['website_name'] = 'Website'
+    item['website_url'] = 'https://example.com'
+    item['title'] = title
+    item['regions'] = region
+    item['queries'] = [query]
+    item['contact_name'] = 'Contact'
+    item['desc'] = 'Description of %s' % title
+    return item
+
+
+def pipeline():
+    cache = GeocodeCache(':memory:', StaticResolver())
+    for region in ('Zürich', 'Bern'):
+        cache.put(region, GeocodeResult(47.0, 8.0, region, None))
+    return MotorMongoDBPipeline('mongodb://motor-test', 'mongodb://motor-test', 'Debug', 'Release', geocode_cache=cache)
+
+
+def run(coroutine):
+    return asyncio.new_event_loop().run_until_complete(coroutine)
+
+
+def test_process_item(monkeypatch):
+    monkeypatch.setattr(motor_pipeline, 'AsyncIOMotorClient', FakeMotorClient)
+    motor = pipeline()
+
+    async def crawl():
+        await motor._open_spider(None)
+        items = [job('Nurse', 'Pflege'), job('Nurse', 'Praktika'), job('Doctor', 'Medizin'),
+                 # The same job with another region, it is written to the same document.
+                 job('Doctor', 'Forschung', region='Bern')]
+        results = await asyncio.gather(*[motor.process_item(item, None) for item in items])
+        db = motor.release_db.delegate
+        await motor._close_spider(None)
+        return items, results, db
+
+    items, results, db = run(crawl())
+
+    assert results == items
+    assert motor.job_locks == {}
+    assert db.Jobs.count_documents({}) == 2
+    nurse = db.Jobs.find_one({'title': 'Nurse'})
+    queries = {query['_id']: query['name'] for query in db.Queries.find()}
+    assert sorted(queries[_id] for _id in nurse['query_ids']) == ['Pflege', 'Praktika']
+    assert db.Jobs.count_documents({'active': True}) == 2
+
+
+def test_process_item_counts_writes(monkeypatch):
+    monkeypatch.setattr(motor_pipeline, 'AsyncIOMotorClient', FakeMotorClient)
+    motor = pipeline()
+    counts = {}
+    motor.count_job_write = lambda kind: counts.__setitem__(kind, counts.get(kind, 0) + 1)
+
+    async def crawl():
+        await motor._open_spider(None)
+        await motor.process_item(job('Nurse', 'Pflege'), None)
+        motor.stored_release_items = type(motor.stored_release_items)()
+        changed = job('Nurse', 'Pflege')
+        changed['desc'] = 'Another description'
+        await motor.process_item(changed, None)
+        await motor._close_spider(None)
+
+    run(crawl())
+
+    assert counts == {'inserted': 1, 'changed': 1}
+
+
+def test_failed_region_fill_is_counted(monkeypatch):
+    monkeypatch.setattr(motor_pipeline, 'AsyncIOMotorClient', FakeMotorClient)
+    motor = pipeline()
+    motor.stats = get_crawler().stats
+    motor.location = lambda region_name: defer.fail(RuntimeError('geocoder down'))
+
+    async def crawl():
+        await motor._open_spider(None)
+        item = await motor.process_item(job('Nurse', 'Pflege', region='Basel'), None)
+        await motor._close_spider(None)
+        return item
+
+    item = run(crawl())
+
+    assert item['title'] == 'Nurse'
+    assert motor.region_fills == {}
+    assert motor.stats.get_value('geocode/errors') == 1
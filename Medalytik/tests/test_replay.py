@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+#
+#  test_replay.py
+#  Medalytik
+#
+#  Replays the recorded amedes corpus in tests/corpus, one listing page and two detail pages.
+#  After a change to the parsers, regenerate the expected items with:
+#      python -m Medalytik.replay --corpus tests/corpus check amedes --update
+#
+
+import os
+
+from scrapy.settings import Settings
+
+from Medalytik.replay import Replay, compare_items
+from Medalytik.spiders.amedes import AmedesSpider
+
+CORPUS_DIR = os.path.join(os.path.dirname(__file__), 'corpus')
+
+
+def replay():
+    return Replay(AmedesSpider, CORPUS_DIR, Settings({'DETAIL_DEDUP_ENABLED': True}))
+
+
+def test_replay_follows_the_recorded_requests():
+    items, missing, stats = replay().run()
+
+    assert missing == 0
+    assert {name: callback_stats.pages for name, callback_stats in stats.items()} == {
+        'parse': 1,
+        'parse_job_website': 2,
+    }
+    assert len(items) == 2
+
+
+def test_replay_items():
+    items, missing, stats = replay().run()
+    jobs = {job['title']: job for job in items}
+
+    job = jobs['Abrechnungskraft (m/w)']
+    assert job['website_name'] == 'Amedes'
+    assert job['queries'] == ['Abrechnung']
+    assert job['regions'] == 'Hamburg'
+    assert job['date_availability'] == '01.03.2019'
+    assert job['desc'] == '- Abrechnung der Laborleistungen\n-Prüfung der Belege'
+    assert job['contact_name'] == 'Frau Anna Muster'
+    assert job['url'].endswith('/abrechnungskraft-hamburg.htm')
+
+    job = jobs['Sachbearbeiter Abrechnung (m/w)']
+    assert job['regions'] == 'Göttingen'
+    assert job['requirements'] == '- Erfahrung in der Abrechnung\n-Teamfähigkeit'
+    assert job['contact_phone'] == '0551 987'
+
+
+def test_replay_matches_the_expected_items():
+    corpus = replay()
+    items, missing, stats = corpus.run()
+
+    assert compare_items(corpus.expected_items(), items) == ([], [])